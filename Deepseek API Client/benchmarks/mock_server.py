@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+"""
+模拟 DeepSeek 服务模块
+在本机提供 /v1/chat/completions 接口，可配置首字节延迟、流式分块速率和错误注入，
+用于在不访问真实 API 的情况下测量客户端自身的开销。也可单独运行：
+
+    python3 benchmarks/mock_server.py --port 8001 --latency 0.2 --error-rate 0.1
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOCK_PATHS = ("/v1/chat/completions", "/chat/completions")
+
+
+class MockServer(ThreadingHTTPServer):
+    """模拟服务，每个连接一个线程
+
+    latency 为收到请求到开始响应的秒数；流式响应共 chunks 块，每秒发送 chunk_rate 块
+    （0 表示不限速）；每个请求以 error_rate 的概率返回 error_status。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), latency=0.0, chunk_rate=0.0, chunks=20,
+                 error_rate=0.0, error_status=503, seed=0):
+        super().__init__(address, MockHandler)
+        self.latency = latency
+        self.chunk_rate = chunk_rate
+        self.chunks = max(1, chunks)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0}
+        self.thread = None
+
+    @property
+    def url(self):
+        """对话补全接口的完整地址"""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        """在后台线程中启动服务，返回接口地址"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        """停止服务并关闭监听端口"""
+        self.shutdown()
+        self.server_close()
+
+    def next_request(self):
+        """记录一次请求，返回本次是否应返回错误"""
+        with self.lock:
+            self.stats["requests"] += 1
+            failed = self.error_rate > 0 and self.random.random() < self.error_rate
+            if failed:
+                self.stats["errors"] += 1
+        return failed
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """按服务的配置生成回复"""
+
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分两次写出，关闭 Nagle 算法以免与延迟确认叠加出 40 毫秒的等待
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.split("?")[0] not in MOCK_PATHS:
+            self.send_json(404, {"error": {"message": f"未知路径: {self.path}"}})
+            return
+        try:
+            data = json.loads(body)
+        except ValueError:
+            self.send_json(400, {"error": {"message": "请求体不是有效的 JSON"}})
+            return
+
+        failed = self.server.next_request()
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        if failed:
+            self.send_json(self.server.error_status, {"error": {"message": "模拟的服务端错误"}}, {"Retry-After": "0"})
+            return
+
+        chunks = [f"第{i + 1}段回复。" for i in range(self.server.chunks)]
+        prompt_tokens = sum(len(str(message.get("content") or "")) for message in data.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(chunks),
+                 "total_tokens": prompt_tokens + len(chunks)}
+        if data.get("stream"):
+            self.send_stream(chunks, usage)
+        else:
+            self.send_json(200, {
+                "id": "mock",
+                "object": "chat.completion",
+                "model": data.get("model", ""),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(chunks)},
+                             "finish_reason": "stop"}],
+                "usage": usage
+            })
+
+    def send_stream(self, chunks, usage):
+        """以 SSE 分块发送回复，分块间隔由 chunk_rate 决定"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1.0 / self.server.chunk_rate if self.server.chunk_rate > 0 else 0.0
+        events = [{"choices": [{"index": 0, "delta": {"content": chunk}}]} for chunk in chunks]
+        events.append({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage})
+        try:
+            for event in events:
+                self.write_chunk(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                if interval:
+                    time.sleep(interval)
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.write_chunk(b"")
+        except OSError:
+            # 客户端提前断开（如取消请求）
+            self.close_connection = True
+
+    def write_chunk(self, data):
+        """写出一个 HTTP 分块"""
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def send_json(self, status, payload, headers=None):
+        """发送 JSON 格式的响应"""
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模拟 DeepSeek 对话补全接口")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址（默认 127.0.0.1）")
+    parser.add_argument("--port", type=int, default=8001, help="监听端口（默认 8001）")
+    parser.add_argument("--latency", type=float, default=0.0, help="首字节延迟（秒）")
+    parser.add_argument("--chunk-rate", type=float, default=0.0, help="流式响应每秒发送的分块数（0 表示不限速）")
+    parser.add_argument("--chunks", type=int, default=20, help="每个回复的分块数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的概率（0~1）")
+    parser.add_argument("--error-status", type=int, default=503, help="注入错误时的状态码")
+    parser.add_argument("--seed", type=int, default=0, help="错误注入的随机种子")
+    args = parser.parse_args()
+
+    server = MockServer((args.host, args.port), args.latency, args.chunk_rate, args.chunks,
+                        args.error_rate, args.error_status, args.seed)
+    print(f"模拟服务已启动: {server.url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"共处理 {server.stats['requests']} 个请求，注入错误 {server.stats['errors']} 次", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
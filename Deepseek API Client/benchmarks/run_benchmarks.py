@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+
+"""
+基准测试
+在本机模拟服务上测量客户端自身的开销，结果以 JSON 输出，便于与之前的结果比较：
+
+    python3 benchmarks/run_benchmarks.py -o results.json
+    python3 benchmarks/run_benchmarks.py --quick --baseline results.json
+
+包含四组测试：
+- latency: 顺序请求的端到端延迟（非流式、流式首字和完整回复、注入错误后重试）
+- throughput: 不同并发数下每秒完成的请求数
+- persistence: 不同存档规模下会话存储的加载、追加、修改和压缩耗时
+- render: 不同会话长度下 GUI 聊天区域的显示耗时（需要图形界面）
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from async_client import AsyncChatClient
+from mock_server import MockServer
+from session_store import JournalSessionStore, SQLiteSessionStore
+
+SUITES = ("latency", "throughput", "persistence", "render")
+
+# 请求使用的配置，与客户端默认值一致，只是关闭了缓存、限流和上下文裁剪
+BENCH_CONFIG = {
+    "api_key": "benchmark",
+    "model": "deepseek-chat",
+    "temperature": 0.7,
+    "max_tokens": 2048,
+    "top_p": 0.95,
+    "frequency_penalty": 0,
+    "presence_penalty": 0,
+    "stream": False,
+    "connect_timeout": 10,
+    "read_timeout": 30,
+    "pool_connections": 4,
+    "pool_maxsize": 64,
+    "keep_alive": True,
+    "http2": False,
+    "context_max_tokens": 0,
+    "max_retries": 3,
+    "retry_backoff_base": 0.01,
+    "retry_backoff_max": 0.05
+}
+
+# 每条模拟消息的内容（约 200 字）
+MESSAGE_TEXT = "这是一条用于基准测试的消息，包含中文和 English words。" * 6
+
+
+def summarize(samples):
+    """把以秒为单位的样本汇总为毫秒统计值"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "max_ms": ordered[-1] * 1000
+    }
+
+
+def make_messages(count, start=0):
+    """生成用户和助手交替的模拟消息"""
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"{i} {MESSAGE_TEXT}",
+         "timestamp": "2024-01-01 00:00:00"}
+        for i in range(start, start + count)
+    ]
+
+
+def write_archive(directory, total, per_session=100):
+    """在目录中写入共 total 条消息的 sessions.json 快照，返回会话名列表"""
+    sessions = {}
+    for start in range(0, total, per_session):
+        sessions[f"会话{start // per_session}"] = make_messages(min(per_session, total - start), start)
+    with open(os.path.join(directory, "sessions.json"), "w", encoding="utf-8") as f:
+        json.dump(sessions, f, ensure_ascii=False)
+    return list(sessions)
+
+
+def directory_size(directory):
+    """目录中所有文件的总字节数"""
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+async def timed_chat(api, config, history):
+    """发送一次请求，返回 (总耗时, 首个增量的耗时, 重试次数)"""
+    started_at = time.perf_counter()
+    first = []
+
+    def on_delta(delta):
+        if not first:
+            first.append(time.perf_counter() - started_at)
+
+    result = await api.chat(config, history, on_delta=on_delta, use_cache=False)
+    return time.perf_counter() - started_at, (first[0] if first else None), result["meta"].get("retries", 0)
+
+
+def bench_latency(args):
+    """顺序请求的端到端延迟"""
+    results = {}
+    scenarios = (
+        ("non_stream", {"stream": False}, 0.0),
+        ("stream", {"stream": True}, 0.0),
+        ("error_injection", {"stream": False}, args.error_rate)
+    )
+    history = [{"role": "user", "content": "你好"}]
+    for name, overrides, error_rate in scenarios:
+        server = MockServer(latency=args.latency, chunk_rate=args.chunk_rate, chunks=args.chunks,
+                            error_rate=error_rate, seed=args.seed)
+        config = dict(BENCH_CONFIG, api_endpoint=server.start(), **overrides)
+        loop = asyncio.new_event_loop()
+        api = AsyncChatClient()
+        totals, firsts, retries, failures = [], [], 0, 0
+        try:
+            # 第一个请求建立连接，不计入结果
+            loop.run_until_complete(timed_chat(api, config, history))
+            for _ in range(args.requests):
+                try:
+                    total, first, retry_count = loop.run_until_complete(timed_chat(api, config, history))
+                except Exception as e:
+                    failures += 1
+                    retries += getattr(e, "retries", 0)
+                    continue
+                totals.append(total)
+                retries += retry_count
+                if first is not None and overrides["stream"]:
+                    firsts.append(first)
+        finally:
+            loop.run_until_complete(api.aclose())
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+            server.stop()
+
+        result = {"total": summarize(totals), "retries": retries, "failures": failures,
+                  "server_errors": server.stats["errors"]}
+        if firsts:
+            result["first_delta"] = summarize(firsts)
+        if error_rate:
+            result["error_rate"] = error_rate
+        results[name] = result
+    return results
+
+
+def bench_throughput(args):
+    """不同并发数下的吞吐量"""
+    results = {}
+    server = MockServer(latency=args.latency, chunk_rate=args.chunk_rate, chunks=args.chunks, seed=args.seed)
+    config = dict(BENCH_CONFIG, api_endpoint=server.start())
+    history = [{"role": "user", "content": "你好"}]
+    loop = asyncio.new_event_loop()
+    api = AsyncChatClient()
+
+    async def run(concurrency, total):
+        queue = asyncio.Queue()
+        for _ in range(total):
+            queue.put_nowait(None)
+        samples = []
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                samples.append((await timed_chat(api, config, history))[0])
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        return time.perf_counter() - started_at, samples
+
+    try:
+        loop.run_until_complete(run(1, 1))
+        for concurrency in args.concurrency:
+            total = max(args.requests, concurrency * 4)
+            elapsed, samples = loop.run_until_complete(run(concurrency, total))
+            results[str(concurrency)] = {
+                "requests": total,
+                "elapsed_s": elapsed,
+                "requests_per_s": total / elapsed if elapsed > 0 else 0.0,
+                "latency": summarize(samples)
+            }
+    finally:
+        loop.run_until_complete(api.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+        server.stop()
+    return results
+
+
+def bench_store(store, sessions, repeat):
+    """测量一个已加载存储的追加、修改和压缩耗时"""
+    session = sessions[len(sessions) // 2]
+    appends, updates = [], []
+    for message in make_messages(repeat):
+        started_at = time.perf_counter()
+        store.append_message(session, message)
+        appends.append(time.perf_counter() - started_at)
+    for index in range(repeat):
+        message = dict(store.sessions[session][index], content=f"已修改 {MESSAGE_TEXT}")
+        started_at = time.perf_counter()
+        store.update_message(session, index, message)
+        updates.append(time.perf_counter() - started_at)
+    started_at = time.perf_counter()
+    store.compact()
+    compact = time.perf_counter() - started_at
+    return {"append": summarize(appends), "update": summarize(updates), "compact_ms": compact * 1000}
+
+
+def bench_persistence(args):
+    """不同存档规模下会话存储的耗时"""
+    results = {}
+    for size in args.archive_sizes:
+        for backend in ("sqlite", "json"):
+            with tempfile.TemporaryDirectory() as directory:
+                sessions = write_archive(directory, size)
+                snapshot_path = os.path.join(directory, "sessions.json")
+                journal_path = os.path.join(directory, "sessions.journal.jsonl")
+
+                def open_store():
+                    if backend == "json":
+                        return JournalSessionStore(snapshot_path, journal_path, compact_threshold=0)
+                    return SQLiteSessionStore(os.path.join(directory, "sessions.db"), snapshot_path, journal_path)
+
+                if backend == "sqlite":
+                    # 首次加载导入快照并建立索引，单独计时
+                    started_at = time.perf_counter()
+                    store = open_store()
+                    store.load()
+                    store.close()
+                    migrate = time.perf_counter() - started_at
+
+                started_at = time.perf_counter()
+                store = open_store()
+                store.load()
+                load = time.perf_counter() - started_at
+                try:
+                    result = bench_store(store, sessions, args.store_operations)
+                finally:
+                    store.close()
+                result["load_ms"] = load * 1000
+                if backend == "sqlite":
+                    result["migrate_ms"] = migrate * 1000
+                result["disk_bytes"] = directory_size(directory)
+                results.setdefault(str(size), {})[backend] = result
+    return results
+
+
+def bench_render(args):
+    """不同会话长度下 GUI 聊天区域的显示耗时"""
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+    except Exception as e:
+        return {"skipped": f"无法创建窗口: {str(e)}"}
+    root.withdraw()
+
+    import gui_main
+
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        app = None
+        try:
+            sessions = {f"长度{length}": make_messages(length) for length in args.session_lengths}
+            with open("sessions.json", "w", encoding="utf-8") as f:
+                json.dump(sessions, f, ensure_ascii=False)
+            app = gui_main.DeepSeekClient(root)
+            root.update()
+            for length in args.session_lengths:
+                result = {}
+                for variant, window in (("windowed", app.config["chat_window_size"]), ("full", length)):
+                    app.config["chat_window_size"] = window
+                    app.current_session = f"长度{length}"
+                    samples = []
+                    for _ in range(args.render_repeat):
+                        started_at = time.perf_counter()
+                        app.update_chat_history(full=True)
+                        root.update_idletasks()
+                        samples.append(time.perf_counter() - started_at)
+                    result[variant] = summarize(samples)
+                    app.config["chat_window_size"] = 200
+
+                # 在已显示的会话末尾追加一条消息，只渲染新增部分
+                app.update_chat_history(full=True)
+                samples = []
+                for message in make_messages(args.render_repeat, length):
+                    app.store.append_message(app.current_session, message)
+                    started_at = time.perf_counter()
+                    app.update_chat_history()
+                    root.update_idletasks()
+                    samples.append(time.perf_counter() - started_at)
+                result["append"] = summarize(samples)
+                results[str(length)] = result
+        finally:
+            if app is not None:
+                app.on_close()
+            else:
+                root.destroy()
+            os.chdir(cwd)
+    return results
+
+
+def git_revision():
+    """当前代码的提交号，不在 git 仓库中时返回 None"""
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5)
+    except Exception:
+        return None
+    return output.stdout.strip() or None
+
+
+def flatten(value, prefix=""):
+    """把嵌套的结果展开为 {"a.b.c": 数值}"""
+    items = {}
+    if isinstance(value, dict):
+        for key, child in value.items():
+            items.update(flatten(child, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        items[prefix] = value
+    return items
+
+
+def compare(results, baseline, threshold=0.1):
+    """输出与基准结果相比变化超过 threshold 的耗时和吞吐量指标"""
+    current = flatten(results["results"])
+    previous = flatten(baseline.get("results", {}))
+    for key in sorted(current):
+        if key not in previous or not previous[key]:
+            continue
+        if not (key.endswith("_ms") or key.endswith("_per_s")):
+            continue
+        ratio = current[key] / previous[key]
+        if abs(ratio - 1) >= threshold:
+            # 耗时变大或吞吐量变小记为变慢
+            slower = ratio > 1 if key.endswith("_ms") else ratio < 1
+            label = "变慢" if slower else "变快"
+            print(f"{label}\t{key}\t{previous[key]:.3f} -> {current[key]:.3f} ({ratio:.2f}x)", file=sys.stderr)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="DeepSeek API 客户端基准测试")
+    parser.add_argument("suites", nargs="*", help=f"要运行的测试组：{' / '.join(SUITES)}（默认全部）")
+    parser.add_argument("-o", "--output", help="结果写入的 JSON 文件（默认输出到标准输出）")
+    parser.add_argument("--baseline", help="与之前的结果文件比较，在标准错误输出变化较大的指标")
+    parser.add_argument("--threshold", type=float, default=0.1, help="与基准比较时报告的最小变化比例（默认 0.1）")
+    parser.add_argument("--quick", action="store_true", help="减少规模，快速运行一遍")
+    parser.add_argument("--requests", type=int, default=200, help="每个场景的请求数（默认 200）")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64], help="吞吐量测试的并发数")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟服务的首字节延迟（秒）")
+    parser.add_argument("--chunk-rate", type=float, default=0.0, help="模拟服务每秒发送的分块数（0 表示不限速）")
+    parser.add_argument("--chunks", type=int, default=20, help="每个回复的分块数")
+    parser.add_argument("--error-rate", type=float, default=0.2, help="错误注入场景中返回 503 的概率")
+    parser.add_argument("--seed", type=int, default=1, help="错误注入的随机种子")
+    parser.add_argument("--archive-sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="存档的消息总数")
+    parser.add_argument("--store-operations", type=int, default=50, help="每个存档上追加和修改的消息数")
+    parser.add_argument("--session-lengths", type=int, nargs="+", default=[100, 1000, 10000], help="GUI 测试的会话长度")
+    parser.add_argument("--render-repeat", type=int, default=5, help="每种显示方式的重复次数")
+    return parser
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error(f"未知的测试组: {suite}")
+    if args.quick:
+        args.requests = min(args.requests, 20)
+        args.concurrency = [c for c in args.concurrency if c <= 16]
+        args.archive_sizes = [size for size in args.archive_sizes if size <= 10000]
+        args.session_lengths = [length for length in args.session_lengths if length <= 1000]
+        args.store_operations = min(args.store_operations, 10)
+        args.render_repeat = min(args.render_repeat, 2)
+
+    benchmarks = {
+        "latency": bench_latency,
+        "throughput": bench_throughput,
+        "persistence": bench_persistence,
+        "render": bench_render
+    }
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "arguments": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "threshold")}
+        },
+        "results": {}
+    }
+    for suite in args.suites or SUITES:
+        print(f"运行 {suite}...", file=sys.stderr)
+        started_at = time.perf_counter()
+        results["results"][suite] = benchmarks[suite](args)
+        print(f"{suite} 完成，用时 {time.perf_counter() - started_at:.1f} 秒", file=sys.stderr)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(results, json.load(f), args.threshold)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
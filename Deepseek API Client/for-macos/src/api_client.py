@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+
+"""
+DeepSeek API 请求模块
+CLI 与 GUI 共用的连接池、请求构建、发送和流式 (SSE) 响应解析
+"""
+
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:  # 可选依赖，仅在开启 http2 时使用
+    httpx = None
+
+from context_window import build_context
+from metrics import record_error, record_success
+from rate_limiter import get_rate_limiter
+from request_timing import RequestTiming
+from response_cache import get_response_cache, request_key
+from retry_policy import RetryPolicy, parse_retry_after
+from structured_log import log_request, log_retry, new_request_id
+from token_counter import message_tokens
+
+API_ENDPOINT = "https://api.deepseek.com/v1/chat/completions"
+SYSTEM_PROMPT = "You are a helpful assistant."
+SUMMARY_PROMPT = "请用简洁的中文总结以下对话的要点，保留后续对话可能用到的事实、约定和结论。"
+
+
+class APIError(Exception):
+    """API 返回了非 200 状态码"""
+
+    def __init__(self, status_code, text, retry_after=None):
+        self.status_code = status_code
+        self.text = text
+        self.retry_after = retry_after
+        super().__init__(f"API错误: {text} (状态码: {status_code})")
+
+
+class RequestCancelled(Exception):
+    """请求在完成前被取消"""
+
+
+class HTTPTransport:
+    """共享的 HTTP 连接池，复用到 API 服务器的 TCP/TLS 连接"""
+
+    def __init__(self, config):
+        self.timeout = (float(config.get("connect_timeout", 10)), float(config.get("read_timeout", 30)))
+        pool_connections = max(1, int(config.get("pool_connections", 4)))
+        pool_maxsize = max(1, int(config.get("pool_maxsize", 10)))
+        keep_alive = bool(config.get("keep_alive", True))
+
+        self.client = None
+        self.session = None
+        if config.get("http2") and httpx is not None:
+            # 安装了 httpx 时可启用 HTTP/2，多个请求复用同一条连接
+            try:
+                self.client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_connections=pool_maxsize,
+                        max_keepalive_connections=pool_maxsize if keep_alive else 0
+                    ),
+                    timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0])
+                )
+            except ImportError:
+                # 未安装 h2 时 httpx 不支持 HTTP/2，退回 HTTP/1.1 连接池
+                self.client = None
+        if self.client is None:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            if not keep_alive:
+                self.session.headers["Connection"] = "close"
+
+    def post(self, url, headers, data, stream=False, trace=None):
+        """发送 POST 请求，返回底层响应对象（requests 或 httpx）
+
+        data 为字典时按 JSON 编码，为 bytes 时作为已编码的请求体直接发送；
+        trace 为 httpx 的 trace 回调，使用 requests 时忽略。
+        """
+        body = {"content": data} if isinstance(data, bytes) else {"json": data}
+        if self.client is not None:
+            extensions = {"trace": trace} if trace is not None else None
+            request = self.client.build_request("POST", url, headers=headers, extensions=extensions, **body)
+            response = self.client.send(request, stream=stream)
+            # 流式响应出错时先读完响应体，以便读取错误信息
+            if stream and response.status_code != 200:
+                response.read()
+            return response
+        if "content" in body:
+            body = {"data": data}
+        return self.session.post(url, headers=headers, timeout=self.timeout, stream=stream, **body)
+
+    def close(self):
+        """关闭连接池"""
+        if self.client is not None:
+            self.client.close()
+        if self.session is not None:
+            self.session.close()
+
+
+TRANSPORT_KEYS = ("connect_timeout", "read_timeout", "pool_connections", "pool_maxsize", "keep_alive", "http2")
+_transport = None
+_transport_settings = None
+_transport_lock = threading.Lock()
+
+
+def get_transport(config):
+    """返回进程内共享的连接池，相关配置变化时重新创建"""
+    global _transport, _transport_settings
+    settings = tuple(config.get(key) for key in TRANSPORT_KEYS)
+    with _transport_lock:
+        if _transport is None or settings != _transport_settings:
+            if _transport is not None:
+                _transport.close()
+            _transport = HTTPTransport(config)
+            _transport_settings = settings
+        return _transport
+
+
+def build_request_data(config, history):
+    """根据配置和对话历史构建请求数据"""
+    # 添加系统消息
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+
+    # 添加对话历史
+    for msg in history:
+        messages.append({"role": msg["role"], "content": msg["content"]})
+
+    data = {
+        "model": config["model"],
+        "messages": messages,
+        "temperature": config["temperature"],
+        "max_tokens": config["max_tokens"],
+        "top_p": config["top_p"],
+        "frequency_penalty": config["frequency_penalty"],
+        "presence_penalty": config["presence_penalty"]
+    }
+
+    # 流式模式下服务端以 SSE 逐段返回内容
+    if config.get("stream"):
+        data["stream"] = True
+    return data
+
+
+def encode_body(data):
+    """把请求数据编码为请求体，记录发送字节数时避免重复编码"""
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+
+def parse_stream_line(line, usage=None):
+    """解析 SSE 响应中的一行，返回 (增量文本列表, 是否已结束)
+
+    usage 为字典时合并服务端在数据块中返回的 token 用量。
+    """
+    # httpx 已按行解码为字符串
+    if isinstance(line, bytes):
+        line = line.decode("utf-8", errors="replace")
+    # 以冒号开头的是 SSE 注释（如 keep-alive），直接跳过
+    if not line or not line.startswith("data:"):
+        return [], False
+
+    payload = line[len("data:"):].strip()
+    if payload == "[DONE]":
+        return [], True
+
+    chunk = json.loads(payload)
+    if usage is not None and chunk.get("usage"):
+        usage.update(chunk["usage"])
+    deltas = []
+    for choice in chunk.get("choices", []):
+        delta = choice.get("delta") or {}
+        content = delta.get("content")
+        if content:
+            deltas.append(content)
+    return deltas, False
+
+
+def iter_stream_deltas(response, timing=None):
+    """逐行解析 SSE 响应流，依次返回助手回复的增量文本
+
+    指定 timing 时记录解析耗时、接收字节数和 token 用量。
+    """
+    usage = {}
+    # 按字节读取后自行以 UTF-8 解码，避免 text/event-stream 被 requests 误判为 ISO-8859-1
+    for raw_line in response.iter_lines():
+        if timing is None:
+            deltas, done = parse_stream_line(raw_line)
+        else:
+            started_at = time.perf_counter()
+            deltas, done = parse_stream_line(raw_line, usage)
+            timing.since("parse", started_at)
+            timing.response_bytes += len(raw_line) + 1
+            timing.usage = usage or None
+        if done:
+            break
+        for content in deltas:
+            yield content
+
+
+def build_headers(config):
+    """构建请求头"""
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {config['api_key']}"
+    }
+
+
+def prompt_tokens(data):
+    """估算请求中提示词的 token 数"""
+    return sum(message_tokens(message) for message in data["messages"])
+
+
+def request_tokens(data):
+    """按提示词估算值加上回复上限计算本次请求需要预约的 token 额度"""
+    return prompt_tokens(data) + int(data["max_tokens"])
+
+
+def used_tokens(data, content, usage):
+    """本次请求实际消耗的 token 数：优先用服务端返回的用量，没有时按提示词和回复估算"""
+    if usage and usage.get("total_tokens"):
+        return int(usage["total_tokens"])
+    return prompt_tokens(data) + message_tokens({"role": "assistant", "content": content})
+
+
+def prepare_request(config, history, session=None):
+    """按会话的上下文配置裁剪历史并构建请求数据（同步与异步客户端共用）"""
+    if session is not None:
+        history = build_context(
+            config, session, history,
+            summarize=lambda messages, previous: summarize_messages(config, messages, previous)
+        )
+    return build_request_data(config, history)
+
+
+def summarize_messages(config, messages, previous_summary=None):
+    """调用 API 生成对话摘要，previous_summary 为已有摘要时在其基础上增量总结"""
+    lines = []
+    if previous_summary:
+        lines.append(f"已有摘要：\n{previous_summary}\n")
+    for message in messages:
+        role_text = "用户" if message["role"] == "user" else "助手"
+        lines.append(f"{role_text}: {message['content']}")
+
+    request_config = dict(config, stream=False)
+    prompt = {"role": "user", "content": SUMMARY_PROMPT + "\n\n" + "\n".join(lines)}
+    return chat_completion(request_config, [prompt])["content"]
+
+
+def api_endpoint(config):
+    """返回配置的上游对话补全接口地址"""
+    return config.get("api_endpoint") or API_ENDPOINT
+
+
+def send_request(transport, url, headers, data, on_delta=None, cancel_event=None, progress=None,
+                 body=None, timing=None):
+    """发送一次请求并返回助手回复，不做重试
+
+    progress["delivered"] 记录流式内容是否已交给 on_delta，已交付后不能再重试。
+    body 为已编码的请求体；指定 timing 时记录首字节、下载和解析的耗时。
+    """
+    stream = bool(data.get("stream"))
+    if timing is None:
+        timing = RequestTiming()
+    # 总以流式接收，收到响应头即返回，才能把首字节和下载时间分开
+    started_at = timing.begin_attempt()
+    response = transport.post(url, headers, body or data, stream=True, trace=timing.trace)
+    received_at = timing.since("ttfb", started_at)
+
+    try:
+        if response.status_code != 200:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            raise APIError(response.status_code, response.text, retry_after)
+
+        if not stream:
+            raw = response.read() if hasattr(response, "read") else response.content
+            parse_started_at = timing.since("download", received_at)
+            result = json.loads(raw)
+            timing.since("parse", parse_started_at)
+            timing.response_bytes = len(raw)
+            timing.usage = result.get("usage")
+            content = result["choices"][0]["message"]["content"]
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled()
+            return content
+
+        chunks = []
+        for delta in iter_stream_deltas(response, timing):
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled()
+            chunks.append(delta)
+            if on_delta is not None:
+                if progress is not None:
+                    progress["delivered"] = True
+                on_delta(delta)
+        # 解析时间穿插在接收过程中，下载时间不含解析
+        timing.add("download", time.perf_counter() - received_at - timing.phases.get("parse", 0.0))
+        return "".join(chunks)
+    finally:
+        response.close()
+
+
+class ChatRequest:
+    """一次对话请求中同步与异步客户端共用的部分
+
+    负责编码请求体、查询响应缓存、限流与重试的决策，以及指标、结构化日志和消息元数据的记录；
+    客户端只负责按 steps() 给出的操作实际发送请求和等待。
+    """
+
+    def __init__(self, config, session=None, use_cache=True):
+        self.config = config
+        self.session = session
+        self.timing = RequestTiming()
+        self.request_id = new_request_id()
+        self.cache = get_response_cache(config) if use_cache else None
+        self.cache_key = None
+        self.data = None
+        self.body = None
+        self.retries = 0
+        # 流式内容是否已交给 on_delta，已交付后不能再重试
+        self.progress = {"delivered": False}
+
+    def prepare(self, data):
+        """记录构建好的请求数据并编码请求体"""
+        self.data = data
+        self.body = encode_body(data)
+        self.timing.request_bytes = len(self.body)
+        self.timing.since("build", self.timing.started_at)
+
+    def cached_result(self, on_delta=None):
+        """命中响应缓存时返回结果（不访问网络），否则返回 None"""
+        if self.cache is None:
+            return None
+        self.cache_key = request_key(self.data, api_endpoint(self.config), self.config.get("api_key", ""))
+        content = self.cache.get(self.cache_key)
+        if content is None:
+            return None
+        # 流式模式下一次性交付全部内容
+        if self.data.get("stream") and on_delta is not None:
+            on_delta(content)
+        meta = dict(self.timing.to_meta(), cached=True, request_id=self.request_id)
+        record_success(self.config, self.data["model"], meta, True)
+        log_request(self.request_id, self.session, self.data["model"], meta)
+        return {"content": content, "meta": meta}
+
+    def steps(self, cancel_event=None):
+        """限流和重试流程（生成器），依次给出客户端需要执行的操作：
+
+        ("acquire", tokens): 在限流器中等待，返回 False 表示等待时被取消；
+        ("send", None): 发送一次请求，返回 (回复内容, None) 或 (None, 异常)；
+        ("sleep", seconds): 重试前等待，返回 True 表示等待时被取消。
+        结束时返回 {"content", "meta"}；最终失败时抛出的异常带有 retries 和 request_id 属性。
+        """
+        policy = RetryPolicy.from_config(self.config)
+        limiter = get_rate_limiter(self.config)
+        tokens = request_tokens(self.data)
+        queued_at = time.perf_counter()
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                raise RequestCancelled()
+            if not (yield "acquire", tokens):
+                raise RequestCancelled()
+            self.timing.since("queue", queued_at)
+            content, error = yield "send", None
+            if error is None:
+                break
+            # 失败的尝试没有得到回复，预约的 token 额度全部归还（请求次数照常计入）
+            limiter.refund(tokens)
+
+            # 流式内容已经显示出来后不再重试，避免重复输出
+            if self.progress["delivered"] or not policy.should_retry(error, self.retries):
+                error.retries = self.retries
+                error.request_id = self.request_id
+                record_error(self.config, error, self.cache is not None)
+                log_request(self.request_id, self.session, self.data["model"], self.timing.to_meta(), error=error)
+                raise error
+
+            delay = policy.delay(error, self.retries)
+            self.retries += 1
+            log_retry(self.request_id, self.retries, delay, error)
+            waited_at = time.perf_counter()
+            if (yield "sleep", delay):
+                raise RequestCancelled()
+            queued_at = self.timing.since("retry_wait", waited_at)
+
+        # 预约时按回复上限扣减，完成后按实际用量归还多扣的部分
+        unused = tokens - used_tokens(self.data, content, self.timing.usage)
+        if unused > 0:
+            limiter.refund(unused)
+        if self.cache is not None:
+            self.cache.put(self.cache_key, content)
+        meta = self.timing.to_meta()
+        meta["request_id"] = self.request_id
+        if self.retries:
+            meta["retries"] = self.retries
+        record_success(self.config, self.data["model"], meta, self.cache is not None)
+        log_request(self.request_id, self.session, self.data["model"], meta)
+        return {"content": content, "meta": meta}
+
+
+def chat_completion(config, history, on_delta=None, cancel_event=None, transport=None, session=None,
+                    use_cache=True):
+    """发送对话请求，返回 {"content": 助手回复, "meta": 需要记录到消息中的元数据}
+
+    流式模式下每收到一段增量文本都会调用 on_delta；cancel_event 被置位时
+    中止接收并抛出 RequestCancelled。本函数不触碰任何界面对象，可在工作线程中调用。
+    未指定 transport 时使用进程内共享的连接池。
+    指定 session 时按该会话的上下文配置裁剪历史后再发送。
+    开启 cache_enabled 时完全相同的请求直接返回缓存的回复，use_cache=False 可跳过缓存。
+    暂时性错误按重试策略自动重试，最终失败时抛出的异常带有 retries 属性。
+    每次发送前经过 RPM/TPM 限流器，超出预算时排队等待。
+    meta 中记录各阶段耗时、收发字节数和 token 用量（见 RequestTiming）。
+    """
+    request = ChatRequest(config, session, use_cache)
+    request.prepare(prepare_request(config, history, session))
+    result = request.cached_result(on_delta)
+    if result is not None:
+        return result
+
+    url = api_endpoint(config)
+    headers = build_headers(config)
+    if transport is None:
+        transport = get_transport(config)
+    limiter = get_rate_limiter(config)
+
+    steps = request.steps(cancel_event)
+    reply = None
+    while True:
+        try:
+            operation, argument = steps.send(reply)
+        except StopIteration as done:
+            return done.value
+        if operation == "acquire":
+            reply = limiter.acquire(argument, cancel_event)
+        elif operation == "send":
+            try:
+                content = send_request(transport, url, headers, request.data, on_delta, cancel_event,
+                                       request.progress, request.body, request.timing)
+                reply = (content, None)
+            except RequestCancelled:
+                raise
+            except Exception as e:
+                reply = (None, e)
+        elif cancel_event is not None:
+            reply = cancel_event.wait(argument)
+        else:
+            time.sleep(argument)
+            reply = False
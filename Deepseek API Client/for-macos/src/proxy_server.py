@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+本地代理服务模块
+在本机提供 OpenAI 兼容的 /v1/chat/completions 接口并转发到上游 API，
+所有调用方共用一个保持连接的上游连接池，完全相同的并发请求只转发一次
+"""
+
+import hashlib
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from api_client import api_endpoint, get_transport
+from rate_limiter import get_rate_limiter
+from response_cache import request_key
+from token_counter import MESSAGE_OVERHEAD, count_tokens
+
+PROXY_PATHS = ("/v1/chat/completions", "/chat/completions")
+
+
+class InflightRequest:
+    """正在转发中的请求，相同请求的调用方等待同一个结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ProxyServer(ThreadingHTTPServer):
+    """转发对话请求的本地 HTTP 服务，每个连接一个线程"""
+
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, ProxyHandler)
+        self.config = config
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.stats = {"requests": 0, "upstream": 0, "coalesced": 0, "errors": 0}
+
+    def count(self, name):
+        """累加统计计数"""
+        with self.lock:
+            self.stats[name] += 1
+
+    def post(self, headers, data, stream=False):
+        """经限流器后向上游发送请求，返回底层响应对象"""
+        self.count("upstream")
+        tokens = sum(count_tokens(str(message.get("content") or "")) + MESSAGE_OVERHEAD
+                     for message in data.get("messages", []))
+        get_rate_limiter(self.config).acquire(tokens + int(data.get("max_tokens") or 0))
+        return get_transport(self.config).post(api_endpoint(self.config), headers, data, stream=stream)
+
+    def forward(self, headers, data):
+        """转发一次请求，返回 (状态码, 响应头, 响应体)"""
+        response = self.post(headers, data)
+        try:
+            response_headers = {"Content-Type": response.headers.get("Content-Type", "application/json")}
+            if response.headers.get("Retry-After"):
+                response_headers["Retry-After"] = response.headers["Retry-After"]
+            return response.status_code, response_headers, response.content
+        finally:
+            response.close()
+
+    def forward_coalesced(self, headers, data):
+        """转发非流式请求；已有完全相同的请求在转发中时直接等待它的结果"""
+        # 不同调用方的密钥不同时不能共享结果
+        key = request_key(data) + hashlib.sha256(headers["Authorization"].encode("utf-8")).hexdigest()
+        with self.lock:
+            request = self.inflight.get(key)
+            leader = request is None
+            if leader:
+                request = self.inflight[key] = InflightRequest()
+            else:
+                self.stats["coalesced"] += 1
+
+        if leader:
+            try:
+                request.result = self.forward(headers, data)
+            except Exception as e:
+                request.error = e
+            finally:
+                with self.lock:
+                    del self.inflight[key]
+                request.done.set()
+        else:
+            request.done.wait()
+
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+
+class ProxyHandler(BaseHTTPRequestHandler):
+    """处理 /v1/chat/completions 请求"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+    def do_POST(self):
+        # 先读完请求体，保持连接上的下一个请求不受影响
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.split("?")[0] not in PROXY_PATHS:
+            self.send_json(404, {"error": {"message": f"未知路径: {self.path}"}})
+            return
+
+        self.server.count("requests")
+        try:
+            data = json.loads(body)
+        except ValueError:
+            self.send_json(400, {"error": {"message": "请求体不是有效的 JSON"}})
+            return
+
+        # 调用方未提供密钥时使用客户端配置中的密钥
+        authorization = self.headers.get("Authorization") or f"Bearer {self.server.config['api_key']}"
+        headers = {"Content-Type": "application/json", "Authorization": authorization}
+
+        try:
+            if data.get("stream"):
+                self.forward_stream(headers, data)
+            else:
+                status, response_headers, body = self.server.forward_coalesced(headers, data)
+                self.send_body(status, response_headers, body)
+        except Exception as e:
+            self.server.count("errors")
+            self.send_json(502, {"error": {"message": f"上游请求失败: {str(e)}"}})
+
+    def forward_stream(self, headers, data):
+        """流式请求逐块转发上游的 SSE 响应"""
+        response = self.server.post(headers, data, stream=True)
+        try:
+            if response.status_code != 200:
+                self.send_body(response.status_code, {"Content-Type": response.headers.get("Content-Type", "application/json")},
+                               response.content)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", response.headers.get("Content-Type", "text/event-stream"))
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            chunks = response.iter_bytes() if hasattr(response, "iter_bytes") else response.iter_content(chunk_size=None)
+            try:
+                for chunk in chunks:
+                    if chunk:
+                        self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                        self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+            except Exception:
+                # 响应头已经发出，只能断开连接让调用方感知中断
+                self.server.count("errors")
+                self.close_connection = True
+        finally:
+            response.close()
+
+    def send_body(self, status, headers, body):
+        """发送完整的响应"""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, payload):
+        """发送 JSON 格式的响应"""
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_body(status, {"Content-Type": "application/json"}, body)
+
+
+def serve(config, host="127.0.0.1", port=8000):
+    """启动代理服务，直到按 Ctrl+C 退出"""
+    server = ProxyServer((host, port), config)
+    print(f"代理服务已启动: http://{host}:{server.server_port}/v1/chat/completions -> {api_endpoint(config)}",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stats = server.stats
+        print(f"共处理 {stats['requests']} 个请求，转发 {stats['upstream']} 次，"
+              f"合并 {stats['coalesced']} 次，失败 {stats['errors']} 次", file=sys.stderr)
+    return 0
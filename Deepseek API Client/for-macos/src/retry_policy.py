@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+重试策略模块
+对限流、服务端繁忙和网络抖动等暂时性错误做指数退避重试（带随机抖动），
+并遵循服务器返回的 Retry-After
+"""
+
+import email.utils
+import random
+import time
+
+import requests
+
+try:
+    import httpx
+except ImportError:  # 可选依赖
+    httpx = None
+
+# 服务器明确表示稍后重试 (429/503) 或网关/服务端暂时故障时重试
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+
+def parse_retry_after(value):
+    """解析 Retry-After 头（秒数或 HTTP 日期），返回需要等待的秒数"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def is_retryable(error):
+    """判断错误是否可以安全重试
+
+    连接失败时请求尚未到达服务器，重试总是安全的；对话补全接口在服务端没有副作用，
+    因此读取超时和 5xx 重试最多只是多消耗一次 token。参数错误、鉴权失败、余额不足等
+    重试也不会成功，直接返回失败。
+    """
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    return False
+
+
+class RetryPolicy:
+    """指数退避重试策略（full jitter）"""
+
+    def __init__(self, max_retries=3, backoff_base=1.0, backoff_max=30.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    @classmethod
+    def from_config(cls, config):
+        """根据配置创建重试策略"""
+        return cls(
+            max_retries=max(0, int(config.get("max_retries", 3))),
+            backoff_base=float(config.get("retry_backoff_base", 1.0)),
+            backoff_max=float(config.get("retry_backoff_max", 30.0))
+        )
+
+    def should_retry(self, error, retries):
+        """已重试 retries 次后是否还应继续重试"""
+        return retries < self.max_retries and is_retryable(error)
+
+    def delay(self, error, retries):
+        """返回第 retries + 1 次重试前的等待秒数"""
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** retries)))
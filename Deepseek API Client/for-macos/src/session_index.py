@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+"""
+会话名称前缀索引模块
+按忽略大小写的会话名排序保存，二分查找所有以输入内容开头的会话
+"""
+
+import bisect
+
+
+class PrefixIndex:
+    """会话名称的有序索引，支持增删和前缀查询"""
+
+    def __init__(self, names=()):
+        self.keys = sorted((name.casefold(), name) for name in names)
+
+    def add(self, name):
+        """加入一个会话名"""
+        entry = (name.casefold(), name)
+        position = bisect.bisect_left(self.keys, entry)
+        if position == len(self.keys) or self.keys[position] != entry:
+            self.keys.insert(position, entry)
+
+    def remove(self, name):
+        """移除一个会话名"""
+        entry = (name.casefold(), name)
+        position = bisect.bisect_left(self.keys, entry)
+        if position < len(self.keys) and self.keys[position] == entry:
+            del self.keys[position]
+
+    def search(self, prefix):
+        """返回所有以 prefix 开头（忽略大小写）的会话名"""
+        prefix = prefix.casefold()
+        position = bisect.bisect_left(self.keys, (prefix,))
+        names = []
+        while position < len(self.keys) and self.keys[position][0].startswith(prefix):
+            names.append(self.keys[position][1])
+            position += 1
+        return names
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""
+批量请求模块
+从 JSONL 文件读取提示词，以有限并发发送请求，每完成一条就追加写入结果 JSONL；
+中断后重新运行会跳过结果文件中已成功的条目
+"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+from api_client import APIError
+from context_window import load_history
+from token_counter import count_message
+
+# 每行可以覆盖的请求参数
+REQUEST_KEYS = ("model", "temperature", "max_tokens", "top_p", "frequency_penalty", "presence_penalty")
+
+
+def load_finished(output_path):
+    """读取已有结果文件，返回已成功条目的 id 集合
+
+    上次运行在写入中途被中断时，文件末尾可能留下不完整的一行，这里把它截掉。
+    """
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+
+    valid_size = 0
+    with open(output_path, "rb") as f:
+        for raw_line in f:
+            if not raw_line.endswith(b"\n"):
+                break
+            valid_size += len(raw_line)
+            try:
+                record = json.loads(raw_line)
+            except ValueError:
+                continue
+            # 手工编辑过的结果文件中可能有不含 id 的行，跳过
+            if isinstance(record, dict) and "error" not in record and valid_id(record.get("id")):
+                finished.add(record["id"])
+
+    if valid_size != os.path.getsize(output_path):
+        with open(output_path, "r+b") as f:
+            f.truncate(valid_size)
+    return finished
+
+
+def valid_id(item_id):
+    """条目 id 只能是字符串或整数"""
+    return isinstance(item_id, (str, int)) and not isinstance(item_id, bool)
+
+
+def iter_prompts(input_path):
+    """逐行读取输入文件，返回 (id, 条目, 错误信息)
+
+    无法解析、不是 JSON 对象/字符串或 id 无效的行返回 (行号, None, 错误信息)。
+    """
+    with open(input_path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                yield line_number, None, "无法解析的输入行（每行须为 JSON 对象或字符串）"
+                continue
+            if isinstance(item, str):
+                item = {"prompt": item}
+            elif not isinstance(item, dict):
+                # 数组、数字等合法 JSON 也无法作为一条请求
+                yield line_number, None, "无法解析的输入行（每行须为 JSON 对象或字符串）"
+                continue
+            item_id = item.get("id", line_number)
+            if not valid_id(item_id):
+                yield line_number, None, "无效的 id（须为字符串或整数）"
+                continue
+            yield item_id, item, None
+
+
+def request_config(config, item):
+    """合并该行指定的模型和参数"""
+    params = item.get("params") or {}
+    if not isinstance(params, dict):
+        raise ValueError("params 须为 JSON 对象")
+    overrides = dict(params)
+    if "model" in item:
+        overrides["model"] = item["model"]
+    request = dict(config, stream=False)
+    request.update({key: value for key, value in overrides.items() if key in REQUEST_KEYS})
+    return request
+
+
+def request_messages(item):
+    """返回该行要发送的消息列表，格式不对时抛出 ValueError"""
+    if "messages" not in item:
+        prompt = item.get("prompt", "")
+        if not isinstance(prompt, str):
+            raise ValueError("prompt 须为字符串")
+        return [{"role": "user", "content": prompt}]
+
+    messages = item["messages"]
+    if not isinstance(messages, list) or not all(
+        isinstance(message, dict) and isinstance(message.get("role"), str) and isinstance(message.get("content"), str)
+        for message in messages
+    ):
+        raise ValueError("messages 须为由 {\"role\", \"content\"} 对象组成的数组")
+    return [dict(message) for message in messages]
+
+
+class BatchRunner:
+    """以有限并发执行批量请求，需在事件循环中运行"""
+
+    def __init__(self, config, api, store, output_path, concurrency=8, use_cache=True):
+        self.config = config
+        self.use_cache = use_cache
+        self.api = api
+        self.store = store
+        self.output_path = output_path
+        self.concurrency = max(1, concurrency)
+        # 同一会话的条目按顺序执行，保证对话历史的先后
+        self.session_locks = {}
+        self.output = None
+        self.counts = {"done": 0, "failed": 0, "skipped": 0}
+        self.started_at = None
+
+    async def run(self, input_path):
+        """执行整个输入文件，返回统计结果"""
+        finished = load_finished(self.output_path)
+        prompts = iter_prompts(input_path)
+        self.started_at = time.monotonic()
+        self.output = open(self.output_path, "a", encoding="utf-8", newline="\n")
+        # 固定数量的工作协程依次从输入中取条目，不会一次读入整个文件
+        workers = [asyncio.ensure_future(self.worker(prompts, finished)) for _ in range(self.concurrency)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            # 某个工作协程出错或整体被取消时，先停止其余协程，再关闭结果文件
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self.output.flush()
+            os.fsync(self.output.fileno())
+            self.output.close()
+        self.report()
+        return self.counts
+
+    async def worker(self, prompts, finished):
+        """工作协程：取出下一条未完成的条目并执行"""
+        for item_id, item, error in prompts:
+            if item_id in finished:
+                self.counts["skipped"] += 1
+                continue
+            if item is None:
+                self.write({"id": item_id, "error": error})
+                continue
+            await self.run_item(item_id, item)
+
+    async def run_item(self, item_id, item):
+        """执行一条请求并写入结果；该行格式不对时只记录这一条失败"""
+        try:
+            session = item.get("session")
+            if session is not None and not isinstance(session, str):
+                raise ValueError("session 须为字符串")
+            config = request_config(self.config, item)
+            messages = request_messages(item)
+        except ValueError as e:
+            self.write({"id": item_id, "error": f"无效的输入行: {str(e)}"})
+            return
+
+        if session is None:
+            record = await self.request(item_id, config, messages, None)
+        else:
+            lock = self.session_locks.setdefault(session, asyncio.Lock())
+            async with lock:
+                record = await self.request(item_id, config, messages, session)
+        self.write(record)
+
+    async def request(self, item_id, config, messages, session):
+        """发送请求，指定会话时把提问和回复记录到会话中"""
+        history = messages
+        if session is not None and session in self.store.sessions:
+            # 只读取上下文配置保留的历史，不把整个会话载入内存
+            count = self.store.session_info(session)["count"]
+            stored = load_history(config, session, count, self.store.load_range)
+            history = [dict(message) for message in stored] + messages
+
+        record = {"id": item_id}
+        if session is not None:
+            record["session"] = session
+        try:
+            result = await self.api.chat(config, history, session=session, use_cache=self.use_cache)
+        except Exception as e:
+            record["error"] = str(e) if isinstance(e, APIError) else f"网络错误: {str(e)}"
+            if getattr(e, "retries", 0):
+                record["retries"] = e.retries
+            return record
+
+        record["content"] = result["content"]
+        record.update(result["meta"])
+        if session is not None:
+            # 成功后才写入会话，失败的条目续跑时不会留下重复的提问
+            self.save_messages(session, messages, result)
+        return record
+
+    def save_messages(self, session, messages, result):
+        """把本条的提问和回复追加到会话中"""
+        if session not in self.store.sessions:
+            self.store.create_session(session)
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        reply = {"role": "assistant", "content": result["content"]}
+        reply.update(result["meta"])
+        for message in messages + [reply]:
+            message["timestamp"] = timestamp
+            count_message(message)
+            self.store.append_message(session, message)
+
+    def write(self, record):
+        """追加一条结果，立即写出以便中断后可以续跑"""
+        if "error" in record:
+            self.counts["failed"] += 1
+        else:
+            self.counts["done"] += 1
+        self.output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.output.flush()
+
+        total = self.counts["done"] + self.counts["failed"]
+        if total % 100 == 0:
+            self.report()
+
+    def report(self):
+        """在标准错误输出进度"""
+        elapsed = time.monotonic() - self.started_at
+        total = self.counts["done"] + self.counts["failed"]
+        rate = total / elapsed if elapsed > 0 else 0.0
+        print(
+            f"完成 {self.counts['done']} 条，失败 {self.counts['failed']} 条，"
+            f"跳过 {self.counts['skipped']} 条，{rate:.1f} 条/秒",
+            file=sys.stderr
+        )
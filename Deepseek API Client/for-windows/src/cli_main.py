@@ -6,41 +6,126 @@ DeepSeek API 客户端 (终端版本)
 使用 Python 实现的命令行界面
 """
 
+import argparse
+import asyncio
 import json
-import requests
 import os
 import time
 import sys
 
+from api_client import APIError
+from async_client import AsyncChatClient
+from batch_runner import BatchRunner
+from proxy_server import serve
+from context_window import CONTEXT_KEYS, context_settings, load_history
+from metrics import get_metrics, observe_persist, shutdown_metrics
+from profiler import DEFAULT_PROFILE_DIR, profile_phase, start_profiling, stop_profiling
+from rate_limiter import get_rate_limiter
+from request_timing import format_timing
+from response_cache import get_response_cache
+from session_store import SessionStoreError, open_session_store
+from structured_log import get_logger, setup_logging, shutdown_logging
+from token_counter import count_message, load_tokenizer
+
+logger = get_logger("cli")
+
+# 按类型转换的配置项
+FLOAT_CONFIG_KEYS = ["temperature", "top_p", "connect_timeout", "read_timeout", "cache_ttl", "retry_backoff_base", "retry_backoff_max", "metrics_textfile_interval", "log_sample_rate"]
+INT_CONFIG_KEYS = ["max_tokens", "frequency_penalty", "presence_penalty", "pool_connections", "pool_maxsize", "context_max_tokens", "context_max_turns", "session_cache_size", "journal_compact_events", "cache_max_entries", "max_retries", "rate_limit_rpm", "rate_limit_tpm", "batch_concurrency", "embedding_batch_size", "metrics_port"]
+BOOL_CONFIG_KEYS = ["stream", "keep_alive", "http2", "context_drop_errors", "context_summary", "cache_enabled"]
+
+
+def convert_config_value(key, value):
+    """把输入的字符串转换为配置项对应的类型，无效数值抛出 ValueError"""
+    if key in FLOAT_CONFIG_KEYS:
+        return float(value)
+    if key in INT_CONFIG_KEYS:
+        return int(value)
+    if key in BOOL_CONFIG_KEYS:
+        return value.strip().lower() in ["1", "true", "yes", "y", "on"]
+    return value
+
+
 class DeepSeekCLIClient:
+    @profile_phase("startup")
     def __init__(self):
         # 配置数据
         self.config = {
             "api_key": "YOUR_API_KEY_HERE",
+            "api_endpoint": "https://api.deepseek.com/v1/chat/completions",
             "model": "deepseek-chat",
             "temperature": 0.7,
             "max_tokens": 2048,
             "top_p": 0.95,
             "frequency_penalty": 0,
-            "presence_penalty": 0
+            "presence_penalty": 0,
+            "stream": False,
+            "connect_timeout": 10,
+            "read_timeout": 30,
+            "pool_connections": 4,
+            "pool_maxsize": 10,
+            "keep_alive": True,
+            "http2": False,
+            "context_max_tokens": 32000,
+            "context_max_turns": 0,
+            "context_drop_errors": True,
+            "context_summary": False,
+            "session_context": {},
+            "tokenizer_path": "",
+            "cache_enabled": False,
+            "cache_ttl": 86400,
+            "cache_max_entries": 1000,
+            "max_retries": 3,
+            "retry_backoff_base": 1.0,
+            "retry_backoff_max": 30.0,
+            "rate_limit_rpm": 0,
+            "rate_limit_tpm": 0,
+            "storage_backend": "sqlite",
+            "session_cache_size": 8,
+            "journal_compact_events": 1000,
+            "embedding_backend": "",
+            "embedding_model": "",
+            "embedding_endpoint": "",
+            "embedding_batch_size": 64,
+            "metrics_port": 0,
+            "metrics_host": "127.0.0.1",
+            "metrics_textfile": "",
+            "metrics_textfile_interval": 15,
+            "log_file": "",
+            "log_level": "WARNING",
+            "log_sample_rate": 1.0,
+            "batch_concurrency": 8
         }
         
         # 会话数据
         self.sessions = {}
         self.current_session = "默认会话"
         
+        # 异步请求客户端，事件循环在多次请求间保留以复用连接
+        self.loop = asyncio.new_event_loop()
+        self.api = AsyncChatClient()
+        
         # 加载配置和会话
-        self.load_config()
+        config_error = self.load_config()
+        # 结构化日志在加载配置后尽早设置，之后的加载错误都能写入日志
+        setup_logging(self.config)
+        if config_error is not None:
+            logger.warning("加载配置失败: %s", config_error)
+        load_tokenizer(self.config["tokenizer_path"])
         self.load_sessions()
+        # 配置了 metrics_port 或 metrics_textfile 时启动指标导出
+        get_metrics(self.config)
     
+    @profile_phase("load_config")
     def load_config(self):
-        """加载配置"""
+        """加载配置，失败时返回异常（日志尚未设置，由调用方在设置后记录）"""
         if os.path.exists("config.json"):
             try:
                 with open("config.json", "r", encoding="utf-8") as f:
                     self.config.update(json.load(f))
             except Exception as e:
-                print(f"加载配置失败: {e}")
+                return e
+        return None
     
     def save_config(self):
         """保存配置"""
@@ -51,26 +136,32 @@ class DeepSeekCLIClient:
         except Exception as e:
             print(f"保存配置失败: {e}")
     
+    @profile_phase("load_sessions")
     def load_sessions(self):
         """加载会话"""
-        if os.path.exists("sessions.json"):
-            try:
-                with open("sessions.json", "r", encoding="utf-8") as f:
-                    self.sessions = json.load(f)
-            except Exception as e:
-                print(f"加载会话失败: {e}")
+        # 存储后端由 storage_backend 决定，修改会话时只写入变化的部分
+        self.store = open_session_store(self.config)
+        try:
+            self.store.load()
+        except SessionStoreError:
+            # 数据库打不开时无法保存任何会话，由调用方提示后退出
+            raise
+        except Exception as e:
+            logger.error("加载会话失败: %s", e, exc_info=True)
+        self.sessions = self.store.sessions
         
         # 确保默认会话存在
         if "默认会话" not in self.sessions:
-            self.sessions["默认会话"] = []
+            self.store.create_session("默认会话")
     
-    def save_sessions(self):
-        """保存会话"""
-        try:
-            with open("sessions.json", "w", encoding="utf-8") as f:
-                json.dump(self.sessions, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存会话失败: {e}")
+    def close(self):
+        """关闭会话存储、连接池、指标导出和日志输出"""
+        self.store.close()
+        shutdown_metrics()
+        shutdown_logging()
+        self.loop.run_until_complete(self.api.aclose())
+        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        self.loop.close()
     
     def print_main_menu(self):
         """打印主菜单"""
@@ -93,6 +184,7 @@ class DeepSeekCLIClient:
             elif choice == "3":
                 self.handle_config_menu()
             elif choice == "4":
+                self.close()
                 print("再见！")
                 break
             else:
@@ -143,10 +235,9 @@ class DeepSeekCLIClient:
             session_name = f"会话_{int(time.time())}"
         
         if session_name not in self.sessions:
-            self.sessions[session_name] = []
+            self.store.create_session(session_name)
             self.current_session = session_name
             print(f"会话 '{session_name}' 创建成功")
-            self.save_sessions()
         else:
             print(f"会话 '{session_name}' 已存在")
     
@@ -158,11 +249,10 @@ class DeepSeekCLIClient:
         if session_name == "默认会话":
             print("默认会话不能删除")
         elif session_name in self.sessions:
-            del self.sessions[session_name]
+            self.store.delete_session(session_name)
             if session_name == self.current_session:
                 self.current_session = "默认会话"
             print(f"会话 '{session_name}' 删除成功")
-            self.save_sessions()
         else:
             print(f"会话 '{session_name}' 不存在")
     
@@ -180,12 +270,14 @@ class DeepSeekCLIClient:
     def print_chat_menu(self):
         """打印聊天菜单"""
         print("\n===== 聊天 =====")
-        print(f"当前会话: {self.current_session}")
+        info = self.store.session_info(self.current_session)
+        print(f"当前会话: {self.current_session} ({info['count']} 条消息，约 {info['tokens']} tokens)")
         print("1. 查看聊天历史")
         print("2. 发送消息")
         print("3. 编辑消息")
         print("4. 删除消息")
-        print("5. 返回主菜单")
+        print("5. 上下文设置")
+        print("6. 返回主菜单")
     
     def handle_chat_menu(self):
         """处理聊天菜单"""
@@ -202,10 +294,13 @@ class DeepSeekCLIClient:
             elif choice == "4":
                 self.delete_message()
             elif choice == "5":
+                self.edit_context_settings()
+            elif choice == "6":
                 break
             else:
                 print("无效选择，请重新输入")
     
+    @profile_phase("list_messages")
     def list_messages(self):
         """查看聊天历史"""
         print(f"\n===== 聊天历史 - {self.current_session} =====")
@@ -223,6 +318,9 @@ class DeepSeekCLIClient:
             print(f"[{i+1}] {role_text}: {content}")
             if timestamp:
                 print(f"时间: {timestamp}")
+            timing_text = format_timing(message)
+            if timing_text:
+                print(f"耗时: {timing_text}")
             print("-" * 60)
     
     def send_message(self):
@@ -255,77 +353,82 @@ class DeepSeekCLIClient:
             "timestamp": timestamp
         }
         
-        self.sessions[self.current_session].append(user_message)
+        count_message(user_message)
+        self.store.append_message(self.current_session, user_message)
         print("\n发送中...")
         
         # 发送到API
         self.send_to_api()
-        self.save_sessions()
     
+    def request_history(self, config, session_name):
+        """读取发送请求需要的历史（只读取上下文配置保留的部分，不加载整个会话）"""
+        count = self.store.session_info(session_name)["count"]
+        return load_history(config, session_name, count, self.store.load_range)
+    
+    @profile_phase("send_to_api")
     def send_to_api(self):
         """发送消息到API"""
-        # 构建请求体
-        messages = []
-        
-        # 添加系统消息
-        messages.append({"role": "system", "content": "You are a helpful assistant."})
-        
-        # 添加对话历史
-        for msg in self.sessions[self.current_session]:
-            messages.append({"role": msg["role"], "content": msg["content"]})
-        
-        # 构建请求数据
-        data = {
-            "model": self.config["model"],
-            "messages": messages,
-            "temperature": self.config["temperature"],
-            "max_tokens": self.config["max_tokens"],
-            "top_p": self.config["top_p"],
-            "frequency_penalty": self.config["frequency_penalty"],
-            "presence_penalty": self.config["presence_penalty"]
-        }
+        printed = []
         
-        # 发送请求
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.config['api_key']}"
-        }
+        def print_delta(delta):
+            # 流式模式下边接收边打印，整段回复结束后再保存
+            if not printed:
+                print("\n助手: ", end="", flush=True)
+            printed.append(delta)
+            print(delta, end="", flush=True)
         
         try:
-            response = requests.post(
-                "https://api.deepseek.com/v1/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30
-            )
+            result = self.loop.run_until_complete(self.api.chat(
+                self.config,
+                self.request_history(self.config, self.current_session),
+                on_delta=print_delta,
+                session=self.current_session
+            ))
+            assistant_message = result["content"]
             
-            if response.status_code == 200:
-                result = response.json()
-                assistant_message = result["choices"][0]["message"]["content"]
-                
-                # 添加助手消息
-                timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-                assistant_msg = {
-                    "role": "assistant",
-                    "content": assistant_message,
-                    "timestamp": timestamp
-                }
-                
-                self.sessions[self.current_session].append(assistant_msg)
-                print("\n助手:", assistant_message)
-                print("-" * 60)
+            if printed:
+                print()
             else:
-                # 添加错误消息
-                error_message = f"API错误: {response.text} (状态码: {response.status_code})"
-                timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-                error_msg = {
-                    "role": "system",
-                    "content": error_message,
-                    "timestamp": timestamp
-                }
-                
-                self.sessions[self.current_session].append(error_msg)
-                print("\n错误:", error_message)
+                print("\n助手:", assistant_message)
+            
+            # 添加助手消息
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+            assistant_msg = {
+                "role": "assistant",
+                "content": assistant_message,
+                "timestamp": timestamp
+            }
+            # 记录重试次数、各阶段耗时等请求元数据
+            assistant_msg.update(result["meta"])
+            
+            count_message(assistant_msg)
+            started_at = time.perf_counter()
+            self.store.append_message(self.current_session, assistant_msg)
+            persist_time = time.perf_counter() - started_at
+            observe_persist(self.config, "append", persist_time)
+            timing_text = format_timing(assistant_msg, persist_time * 1000)
+            if timing_text:
+                print(f"耗时: {timing_text}")
+            print("-" * 60)
+        except APIError as e:
+            # 添加错误消息
+            error_message = str(e)
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+            error_msg = {
+                "role": "system",
+                "content": error_message,
+                "timestamp": timestamp
+            }
+            # 记录请求 ID，便于与日志中的失败记录对应
+            if getattr(e, "request_id", None):
+                error_msg["request_id"] = e.request_id
+            if getattr(e, "retries", 0):
+                error_msg["retries"] = e.retries
+                error_message += f" (已重试 {e.retries} 次)"
+            
+            count_message(error_msg)
+            self.store.append_message(self.current_session, error_msg)
+            print("\n错误:", error_message)
         except Exception as e:
             # 添加错误消息
             error_message = f"网络错误: {str(e)}"
@@ -335,8 +438,15 @@ class DeepSeekCLIClient:
                 "content": error_message,
                 "timestamp": timestamp
             }
+            # 记录请求 ID，便于与日志中的失败记录对应
+            if getattr(e, "request_id", None):
+                error_msg["request_id"] = e.request_id
+            if getattr(e, "retries", 0):
+                error_msg["retries"] = e.retries
+                error_message += f" (已重试 {e.retries} 次)"
             
-            self.sessions[self.current_session].append(error_msg)
+            count_message(error_msg)
+            self.store.append_message(self.current_session, error_msg)
             print("\n错误:", error_message)
     
     def edit_message(self):
@@ -364,10 +474,12 @@ class DeepSeekCLIClient:
             
             new_content = "\n".join(new_lines)
             if new_content:
-                message["content"] = new_content
-                message["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+                new_message = dict(message)
+                new_message["content"] = new_content
+                new_message["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+                count_message(new_message)
+                self.store.update_message(self.current_session, msg_index, new_message)
                 print("消息编辑成功")
-                self.save_sessions()
         except ValueError:
             print("无效的输入")
     
@@ -381,12 +493,49 @@ class DeepSeekCLIClient:
                 print("无效的消息序号")
                 return
             
-            self.sessions[self.current_session].pop(msg_index)
+            self.store.delete_message(self.current_session, msg_index)
             print("消息删除成功")
-            self.save_sessions()
         except ValueError:
             print("无效的输入")
     
+    def edit_context_settings(self):
+        """编辑当前会话的上下文设置"""
+        print(f"\n===== 上下文设置 - {self.current_session} =====")
+        for key, value in context_settings(self.config, self.current_session).items():
+            print(f"{key}: {value}")
+        print("请输入要修改的配置项 (输入 'exit' 退出，新值留空表示恢复为全局配置):")
+        
+        overrides = dict(self.config["session_context"].get(self.current_session, {}))
+        while True:
+            key = input("配置项: ")
+            if key == "exit":
+                break
+            
+            if key in CONTEXT_KEYS:
+                new_value = input("新值: ")
+                if not new_value:
+                    overrides.pop(key, None)
+                    print(f"{key} 已恢复为全局配置")
+                    continue
+                
+                if key in ["context_max_tokens", "context_max_turns"]:
+                    try:
+                        overrides[key] = int(new_value)
+                    except ValueError:
+                        print("无效的数值，请输入整数")
+                        continue
+                else:
+                    overrides[key] = new_value.strip().lower() in ["1", "true", "yes", "y", "on"]
+                print(f"{key} 已更新为: {overrides[key]}")
+            else:
+                print("无效的配置项")
+        
+        if overrides:
+            self.config["session_context"][self.current_session] = overrides
+        else:
+            self.config["session_context"].pop(self.current_session, None)
+        self.save_config()
+    
     def print_config_menu(self):
         """打印配置菜单"""
         print("\n===== 配置管理 =====")
@@ -414,40 +563,43 @@ class DeepSeekCLIClient:
         print("\n===== 当前配置 =====")
         for key, value in self.config.items():
             print(f"{key}: {value}")
+        
+        cache = get_response_cache(self.config)
+        if cache is not None:
+            stats = cache.stats()
+            print(f"响应缓存: 命中 {stats['hits']} 次，未命中 {stats['misses']} 次，共 {stats['entries']} 条")
+        if self.config["rate_limit_rpm"] or self.config["rate_limit_tpm"]:
+            print(f"速率限制: 当前排队请求 {get_rate_limiter(self.config).queue_depth} 个")
         print()
     
     def edit_config(self):
         """编辑配置"""
         print("\n===== 编辑配置 =====")
         print("请输入要修改的配置项 (输入 'exit' 退出):")
-        print("可用配置项: api_key, model, temperature, max_tokens, top_p, frequency_penalty, presence_penalty")
+        print("可用配置项: " + ", ".join(self.config))
         
         while True:
             key = input("配置项: ")
             if key == "exit":
                 break
             
-            if key in self.config:
+            if key == "session_context":
+                print("请在聊天菜单的“上下文设置”中按会话修改")
+            elif key in self.config:
                 current_value = self.config[key]
                 print(f"当前值: {current_value}")
                 
                 new_value = input("新值: ")
                 if new_value:
                     # 根据配置项类型转换值
-                    if key in ["temperature", "top_p"]:
-                        try:
-                            self.config[key] = float(new_value)
-                        except ValueError:
-                            print("无效的数值，请输入数字")
-                            continue
-                    elif key in ["max_tokens", "frequency_penalty", "presence_penalty"]:
-                        try:
-                            self.config[key] = int(new_value)
-                        except ValueError:
+                    try:
+                        self.config[key] = convert_config_value(key, new_value)
+                    except ValueError:
+                        if key in INT_CONFIG_KEYS:
                             print("无效的数值，请输入整数")
-                            continue
-                    else:
-                        self.config[key] = new_value
+                        else:
+                            print("无效的数值，请输入数字")
+                        continue
                     
                     print(f"{key} 已更新为: {self.config[key]}")
             else:
@@ -455,6 +607,311 @@ class DeepSeekCLIClient:
         
         self.save_config()
 
+    def run_batch(self, input_path, output_path, concurrency=None, use_cache=True):
+        """批量执行 JSONL 文件中的提示词，结果写入 output_path"""
+        if concurrency is None:
+            concurrency = int(self.config["batch_concurrency"])
+        runner = BatchRunner(self.config, self.api, self.store, output_path, concurrency, use_cache)
+        counts = self.loop.run_until_complete(runner.run(input_path))
+        return 1 if counts["failed"] else 0
+    
+    @profile_phase("send_to_api")
+    def request_reply(self, config, history, session=None, use_cache=True):
+        """命令行模式下发送请求，回复写到标准输出，返回回复结果"""
+        def print_delta(delta):
+            sys.stdout.write(delta)
+            sys.stdout.flush()
+        
+        result = self.loop.run_until_complete(self.api.chat(
+            config, history, on_delta=print_delta, session=session, use_cache=use_cache
+        ))
+        # 流式模式下内容已经逐段输出
+        if not config.get("stream"):
+            sys.stdout.write(result["content"])
+        sys.stdout.write("\n")
+        return result
+    
+    def command_chat(self, args):
+        """chat: 单轮提问，不读写任何会话"""
+        config = request_config_from_args(self.config, args)
+        history = [{"role": "user", "content": read_prompt(args.prompt)}]
+        try:
+            result = self.request_reply(config, history, use_cache=not args.no_cache)
+        except Exception as e:
+            print(format_error(e), file=sys.stderr)
+            return 1
+        if args.timing:
+            print(format_timing(result["meta"]), file=sys.stderr)
+        return 0
+    
+    def command_send(self, args):
+        """send: 在会话中发送消息，提问和回复都记录到会话中"""
+        session_name = args.session
+        if session_name not in self.sessions:
+            self.store.create_session(session_name)
+        
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        user_message = {"role": "user", "content": read_prompt(args.prompt), "timestamp": timestamp}
+        count_message(user_message)
+        self.store.append_message(session_name, user_message)
+        
+        config = request_config_from_args(self.config, args)
+        try:
+            result = self.request_reply(config, self.request_history(config, session_name), session=session_name,
+                                        use_cache=not args.no_cache)
+        except Exception as e:
+            error_message = format_error(e)
+            error_msg = {"role": "system", "content": error_message, "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")}
+            if getattr(e, "request_id", None):
+                error_msg["request_id"] = e.request_id
+            if getattr(e, "retries", 0):
+                error_msg["retries"] = e.retries
+            count_message(error_msg)
+            self.store.append_message(session_name, error_msg)
+            print(error_message, file=sys.stderr)
+            return 1
+        
+        assistant_msg = {"role": "assistant", "content": result["content"], "timestamp": time.strftime("%Y-%m-%d %H:%M:%S")}
+        assistant_msg.update(result["meta"])
+        count_message(assistant_msg)
+        started_at = time.perf_counter()
+        self.store.append_message(session_name, assistant_msg)
+        persist_time = time.perf_counter() - started_at
+        observe_persist(self.config, "append", persist_time)
+        if args.timing:
+            print(format_timing(assistant_msg, persist_time * 1000), file=sys.stderr)
+        return 0
+    
+    def command_sessions(self, args):
+        """sessions list/create/delete"""
+        if args.action == "list":
+            for session_name in self.sessions:
+                info = self.store.session_info(session_name)
+                updated_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(info["updated_at"])) if info["updated_at"] else "-"
+                print(f"{session_name}\t{info['count']}\t{updated_at}")
+            return 0
+        
+        if not args.name:
+            print("请指定会话名称", file=sys.stderr)
+            return 2
+        if args.action == "create":
+            if args.name in self.sessions:
+                print(f"会话 '{args.name}' 已存在", file=sys.stderr)
+                return 1
+            self.store.create_session(args.name)
+        else:
+            if args.name == "默认会话":
+                print("默认会话不能删除", file=sys.stderr)
+                return 1
+            if args.name not in self.sessions:
+                print(f"会话 '{args.name}' 不存在", file=sys.stderr)
+                return 1
+            self.store.delete_session(args.name)
+        return 0
+    
+    def command_export(self, args):
+        """export: 把会话导出到标准输出"""
+        names = args.sessions or list(self.sessions)
+        for session_name in names:
+            if session_name not in self.sessions:
+                print(f"会话 '{session_name}' 不存在", file=sys.stderr)
+                return 1
+        
+        if args.format == "json":
+            data = {session_name: list(self.sessions[session_name]) for session_name in names}
+            json.dump(data, sys.stdout, ensure_ascii=False, indent=2)
+            sys.stdout.write("\n")
+            return 0
+        
+        for session_name in names:
+            if args.format == "markdown":
+                print(f"# {session_name}\n")
+            else:
+                print(f"===== {session_name} =====")
+            for msg in self.sessions[session_name]:
+                role_text = {"user": "用户", "assistant": "助手"}.get(msg["role"], "系统")
+                if args.format == "markdown":
+                    print(f"**{role_text}** ({msg.get('timestamp', '')})\n\n{msg['content']}\n")
+                else:
+                    print(f"[{msg.get('timestamp', '')}] {role_text}: {msg['content']}")
+            print()
+        return 0
+    
+    def command_search(self, args):
+        """search: 在所有会话中全文搜索消息"""
+        query = " ".join(args.query)
+        for hit in self.store.search(query, args.limit):
+            role_text = {"user": "用户", "assistant": "助手"}.get(hit["role"], "系统")
+            print(f"{hit['session']}\t#{hit['index'] + 1}\t{role_text}\t{hit['timestamp']}\t{hit['snippet']}")
+        return 0
+    
+    def command_semantic(self, args):
+        """semantic: 按语义查找相近的消息，先为新增的消息计算向量"""
+        # 语义搜索依赖 numpy，只在使用时导入，不拖慢其他命令的启动
+        from semantic_index import create_semantic_index, semantic_results
+        
+        try:
+            index = create_semantic_index(self.config)
+        except ValueError as e:
+            print(str(e), file=sys.stderr)
+            return 1
+        if index is None:
+            print("未开启语义搜索，请先设置 embedding_backend (api 或 local)", file=sys.stderr)
+            return 1
+        
+        def report(done, total):
+            print(f"\r计算向量 {done}/{total}", end="", file=sys.stderr, flush=True)
+        
+        reader = self.store.open_reader()
+        try:
+            if index.sync(reader, report):
+                print(file=sys.stderr)
+            hits = index.query(" ".join(args.query), args.limit)
+        except Exception as e:
+            print(format_error(e), file=sys.stderr)
+            return 1
+        finally:
+            reader.close()
+        for hit in semantic_results(self.store, hits):
+            role_text = {"user": "用户", "assistant": "助手"}.get(hit["role"], "系统")
+            print(f"{hit['session']}\t#{hit['index'] + 1}\t{role_text}\t{hit['score']:.3f}\t{hit['snippet']}")
+        return 0
+    
+    def command_config(self, args):
+        """config get/set"""
+        if args.action == "get":
+            if args.key is None:
+                json.dump(self.config, sys.stdout, ensure_ascii=False, indent=2)
+                sys.stdout.write("\n")
+            elif args.key in self.config:
+                value = self.config[args.key]
+                print(value if isinstance(value, str) else json.dumps(value, ensure_ascii=False))
+            else:
+                print(f"无效的配置项: {args.key}", file=sys.stderr)
+                return 1
+            return 0
+        
+        if args.key is None or args.value is None:
+            print("用法: config set KEY VALUE", file=sys.stderr)
+            return 2
+        if args.key not in self.config or args.key == "session_context":
+            print(f"无效的配置项: {args.key}", file=sys.stderr)
+            return 1
+        try:
+            self.config[args.key] = convert_config_value(args.key, args.value)
+        except ValueError:
+            print(f"无效的数值: {args.value}", file=sys.stderr)
+            return 1
+        with open("config.json", "w", encoding="utf-8") as f:
+            json.dump(self.config, f, ensure_ascii=False, indent=2)
+        return 0
+
+def read_prompt(words):
+    """从命令行参数读取提示词，未提供或为 '-' 时读取标准输入"""
+    if words and words != ["-"]:
+        return " ".join(words)
+    return sys.stdin.read().strip()
+
+def request_config_from_args(config, args):
+    """合并命令行中指定的模型和参数"""
+    config = dict(config)
+    if args.model:
+        config["model"] = args.model
+    if args.temperature is not None:
+        config["temperature"] = args.temperature
+    if args.stream:
+        config["stream"] = True
+    return config
+
+def format_error(e):
+    """把请求异常转换为错误提示"""
+    error_message = str(e) if isinstance(e, APIError) else f"网络错误: {str(e)}"
+    if getattr(e, "retries", 0):
+        error_message += f" (已重试 {e.retries} 次)"
+    return error_message
+
+def build_parser():
+    """构建命令行参数解析器"""
+    parser = argparse.ArgumentParser(description="DeepSeek API 客户端 (CLI)，不带参数时进入交互菜单")
+    parser.add_argument("--profile", nargs="?", const=DEFAULT_PROFILE_DIR, metavar="DIR",
+                        help=f"剖析启动、请求、保存等阶段，退出时把报告写入 DIR 下按时间命名的子目录（默认 {DEFAULT_PROFILE_DIR}）")
+    subparsers = parser.add_subparsers(dest="command")
+    
+    request_options = argparse.ArgumentParser(add_help=False)
+    request_options.add_argument("prompt", nargs="*", help="提示词，省略或为 '-' 时从标准输入读取")
+    request_options.add_argument("-m", "--model", help="本次请求使用的模型")
+    request_options.add_argument("-t", "--temperature", type=float, help="本次请求的温度")
+    request_options.add_argument("--stream", action="store_true", help="流式输出回复")
+    request_options.add_argument("--timing", action="store_true", help="在标准错误输出各阶段耗时、收发字节数和 token 用量")
+    request_options.add_argument("--no-cache", action="store_true", help="本次请求不使用响应缓存")
+    
+    subparsers.add_parser("chat", parents=[request_options], help="单轮提问，不记录到会话")
+    send_parser = subparsers.add_parser("send", parents=[request_options], help="在会话中发送消息并记录回复")
+    send_parser.add_argument("-s", "--session", default="默认会话", help="会话名称（不存在时自动创建）")
+    
+    sessions_parser = subparsers.add_parser("sessions", help="列出、创建或删除会话")
+    sessions_parser.add_argument("action", choices=["list", "create", "delete"])
+    sessions_parser.add_argument("name", nargs="?", help="会话名称")
+    
+    export_parser = subparsers.add_parser("export", help="导出会话到标准输出")
+    export_parser.add_argument("sessions", nargs="*", help="要导出的会话，省略时导出全部")
+    export_parser.add_argument("-f", "--format", choices=["json", "markdown", "text"], default="json")
+    
+    search_parser = subparsers.add_parser("search", help="在所有会话中全文搜索消息")
+    search_parser.add_argument("query", nargs="+", help="关键词，多个关键词须同时出现")
+    search_parser.add_argument("-n", "--limit", type=int, default=20, help="最多显示的结果数（默认 20）")
+    
+    semantic_parser = subparsers.add_parser("semantic", help="按语义查找相近的消息（需配置 embedding_backend）")
+    semantic_parser.add_argument("query", nargs="+", help="要查找的内容")
+    semantic_parser.add_argument("-n", "--limit", type=int, default=10, help="最多显示的结果数（默认 10）")
+    
+    config_parser = subparsers.add_parser("config", help="读取或修改配置")
+    config_parser.add_argument("action", choices=["get", "set"])
+    config_parser.add_argument("key", nargs="?")
+    config_parser.add_argument("value", nargs="?")
+    
+    serve_parser = subparsers.add_parser("serve", help="启动本地 OpenAI 兼容代理服务")
+    serve_parser.add_argument("--host", default="127.0.0.1", help="监听地址（默认 127.0.0.1）")
+    serve_parser.add_argument("--port", type=int, default=8000, help="监听端口（默认 8000）")
+    
+    batch_parser = subparsers.add_parser("batch", help="批量执行 JSONL 文件中的提示词")
+    batch_parser.add_argument("input", help="输入文件，每行一个 JSON：prompt 或 messages，可选 id、session、model、params")
+    batch_parser.add_argument("output", help="结果文件，每完成一条追加一行；重新运行时跳过已成功的条目")
+    batch_parser.add_argument("-j", "--concurrency", type=int, help="并发请求数（默认使用配置 batch_concurrency）")
+    batch_parser.add_argument("--no-cache", action="store_true", help="本次批量请求不使用响应缓存")
+    return parser
+
+def run_command(args):
+    """创建客户端并执行命令，不带命令时进入交互菜单"""
+    try:
+        client = DeepSeekCLIClient()
+    except SessionStoreError as e:
+        print(str(e), file=sys.stderr)
+        shutdown_logging()
+        return 1
+    if args.command is None:
+        client.handle_main_menu()
+        return 0
+    
+    try:
+        if args.command == "batch":
+            return client.run_batch(args.input, args.output, args.concurrency, not args.no_cache)
+        if args.command == "serve":
+            return serve(client.config, args.host, args.port)
+        return getattr(client, f"command_{args.command}")(args)
+    finally:
+        client.close()
+
+def main():
+    args = build_parser().parse_args()
+    if args.profile:
+        start_profiling(args.profile)
+    try:
+        return run_command(args)
+    finally:
+        report_dir = stop_profiling()
+        if report_dir:
+            print(f"剖析报告已写入: {report_dir}", file=sys.stderr)
+
 if __name__ == "__main__":
-    client = DeepSeekCLIClient()
-    client.handle_main_menu()
+    sys.exit(main())
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+"""
+上下文窗口管理模块
+在每次请求前裁剪对话历史：去掉错误提示、保留最近若干轮、控制 token 预算，
+并可把被裁掉的早期对话替换为缓存的摘要
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from token_counter import message_tokens
+from structured_log import get_logger
+
+logger = get_logger("context")
+
+# 上下文相关配置项，可在 config.json 的 session_context 中按会话覆盖
+CONTEXT_KEYS = ("context_max_tokens", "context_max_turns", "context_drop_errors", "context_summary")
+SUMMARY_PREFIX = "以下是之前对话的摘要：\n"
+
+
+def context_settings(config, session):
+    """返回某个会话生效的上下文配置"""
+    settings = {key: config.get(key) for key in CONTEXT_KEYS}
+    overrides = config.get("session_context", {}).get(session, {})
+    settings.update({key: value for key, value in overrides.items() if key in CONTEXT_KEYS})
+    return settings
+
+
+def split_turns(messages):
+    """按用户消息把历史切分为若干轮，每轮以一条用户消息开头"""
+    turns = []
+    for message in messages:
+        if message["role"] == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def trim_history(messages, settings):
+    """裁剪对话历史，返回 (保留的消息, 被裁掉的消息)"""
+    # 会话中的 system 消息都是本地记录的错误提示，对模型没有意义
+    if settings.get("context_drop_errors"):
+        messages = [message for message in messages if message["role"] != "system"]
+
+    turns = split_turns(messages)
+    max_turns = int(settings.get("context_max_turns") or 0)
+    max_tokens = int(settings.get("context_max_tokens") or 0)
+
+    # 从最新一轮往前保留，最新一轮（当前提问）无论大小都会发送
+    kept = 0
+    total = 0
+    for turn in reversed(turns):
+        if max_turns and kept >= max_turns:
+            break
+        turn_tokens = sum(message_tokens(message) for message in turn)
+        if max_tokens and kept and total + turn_tokens > max_tokens:
+            break
+        kept += 1
+        total += turn_tokens
+
+    split = len(turns) - kept
+    dropped = [message for turn in turns[:split] for message in turn]
+    kept_messages = [message for turn in turns[split:] for message in turn]
+    return kept_messages, dropped
+
+
+def load_history(config, session, count, load_range, page_size=200):
+    """按会话的上下文配置读取请求需要的历史，不必把整个会话载入内存
+
+    load_range(session, start, stop) 读取一段消息，count 为会话的消息数。
+    只设了轮数或 token 上限时从末尾向前分页读取，直到最早读到的（可能不完整的）一轮会被裁掉为止，
+    此时 trim_history 的结果与基于完整历史时相同；开启 context_summary 或未设上限时需要全部历史。
+    """
+    settings = context_settings(config, session)
+    limited = settings.get("context_max_turns") or settings.get("context_max_tokens")
+    if not limited or settings.get("context_summary"):
+        return load_range(session, 0, count)
+
+    start = count
+    messages = []
+    while start > 0:
+        stop = start
+        start = max(0, start - page_size)
+        messages = load_range(session, start, stop) + messages
+        if trim_history(messages, settings)[1]:
+            break
+        # 每次读取的页大小翻倍，上限很大时总的裁剪次数也只是对数级
+        page_size *= 2
+    return messages
+
+
+def messages_hash(messages):
+    """计算一组消息的哈希，用于判断摘要缓存是否仍然有效"""
+    digest = hashlib.sha1()
+    for message in messages:
+        digest.update(message["role"].encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(message["content"].encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class SummaryCache:
+    """按会话缓存早期对话的摘要，保存在 context_summaries.json"""
+
+    def __init__(self, path="context_summaries.json"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def load(self):
+        """首次使用时读取缓存文件"""
+        if self.entries is None:
+            self.entries = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        self.entries = json.load(f)
+                except Exception as e:
+                    logger.warning("加载摘要缓存失败: %s", e)
+
+    def get(self, session):
+        """返回会话的摘要缓存项"""
+        with self.lock:
+            self.load()
+            return self.entries.get(session)
+
+    def put(self, session, entry):
+        """保存会话的摘要缓存项"""
+        with self.lock:
+            self.load()
+            self.entries[session] = entry
+            try:
+                with open(self.path, "w", encoding="utf-8") as f:
+                    json.dump(self.entries, f, ensure_ascii=False, indent=2)
+            except Exception as e:
+                logger.warning("保存摘要缓存失败: %s", e)
+
+
+summary_cache = SummaryCache()
+
+
+def summarize_dropped(session, dropped, summarize):
+    """返回被裁掉消息的摘要，尽量复用缓存，只对新增部分增量总结"""
+    entry = summary_cache.get(session)
+    count = len(dropped)
+    if entry and entry["count"] <= count and entry["hash"] == messages_hash(dropped[:entry["count"]]):
+        if entry["count"] == count:
+            return entry["summary"]
+        # 之前的摘要仍然有效，只需把新裁掉的消息并入
+        summary = summarize(dropped[entry["count"]:], entry["summary"])
+    else:
+        summary = summarize(dropped, None)
+
+    summary_cache.put(session, {"count": count, "hash": messages_hash(dropped), "summary": summary})
+    return summary
+
+
+def build_context(config, session, history, summarize=None):
+    """根据会话的上下文配置生成本次请求要发送的历史消息
+
+    summarize(messages, previous_summary) 用于生成摘要，仅在开启 context_summary 时调用。
+    """
+    settings = context_settings(config, session)
+    kept, dropped = trim_history(history, settings)
+    if not dropped or not settings.get("context_summary") or summarize is None:
+        return kept
+
+    try:
+        summary = summarize_dropped(session, dropped, summarize)
+    except Exception as e:
+        # 摘要失败时退化为直接裁剪，不影响本次请求
+        logger.warning("生成对话摘要失败: %s", e)
+        return kept
+    return [{"role": "system", "content": SUMMARY_PREFIX + summary}] + kept
@@ -8,12 +8,32 @@ DeepSeek API 客户端 (GUI 版本)
 
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
+import argparse
+import asyncio
 import json
-import requests
 import os
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api_client import APIError, RequestCancelled
+from async_client import AsyncChatClient
+from context_window import load_history
+from metrics import get_metrics, observe_persist, shutdown_metrics
+from profiler import DEFAULT_PROFILE_DIR, profile_phase, start_profiling, stop_profiling
+from rate_limiter import get_rate_limiter
+from request_timing import format_timing
+from response_cache import get_response_cache
+from session_index import PrefixIndex
+from session_store import SessionStoreError, open_session_store
+from structured_log import get_logger, setup_logging, shutdown_logging
+from token_counter import count_message, load_tokenizer
+
+logger = get_logger("gui")
 
 class DeepSeekClient:
+    @profile_phase("startup")
     def __init__(self, root):
         self.root = root
         self.root.title("DeepSeek API 客户端")
@@ -23,12 +43,50 @@ class DeepSeekClient:
         # 配置数据
         self.config = {
             "api_key": "YOUR_API_KEY_HERE",
+            "api_endpoint": "https://api.deepseek.com/v1/chat/completions",
             "model": "deepseek-chat",
             "temperature": 0.7,
             "max_tokens": 2048,
             "top_p": 0.95,
             "frequency_penalty": 0,
-            "presence_penalty": 0
+            "presence_penalty": 0,
+            "stream": False,
+            "connect_timeout": 10,
+            "read_timeout": 30,
+            "pool_connections": 4,
+            "pool_maxsize": 10,
+            "keep_alive": True,
+            "http2": False,
+            "context_max_tokens": 32000,
+            "context_max_turns": 0,
+            "context_drop_errors": True,
+            "context_summary": False,
+            "session_context": {},
+            "tokenizer_path": "",
+            "cache_enabled": False,
+            "cache_ttl": 86400,
+            "cache_max_entries": 1000,
+            "max_retries": 3,
+            "retry_backoff_base": 1.0,
+            "retry_backoff_max": 30.0,
+            "rate_limit_rpm": 0,
+            "rate_limit_tpm": 0,
+            "worker_threads": 4,
+            "chat_window_size": 200,
+            "storage_backend": "sqlite",
+            "session_cache_size": 8,
+            "journal_compact_events": 1000,
+            "embedding_backend": "",
+            "embedding_model": "",
+            "embedding_endpoint": "",
+            "embedding_batch_size": 64,
+            "metrics_port": 0,
+            "metrics_host": "127.0.0.1",
+            "metrics_textfile": "",
+            "metrics_textfile_interval": 15,
+            "log_file": "",
+            "log_level": "WARNING",
+            "log_sample_rate": 1.0
         }
         
         # 会话数据
@@ -36,12 +94,38 @@ class DeepSeekClient:
         self.current_session = "默认会话"
         
         # 加载配置和会话
-        self.load_config()
+        config_error = self.load_config()
+        # 结构化日志在加载配置后尽早设置，之后的加载错误都能写入日志
+        setup_logging(self.config)
+        if config_error is not None:
+            logger.warning("加载配置失败: %s", config_error)
+        load_tokenizer(self.config["tokenizer_path"])
         self.load_sessions()
+        # 配置了 metrics_port 或 metrics_textfile 时启动指标导出
+        get_metrics(self.config)
+        
+        # 后台请求：所有请求在同一个事件循环线程中并发执行，结果经队列交回界面线程处理
+        self.loop = asyncio.new_event_loop()
+        # 未安装 httpx 时同步请求在该线程池中执行
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers=max(1, int(self.config["worker_threads"]))))
+        self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        self.api = AsyncChatClient()
+        self.result_queue = queue.Queue()
+        # 等待回复的会话 -> 取消事件
+        self.pending_requests = {}
+        # 等待回复的会话 -> 请求任务
+        self.request_futures = {}
+        # 流式回复中已收到的增量文本，按会话缓存
+        self.stream_buffers = {}
         
         # 创建主框架
         self.create_main_frame()
         
+        # 轮询后台结果，窗口关闭时停止后台请求
+        self.root.after(50, self.poll_results)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        
     def create_main_frame(self):
         """创建主框架"""
         # 创建分割视图
@@ -60,7 +144,9 @@ class DeepSeekClient:
         self.tab_control = ttk.Notebook(self.right_frame)
         self.chat_tab = ttk.Frame(self.tab_control)
         self.config_tab = ttk.Frame(self.tab_control)
+        self.search_tab = ttk.Frame(self.tab_control)
         self.tab_control.add(self.chat_tab, text="聊天")
+        self.tab_control.add(self.search_tab, text="搜索")
         self.tab_control.add(self.config_tab, text="配置")
         self.tab_control.pack(fill=tk.BOTH, expand=True)
         
@@ -70,14 +156,20 @@ class DeepSeekClient:
         # 创建聊天面板
         self.create_chat_panel()
         
+        # 创建搜索面板
+        self.create_search_panel()
+        
         # 创建配置面板
         self.create_config_panel()
         
         # 创建状态栏
         self.status_frame = ttk.Frame(self.root, height=20)
         self.status_frame.pack(fill=tk.X, side=tk.BOTTOM)
+        self.token_label = ttk.Label(self.status_frame, text="", relief=tk.SUNKEN, anchor=tk.E)
+        self.token_label.pack(side=tk.RIGHT, padx=5, pady=2)
         self.status_label = ttk.Label(self.status_frame, text="就绪", relief=tk.SUNKEN, anchor=tk.W)
         self.status_label.pack(fill=tk.X, padx=5, pady=2)
+        self.update_token_status()
     
     def create_session_panel(self):
         """创建会话管理面板"""
@@ -91,8 +183,17 @@ class DeepSeekClient:
                 ttk.Label(self.session_frame, text="会话管理", font=("Arial", 12, "bold")).pack(pady=10)
         
         # 会话列表
+        # 输入会话名开头即可筛选，回车切换到第一个匹配的会话
+        self.session_filter_var = tk.StringVar()
+        filter_entry = ttk.Entry(self.session_frame, textvariable=self.session_filter_var)
+        filter_entry.pack(fill=tk.X, padx=10, pady=(0, 5))
+        filter_entry.bind("<Return>", self.switch_to_first_match)
+        self.session_filter_var.trace_add("write", lambda *args: self.update_session_list())
+        
         self.session_listbox = tk.Listbox(self.session_frame, height=15)
         self.session_listbox.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        # 列表中当前显示的 (会话名, 显示文本)，用于只更新变化的列表项
+        self.listed_sessions = []
         self.update_session_list()
         
         # 会话操作按钮
@@ -119,6 +220,20 @@ class DeepSeekClient:
         self.chat_history.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
         self.chat_history.config(state=tk.DISABLED)
         
+        # 绑定键盘事件
+        self.chat_history.bind("<Up>", self.select_previous_message)
+        self.chat_history.bind("<Down>", self.select_next_message)
+        self.chat_history.bind("<space>", self.confirm_message_selection)
+        
+        # 只显示会话中 [rendered_start, rendered_end) 范围的消息，滚动到顶部或底部时再加载相邻的消息
+        self.chat_history.config(yscrollcommand=self.on_chat_scroll)
+        self.rendered_session = None
+        self.rendered_start = 0
+        self.rendered_end = 0
+        self.rendered_total = 0
+        self.scroll_job = None
+        self.selected_message_index = -1
+        
         # 消息操作提示
         message_hint_frame = ttk.Frame(self.chat_tab)
         message_hint_frame.pack(fill=tk.X, padx=10, pady=5)
@@ -133,14 +248,161 @@ class DeepSeekClient:
         self.message_entry = scrolledtext.ScrolledText(input_frame, wrap=tk.WORD, height=4)
         self.message_entry.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
         
-        # 发送按钮
+        # 发送和取消按钮，以及本次请求跳过响应缓存的开关
+        ttk.Button(input_frame, text="取消", command=self.cancel_request).pack(side=tk.RIGHT, padx=5, pady=5)
         ttk.Button(input_frame, text="发送", command=self.send_message).pack(side=tk.RIGHT, padx=5, pady=5)
+        self.no_cache_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(input_frame, text="不使用缓存", variable=self.no_cache_var).pack(side=tk.RIGHT, padx=5, pady=5)
         
         # 绑定组合键发送消息（Ctrl+Enter）
         self.message_entry.bind("<Control-Return>", lambda event: self.send_message())
         # 确保按Enter键换行，而不是发送消息
         self.message_entry.bind("<Return>", lambda event: "break")
     
+    def create_search_panel(self):
+        """创建搜索面板"""
+        search_frame = ttk.Frame(self.search_tab)
+        search_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(search_frame, textvariable=self.search_var)
+        search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        search_entry.bind("<Return>", lambda event: self.search_messages())
+        ttk.Button(search_frame, text="语义搜索", command=self.semantic_search).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(search_frame, text="搜索", command=self.search_messages).pack(side=tk.RIGHT, padx=5)
+        
+        # 搜索结果，双击跳转到对应会话中的消息
+        columns = ("session", "index", "role", "snippet")
+        self.search_results = ttk.Treeview(self.search_tab, columns=columns, show="headings")
+        for column, text, width in zip(columns, ("会话", "序号", "角色", "内容"), (120, 50, 50, 400)):
+            self.search_results.heading(column, text=text)
+            self.search_results.column(column, width=width, stretch=(column == "snippet"))
+        self.search_results.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.search_results.bind("<Double-1>", self.open_search_result)
+        self.search_hits = {}
+        self.semantic_index = None
+        self.semantic_settings = None
+        self.semantic_future = None
+        # 关闭窗口时置位，后台计算向量在批次之间停止，不拖延退出
+        self.semantic_stop = threading.Event()
+    
+    def search_messages(self):
+        """在所有会话中全文搜索消息"""
+        query = self.search_var.get().strip()
+        self.show_search_hits([])
+        if not query:
+            return
+        
+        started_at = time.perf_counter()
+        hits = self.store.search(query, 200)
+        elapsed = (time.perf_counter() - started_at) * 1000
+        self.show_search_hits(hits)
+        self.status_label.config(text=f"找到 {len(hits)} 条结果（{elapsed:.1f} 毫秒）")
+    
+    def show_search_hits(self, hits):
+        """在搜索结果列表中显示条目"""
+        self.search_results.delete(*self.search_results.get_children())
+        self.search_hits = {}
+        for hit in hits:
+            role_text = {"user": "用户", "assistant": "助手"}.get(hit["role"], "系统")
+            item = self.search_results.insert("", tk.END, values=(hit["session"], hit["index"] + 1, role_text, hit["snippet"]))
+            self.search_hits[item] = hit
+    
+    def semantic_search(self):
+        """按语义查找相近的消息，计算向量和查询在后台线程中进行"""
+        query = self.search_var.get().strip()
+        if not query or self.semantic_future is not None:
+            return
+        
+        config = dict(self.config)
+        config["api_key"] = self.api_key_var.get()
+        # 配置中的向量模型变化后重新创建索引
+        settings = tuple(config.get(key) for key in ("embedding_backend", "embedding_model", "embedding_endpoint"))
+        index = self.semantic_index if self.semantic_settings == settings else None
+        # 界面线程只复制会话元数据；创建索引（本地模型加载较慢）、扫描、计算向量、查询和压缩
+        # 都在线程池中进行，数据库读取使用工作线程自己的连接
+        reader = self.store.open_reader()
+        progress = [0, 0]
+        
+        def work():
+            # 语义搜索依赖 numpy，只在使用时导入
+            from semantic_index import create_semantic_index
+            
+            try:
+                semantic_index = index or create_semantic_index(config)
+                if semantic_index is None:
+                    return None, []
+                semantic_index.sync(reader, lambda done, total: progress.__setitem__(slice(None), [done, total]),
+                                    self.semantic_stop)
+                if self.semantic_stop.is_set():
+                    return None, []
+                return semantic_index, semantic_index.query(query, 50)
+            finally:
+                reader.close()
+        
+        self.semantic_future = asyncio.run_coroutine_threadsafe(self.run_in_executor(work), self.loop)
+        self.status_label.config(text="语义搜索中...")
+        self.root.after(100, self.poll_semantic_search, settings, progress)
+    
+    async def run_in_executor(self, func):
+        """在事件循环的线程池中执行阻塞函数"""
+        return await asyncio.get_running_loop().run_in_executor(None, func)
+    
+    def poll_semantic_search(self, settings, progress):
+        """等待语义搜索完成后显示结果"""
+        from semantic_index import semantic_results
+        
+        future = self.semantic_future
+        if not future.done():
+            if progress[1]:
+                self.status_label.config(text=f"计算向量 {progress[0]}/{progress[1]}...")
+            self.root.after(100, self.poll_semantic_search, settings, progress)
+            return
+        
+        self.semantic_future = None
+        try:
+            index, hits = future.result()
+        except ValueError as e:
+            self.status_label.config(text="语义搜索失败")
+            messagebox.showerror("错误", str(e))
+            return
+        except Exception as e:
+            self.status_label.config(text=f"语义搜索失败: {str(e)}")
+            return
+        if index is None:
+            self.status_label.config(text="就绪")
+            messagebox.showinfo("提示", "未开启语义搜索，请先在配置中设置 embedding_backend (api 或 local)")
+            return
+        
+        # 保留索引，下次搜索只扫描有变化的会话
+        self.semantic_index = index
+        self.semantic_settings = settings
+        results = semantic_results(self.store, hits)
+        self.show_search_hits(results)
+        self.status_label.config(text=f"找到 {len(results)} 条相近的消息")
+    
+    def open_search_result(self, event):
+        """切换到搜索结果所在的会话并选中该消息"""
+        selected = self.search_results.selection()
+        hit = self.search_hits.get(selected[0]) if selected else None
+        if hit is None or hit["session"] not in self.sessions:
+            return
+        
+        self.current_session = hit["session"]
+        self.update_session_list()
+        self.update_chat_history()
+        self.tab_control.select(self.chat_tab)
+        if hit["index"] >= self.message_count(self.current_session):
+            return
+        
+        self.selected_message_index = hit["index"]
+        self.show_message(hit["index"])
+        self.chat_history.tag_remove("sel", 1.0, tk.END)
+        self.chat_history.tag_configure("sel", background="#ffffcc", foreground="#000000")
+        self.chat_history.tag_add("sel", f"msg_{hit['index']}.first", f"msg_{hit['index']}.last")
+        self.chat_history.see(f"msg_{hit['index']}.first")
+        self.chat_history.focus_set()
+    
     def create_config_panel(self):
         """创建配置面板"""
         # 配置表单
@@ -184,17 +446,64 @@ class DeepSeekClient:
         self.presence_penalty_var = tk.IntVar(value=self.config["presence_penalty"])
         ttk.Entry(config_frame, textvariable=self.presence_penalty_var, width=10).grid(row=6, column=1, sticky=tk.W, pady=5)
         
+        # 流式输出
+        ttk.Label(config_frame, text="流式输出:").grid(row=7, column=0, sticky=tk.W, pady=5)
+        self.stream_var = tk.BooleanVar(value=self.config["stream"])
+        ttk.Checkbutton(config_frame, variable=self.stream_var).grid(row=7, column=1, sticky=tk.W, pady=5)
+        
         # 保存配置按钮
-        ttk.Button(config_frame, text="保存配置", command=self.save_config).grid(row=7, column=0, columnspan=3, pady=20)
+        ttk.Button(config_frame, text="保存配置", command=self.save_config).grid(row=8, column=0, columnspan=3, pady=20)
     
     def update_session_list(self):
-        """更新会话列表"""
-        self.session_listbox.delete(0, tk.END)
-        for session in self.sessions:
-            if session == self.current_session:
-                self.session_listbox.insert(tk.END, f"{session} [当前]")
-            else:
-                self.session_listbox.insert(tk.END, session)
+        """更新会话列表：按最后活动时间排序，只改动有变化的列表项"""
+        prefix = self.session_filter_var.get().strip()
+        names = self.session_index.search(prefix) if prefix else list(self.sessions)
+        names.sort(key=lambda name: self.store.session_info(name)["updated_at"], reverse=True)
+        entries = [(name, self.session_label(name)) for name in names]
+        old_entries = self.listed_sessions
+        
+        if len(entries) == len(old_entries) and all(new[0] == old[0] for new, old in zip(entries, old_entries)):
+            # 顺序不变时只替换状态标记有变化的项
+            for index, (new, old) in enumerate(zip(entries, old_entries)):
+                if new != old:
+                    self.session_listbox.delete(index)
+                    self.session_listbox.insert(index, new[1])
+        else:
+            # 跳过首尾相同的部分，只替换中间变化的一段
+            head = 0
+            while head < min(len(entries), len(old_entries)) and entries[head] == old_entries[head]:
+                head += 1
+            tail = 0
+            while (tail < min(len(entries), len(old_entries)) - head and
+                   entries[-1 - tail] == old_entries[-1 - tail]):
+                tail += 1
+            if len(old_entries) - tail > head:
+                self.session_listbox.delete(head, len(old_entries) - tail - 1)
+            labels = [label for name, label in entries[head:len(entries) - tail]]
+            if labels:
+                self.session_listbox.insert(head, *labels)
+        
+        self.listed_sessions = entries
+    
+    def session_label(self, session_name):
+        """会话列表中显示的文本（带状态标记）"""
+        label = session_name
+        if session_name == self.current_session:
+            label += " [当前]"
+        if session_name in self.pending_requests:
+            label += " [等待中]"
+        return label
+    
+    def get_session_name(self, index):
+        """返回会话列表中第 index 项对应的会话名称"""
+        return self.listed_sessions[index][0]
+    
+    def switch_to_first_match(self, event):
+        """切换到筛选结果中的第一个会话"""
+        if self.listed_sessions:
+            self.current_session = self.listed_sessions[0][0]
+            self.update_session_list()
+            self.update_chat_history()
     
     def create_session(self):
         """创建新会话"""
@@ -203,35 +512,34 @@ class DeepSeekClient:
             session_name = f"会话_{int(time.time())}"
         
         if session_name not in self.sessions:
-            self.sessions[session_name] = []
+            self.store.create_session(session_name)
+            self.session_index.add(session_name)
             self.current_session = session_name
             self.update_session_list()
             self.update_chat_history()
             self.session_name_var.set("")
-            self.save_sessions()
     
     def delete_session(self):
         """删除会话"""
         selected = self.session_listbox.curselection()
         if selected:
-            # 获取选中的会话项文本
-            session_item = self.session_listbox.get(selected[0])
-            # 提取实际会话名称（移除" [当前]"标记）
-            session_name = session_item.replace(" [当前]", "")
+            # 提取实际会话名称
+            session_name = self.get_session_name(selected[0])
             
             if session_name != "默认会话":
                 # 确保会话存在于字典中
                 if session_name in self.sessions:
+                    # 放弃该会话尚未完成的请求
+                    self.discard_request(session_name)
                     # 删除会话
-                    del self.sessions[session_name]
+                    self.store.delete_session(session_name)
+                    self.session_index.remove(session_name)
                     # 如果删除的是当前会话，切换到默认会话
                     if session_name == self.current_session:
                         self.current_session = "默认会话"
                     # 更新会话列表和聊天历史
                     self.update_session_list()
                     self.update_chat_history()
-                    # 保存会话
-                    self.save_sessions()
                     # 显示成功消息
                     self.status_label.config(text=f"会话 '{session_name}' 已删除")
                 else:
@@ -246,56 +554,222 @@ class DeepSeekClient:
         """切换会话"""
         selected = self.session_listbox.curselection()
         if selected:
-            session_name = self.session_listbox.get(selected[0])
-            if " [当前]" in session_name:
-                session_name = session_name.replace(" [当前]", "")
+            session_name = self.get_session_name(selected[0])
             
             if session_name in self.sessions:
                 self.current_session = session_name
                 self.update_session_list()
                 self.update_chat_history()
     
-    def update_chat_history(self):
-        """更新聊天历史"""
+    @profile_phase("update_chat_history")
+    def update_chat_history(self, full=False):
+        """更新聊天历史
+
+        只追加上次显示之后新增的消息；切换会话、消息被删除、正在浏览较早的消息
+        或 full=True 时才重新显示最近的一段消息。
+        """
+        count = self.message_count(self.current_session)
+        if (full or self.rendered_session != self.current_session or count < self.rendered_total
+                or self.rendered_end < self.rendered_total):
+            if self.rendered_session != self.current_session:
+                # 初始化当前选中的消息索引
+                self.selected_message_index = -1
+            self.rendered_session = self.current_session
+            self.render_window(max(0, count - self.chat_window_size()), count)
+        else:
+            self.chat_history.config(state=tk.NORMAL)
+            # 去掉上次的等待提示或流式内容，新消息接在已显示的消息之后
+            for tag in ("pending", "streaming"):
+                if self.chat_history.tag_ranges(tag):
+                    self.chat_history.delete(f"{tag}.first", f"{tag}.last")
+            
+            for offset, message in enumerate(self.store.load_range(self.current_session, self.rendered_end, count)):
+                self.insert_message(tk.END, self.rendered_end + offset, message)
+            self.rendered_end = self.rendered_total = count
+            
+            # 超出显示上限时移除最早的消息
+            limit = self.chat_window_size() * 3
+            if self.rendered_end - self.rendered_start > limit:
+                start = self.rendered_end - limit
+                self.chat_history.delete(1.0, f"item_{start}.first")
+                self.rendered_start = start
+            
+            self.insert_placeholder()
+            self.chat_history.config(state=tk.DISABLED)
+        
+        self.chat_history.see(tk.END)
+        self.update_token_status()
+    
+    def chat_window_size(self):
+        """聊天区域一次显示的消息数"""
+        return max(10, int(self.config["chat_window_size"]))
+    
+    def message_count(self, session_name):
+        """返回会话的消息数（不加载消息）"""
+        if session_name not in self.sessions:
+            return 0
+        return self.store.session_info(session_name)["count"]
+    
+    def load_message(self, session_name, i):
+        """从会话存储读取第 i 条消息（不加载整个会话），不存在时返回 None"""
+        messages = self.store.load_range(session_name, i, i + 1)
+        return messages[0] if messages else None
+    
+    def render_window(self, start, count):
+        """清空聊天区域，从会话存储读取并显示 [start, start + 窗口大小) 范围的消息"""
+        end = min(count, start + self.chat_window_size())
         self.chat_history.config(state=tk.NORMAL)
         self.chat_history.delete(1.0, tk.END)
+        if end > start:
+            for offset, message in enumerate(self.store.load_range(self.current_session, start, end)):
+                self.insert_message(tk.END, start + offset, message)
+        self.rendered_start = start
+        self.rendered_end = end
+        self.rendered_total = count
+        self.insert_placeholder()
+        self.chat_history.config(state=tk.DISABLED)
+    
+    def insert_placeholder(self):
+        """显示到会话末尾时，为等待回复中的会话显示已收到的内容或等待提示"""
+        if self.current_session not in self.pending_requests or self.rendered_end < self.rendered_total:
+            return
+        buffer = self.stream_buffers.get(self.current_session)
+        if buffer:
+            self.chat_history.insert(tk.END, "助手: " + "".join(buffer), ("assistant", "streaming"))
+        else:
+            self.chat_history.insert(tk.END, "助手: 等待回复中...", ("assistant", "pending"))
+    
+    def on_chat_scroll(self, first, last):
+        """滚动到已显示内容的顶部或底部时加载相邻的消息"""
+        self.chat_history.vbar.set(first, last)
+        if self.scroll_job is not None:
+            return
+        if float(first) <= 0.0 and self.rendered_start > 0:
+            self.scroll_job = self.root.after_idle(self.load_earlier_messages)
+        elif float(last) >= 1.0 and self.rendered_end < self.rendered_total:
+            self.scroll_job = self.root.after_idle(self.load_later_messages)
+    
+    def line_of(self, index):
+        """返回 Text 索引所在的行号"""
+        return int(self.chat_history.index(index).split(".")[0])
+    
+    def load_earlier_messages(self):
+        """在顶部插入更早的一页消息，保持当前可见内容不动"""
+        self.scroll_job = None
+        # 重绘过程中触发的滚动事件到这里时可能已不在顶部
+        if self.rendered_start <= 0 or self.chat_history.yview()[0] > 0.0:
+            return
+        start = max(0, self.rendered_start - self.chat_window_size() // 2)
+        messages = self.store.load_range(self.current_session, start, self.rendered_start)
+        top_line = self.line_of("@0,0")
+        lines_before = self.line_of(tk.END)
         
-        if self.current_session in self.sessions:
-            for i, message in enumerate(self.sessions[self.current_session]):
-                role = message["role"]
-                content = message["content"]
-                timestamp = message.get("timestamp", "")
-                
-                # 添加消息标签，格式为"msg_{index}"
-                msg_tag = f"msg_{i}"
-                
-                if role == "user":
-                    self.chat_history.insert(tk.END, f"用户: {content}\n", ("user", msg_tag))
-                elif role == "assistant":
-                    self.chat_history.insert(tk.END, f"助手: {content}\n", ("assistant", msg_tag))
-                elif role == "system":
-                    self.chat_history.insert(tk.END, f"系统: {content}\n", ("system", msg_tag))
-                
-                if timestamp:
-                    self.chat_history.insert(tk.END, f"时间: {timestamp}\n", "timestamp")
-                
-                self.chat_history.insert(tk.END, "-" * 80 + "\n")
+        self.chat_history.config(state=tk.NORMAL)
+        # 倒序插入到开头，最终顺序不变
+        for offset in range(len(messages) - 1, -1, -1):
+            self.insert_message(1.0, start + offset, messages[offset])
+        self.rendered_start = start
+        added_lines = self.line_of(tk.END) - lines_before
         
+        # 超出显示上限时移除最后面的消息（包括等待提示）
+        limit = self.chat_window_size() * 3
+        if self.rendered_end - self.rendered_start > limit:
+            end = self.rendered_start + limit
+            self.chat_history.delete(f"item_{end}.first", tk.END)
+            self.rendered_end = end
         self.chat_history.config(state=tk.DISABLED)
-        self.chat_history.see(tk.END)
+        self.chat_history.yview(f"{top_line + added_lines}.0")
+    
+    def load_later_messages(self):
+        """在底部追加后面的一页消息，保持当前可见内容不动"""
+        self.scroll_job = None
+        if self.rendered_end >= self.rendered_total or self.chat_history.yview()[1] < 1.0:
+            return
+        end = min(self.rendered_total, self.rendered_end + self.chat_window_size() // 2)
+        messages = self.store.load_range(self.current_session, self.rendered_end, end)
+        top_line = self.line_of("@0,0")
         
-        # 绑定键盘事件
-        self.chat_history.bind("<Up>", self.select_previous_message)
-        self.chat_history.bind("<Down>", self.select_next_message)
-        self.chat_history.bind("<space>", self.confirm_message_selection)
+        self.chat_history.config(state=tk.NORMAL)
+        for offset, message in enumerate(messages):
+            self.insert_message(tk.END, self.rendered_end + offset, message)
+        self.rendered_end = end
+        self.insert_placeholder()
         
-        # 初始化当前选中的消息索引
-        self.selected_message_index = -1
+        # 超出显示上限时移除最前面的消息
+        removed_lines = 0
+        limit = self.chat_window_size() * 3
+        if self.rendered_end - self.rendered_start > limit:
+            start = self.rendered_end - limit
+            removed_lines = self.line_of(f"item_{start}.first") - 1
+            self.chat_history.delete(1.0, f"item_{start}.first")
+            self.rendered_start = start
+        self.chat_history.config(state=tk.DISABLED)
+        self.chat_history.yview(f"{max(1, top_line - removed_lines)}.0")
+    
+    def show_message(self, i):
+        """确保第 i 条消息在显示范围内，不在时以它为中心重新显示一段消息"""
+        if self.rendered_start <= i < self.rendered_end:
+            return
+        count = self.message_count(self.current_session)
+        window = self.chat_window_size()
+        self.render_window(max(0, min(i - window // 2, count - window)), count)
+    
+    def insert_message(self, index, i, message):
+        """在 index 处插入第 i 条消息
+
+        消息正文带有 msg_{i} 标签，整段（正文、时间和分隔线）带有 item_{i} 标签，便于原位替换。
+        """
+        role = message["role"]
+        timestamp = message.get("timestamp", "")
+        role_text = {"user": "用户", "assistant": "助手", "system": "系统"}.get(role)
+        item_tag = f"item_{i}"
+        
+        chunks = []
+        if role_text:
+            chunks += [f"{role_text}: {message['content']}\n", (role, f"msg_{i}", item_tag)]
+        if timestamp:
+            chunks += [f"时间: {timestamp}\n", ("timestamp", item_tag)]
+        chunks += ["-" * 80 + "\n", (item_tag,)]
+        self.chat_history.insert(index, *chunks)
+    
+    def refresh_message(self, i):
+        """原位替换已显示的第 i 条消息（编辑消息后调用）"""
+        if self.rendered_session != self.current_session or not self.rendered_start <= i < self.rendered_end:
+            return
+        item_tag = f"item_{i}"
+        if not self.chat_history.tag_ranges(item_tag):
+            self.update_chat_history(full=True)
+            return
+        
+        self.chat_history.config(state=tk.NORMAL)
+        index = self.chat_history.index(f"{item_tag}.first")
+        self.chat_history.delete(f"{item_tag}.first", f"{item_tag}.last")
+        self.insert_message(index, i, self.load_message(self.current_session, i))
+        self.chat_history.config(state=tk.DISABLED)
+        
+        self.update_token_status()
+    
+    def update_token_status(self):
+        """在状态栏显示当前会话的消息数和 token 总数"""
+        if not hasattr(self, "token_label"):
+            return
+        # 消息数和 token 总数取自会话元数据，不加载消息
+        info = self.store.session_info(self.current_session) if self.current_session in self.sessions else {}
+        text = f"{info.get('count', 0)} 条消息 | 约 {info.get('tokens', 0)} tokens"
+        # 限流器中有请求排队时一并显示
+        queue_depth = get_rate_limiter(self.config).queue_depth
+        if queue_depth:
+            text += f" | 排队 {queue_depth} 个请求"
+        self.token_label.config(text=text)
     
     def send_message(self):
         """发送消息"""
         message = self.message_entry.get(1.0, tk.END).strip()
         if message:
+            if self.current_session in self.pending_requests:
+                self.status_label.config(text=f"会话 '{self.current_session}' 正在等待回复，请稍候或先取消")
+                return
+            
             # 添加用户消息
             timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
             user_message = {
@@ -305,99 +779,176 @@ class DeepSeekClient:
             }
             
             if self.current_session not in self.sessions:
-                self.sessions[self.current_session] = []
+                self.store.create_session(self.current_session)
+                self.session_index.add(self.current_session)
             
-            self.sessions[self.current_session].append(user_message)
-            self.update_chat_history()
+            count_message(user_message)
+            self.store.append_message(self.current_session, user_message)
             self.message_entry.delete(1.0, tk.END)
             
             # 发送到API
             self.send_to_api()
-            self.save_sessions()
     
     def send_to_api(self):
-        """发送消息到API"""
-        # 构建请求体
-        messages = []
+        """把当前会话的请求提交到后台线程"""
+        session_name = self.current_session
         
-        # 添加系统消息
-        messages.append({"role": "system", "content": "You are a helpful assistant."})
+        # 在界面线程中复制请求所需的数据，工作线程不访问任何 Tk 对象
+        config = dict(self.config)
+        config["api_key"] = self.api_key_var.get()
+        # 只读取本次请求需要的历史，不把整个会话载入内存
+        history = load_history(config, session_name, self.message_count(session_name), self.store.load_range)
+        history = [dict(msg) for msg in history]
+        cancel_event = threading.Event()
         
-        # 添加对话历史
-        if self.current_session in self.sessions:
-            for msg in self.sessions[self.current_session]:
-                messages.append({"role": msg["role"], "content": msg["content"]})
-        
-        # 构建请求数据
-        data = {
-            "model": self.config["model"],
-            "messages": messages,
-            "temperature": self.config["temperature"],
-            "max_tokens": self.config["max_tokens"],
-            "top_p": self.config["top_p"],
-            "frequency_penalty": self.config["frequency_penalty"],
-            "presence_penalty": self.config["presence_penalty"]
-        }
+        self.pending_requests[session_name] = cancel_event
+        self.stream_buffers[session_name] = []
+        self.request_futures[session_name] = asyncio.run_coroutine_threadsafe(
+            self.request_task(session_name, config, history, cancel_event, not self.no_cache_var.get()), self.loop
+        )
         
-        # 使用DeepSeek API
-        api_key = self.api_key_var.get()
-        api_endpoint = "https://api.deepseek.com/v1/chat/completions"
-        
-        # 发送请求
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
+        self.update_session_list()
+        self.update_chat_history()
+        self.status_label.config(text=f"会话 '{session_name}' 等待回复中...")
+    
+    async def request_task(self, session_name, config, history, cancel_event, use_cache=True):
+        """在事件循环线程中执行请求，结果放入队列"""
+        def on_delta(delta):
+            self.result_queue.put(("delta", session_name, cancel_event, delta))
         
         try:
-            response = requests.post(
-                api_endpoint,
-                headers=headers,
-                json=data,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                assistant_message = result["choices"][0]["message"]["content"]
-                
-                # 添加助手消息
-                timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-                assistant_msg = {
-                    "role": "assistant",
-                    "content": assistant_message,
-                    "timestamp": timestamp
-                }
-                
-                self.sessions[self.current_session].append(assistant_msg)
-                self.update_chat_history()
-                self.save_sessions()
-            else:
-                # 添加错误消息
-                error_message = f"API错误: {response.text} (状态码: {response.status_code})"
-                timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-                error_msg = {
-                    "role": "system",
-                    "content": error_message,
-                    "timestamp": timestamp
-                }
-                
-                self.sessions[self.current_session].append(error_msg)
-                self.update_chat_history()
-                self.save_sessions()
+            result = await self.api.chat(config, history, on_delta=on_delta, cancel_event=cancel_event, session=session_name,
+                                         use_cache=use_cache)
+            self.result_queue.put(("done", session_name, cancel_event, result))
+        except (RequestCancelled, asyncio.CancelledError):
+            pass
         except Exception as e:
+            error_message = str(e) if isinstance(e, APIError) else f"网络错误: {str(e)}"
+            # 记录请求 ID，便于与日志中的失败记录对应
+            meta = {"request_id": e.request_id} if getattr(e, "request_id", None) else {}
+            if getattr(e, "retries", 0):
+                meta["retries"] = e.retries
+            self.result_queue.put(("error", session_name, cancel_event, {"content": error_message, "meta": meta}))
+    
+    def poll_results(self):
+        """在界面线程中处理后台返回的结果"""
+        try:
+            while True:
+                kind, session_name, cancel_event, payload = self.result_queue.get_nowait()
+                # 已取消或已被放弃的请求，结果直接丢弃
+                if self.pending_requests.get(session_name) is not cancel_event:
+                    continue
+                
+                if kind == "delta":
+                    self.append_stream_delta(session_name, payload)
+                else:
+                    self.finish_request(session_name, kind, payload)
+        except queue.Empty:
+            pass
+        
+        # 有请求在等待时刷新状态栏中的排队数
+        if self.pending_requests:
+            self.update_token_status()
+        self.root.after(50, self.poll_results)
+    
+    def append_stream_delta(self, session_name, delta):
+        """追加流式回复的增量文本"""
+        buffer = self.stream_buffers.setdefault(session_name, [])
+        buffer.append(delta)
+        
+        if session_name == self.current_session and self.rendered_end == self.rendered_total:
+            self.chat_history.config(state=tk.NORMAL)
+            if len(buffer) == 1:
+                # 收到第一段内容时替换等待提示
+                if self.chat_history.tag_ranges("pending"):
+                    self.chat_history.delete("pending.first", "pending.last")
+                self.chat_history.insert(tk.END, "助手: ", ("assistant", "streaming"))
+            self.chat_history.insert(tk.END, delta, ("assistant", "streaming"))
+            self.chat_history.config(state=tk.DISABLED)
+            self.chat_history.see(tk.END)
+    
+    @profile_phase("receive_reply")
+    def finish_request(self, session_name, kind, result):
+        """请求完成后保存回复或错误信息"""
+        del self.pending_requests[session_name]
+        self.request_futures.pop(session_name, None)
+        self.stream_buffers.pop(session_name, None)
+        
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        if kind == "done":
+            # 添加助手消息
+            message = {
+                "role": "assistant",
+                "content": result["content"],
+                "timestamp": timestamp
+            }
+            status_text = f"会话 '{session_name}' 已收到回复"
+            cache = get_response_cache(self.config)
+            if cache is not None:
+                stats = cache.stats()
+                status_text += f" | 响应缓存命中 {stats['hits']} 次，未命中 {stats['misses']} 次"
+        else:
             # 添加错误消息
-            error_message = f"网络错误: {str(e)}"
-            timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-            error_msg = {
+            message = {
                 "role": "system",
-                "content": error_message,
+                "content": result["content"],
                 "timestamp": timestamp
             }
-            
-            self.sessions[self.current_session].append(error_msg)
+            status_text = f"会话 '{session_name}' 请求失败"
+        
+        # 记录重试次数、各阶段耗时等请求元数据
+        message.update(result["meta"])
+        if message.get("retries"):
+            status_text += f" (重试 {message['retries']} 次)"
+        
+        if session_name in self.sessions:
+            count_message(message)
+            started_at = time.perf_counter()
+            self.store.append_message(session_name, message)
+            persist_time = time.perf_counter() - started_at
+            observe_persist(self.config, "append", persist_time)
+            timing_text = format_timing(message, persist_time * 1000)
+            if timing_text:
+                status_text += f" | {timing_text}"
+        
+        self.update_session_list()
+        if session_name == self.current_session:
             self.update_chat_history()
-            self.save_sessions()
+        self.status_label.config(text=status_text)
+    
+    def discard_request(self, session_name):
+        """取消会话中尚未完成的请求，之后到达的结果会被丢弃"""
+        cancel_event = self.pending_requests.pop(session_name, None)
+        if cancel_event is None:
+            return False
+        cancel_event.set()
+        future = self.request_futures.pop(session_name, None)
+        if future is not None:
+            future.cancel()
+        self.stream_buffers.pop(session_name, None)
+        return True
+    
+    def cancel_request(self):
+        """取消当前会话的请求"""
+        if self.discard_request(self.current_session):
+            self.update_session_list()
+            self.update_chat_history()
+            self.status_label.config(text=f"会话 '{self.current_session}' 的请求已取消")
+    
+    def on_close(self):
+        """关闭窗口时取消所有请求并退出"""
+        for session_name in list(self.pending_requests):
+            self.discard_request(session_name)
+        self.semantic_stop.set()
+        try:
+            asyncio.run_coroutine_threadsafe(self.api.aclose(), self.loop).result(timeout=1)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.store.close()
+        shutdown_metrics()
+        shutdown_logging()
+        self.root.destroy()
     
     def edit_message(self):
         """编辑消息"""
@@ -412,11 +963,10 @@ class DeepSeekClient:
     def select_previous_message(self, event):
         """选择上一条消息"""
         if self.current_session in self.sessions:
-            num_messages = len(self.sessions[self.current_session])
+            num_messages = self.message_count(self.current_session)
             if num_messages > 0:
                 # 取消当前选中消息的高亮
-                if self.selected_message_index >= 0:
-                    self.chat_history.tag_remove("sel", f"msg_{self.selected_message_index}.0", f"msg_{self.selected_message_index}.end")
+                self.chat_history.tag_remove("sel", 1.0, tk.END)
                 
                 # 选择上一条消息
                 if self.selected_message_index <= 0:
@@ -425,15 +975,19 @@ class DeepSeekClient:
                     self.selected_message_index -= 1
                 
                 # 高亮显示选中的消息，使用更明显的高亮样式
+                self.show_message(self.selected_message_index)
                 self.chat_history.tag_configure("sel", background="#ffffcc", foreground="#000000")
-                self.chat_history.tag_add("sel", f"msg_{self.selected_message_index}.0", f"msg_{self.selected_message_index}.end")
-                self.chat_history.see(f"msg_{self.selected_message_index}.0")
+                self.chat_history.tag_add("sel", f"msg_{self.selected_message_index}.first", f"msg_{self.selected_message_index}.last")
+                self.chat_history.see(f"msg_{self.selected_message_index}.first")
                 
                 # 在状态栏显示当前选中的消息信息
-                message = self.sessions[self.current_session][self.selected_message_index]
+                message = self.load_message(self.current_session, self.selected_message_index)
                 role = message["role"]
                 role_text = "用户" if role == "user" else "助手" if role == "assistant" else "系统"
                 status_text = f"当前选中: 第{self.selected_message_index + 1}条消息 ({role_text})"
+                timing_text = format_timing(message)
+                if timing_text:
+                    status_text += f" | {timing_text}"
                 # 更新状态栏
                 if hasattr(self, "status_label"):
                     self.status_label.config(text=status_text)
@@ -442,25 +996,28 @@ class DeepSeekClient:
     def select_next_message(self, event):
         """选择下一条消息"""
         if self.current_session in self.sessions:
-            num_messages = len(self.sessions[self.current_session])
+            num_messages = self.message_count(self.current_session)
             if num_messages > 0:
                 # 取消当前选中消息的高亮
-                if self.selected_message_index >= 0:
-                    self.chat_history.tag_remove("sel", f"msg_{self.selected_message_index}.0", f"msg_{self.selected_message_index}.end")
+                self.chat_history.tag_remove("sel", 1.0, tk.END)
                 
                 # 选择下一条消息
                 self.selected_message_index = (self.selected_message_index + 1) % num_messages
                 
                 # 高亮显示选中的消息，使用更明显的高亮样式
+                self.show_message(self.selected_message_index)
                 self.chat_history.tag_configure("sel", background="#ffffcc", foreground="#000000")
-                self.chat_history.tag_add("sel", f"msg_{self.selected_message_index}.0", f"msg_{self.selected_message_index}.end")
-                self.chat_history.see(f"msg_{self.selected_message_index}.0")
+                self.chat_history.tag_add("sel", f"msg_{self.selected_message_index}.first", f"msg_{self.selected_message_index}.last")
+                self.chat_history.see(f"msg_{self.selected_message_index}.first")
                 
                 # 在状态栏显示当前选中的消息信息
-                message = self.sessions[self.current_session][self.selected_message_index]
+                message = self.load_message(self.current_session, self.selected_message_index)
                 role = message["role"]
                 role_text = "用户" if role == "user" else "助手" if role == "assistant" else "系统"
                 status_text = f"当前选中: 第{self.selected_message_index + 1}条消息 ({role_text})"
+                timing_text = format_timing(message)
+                if timing_text:
+                    status_text += f" | {timing_text}"
                 # 更新状态栏
                 if hasattr(self, "status_label"):
                     self.status_label.config(text=status_text)
@@ -469,10 +1026,11 @@ class DeepSeekClient:
     def confirm_message_selection(self, event):
         """确认选择并进入编辑模式"""
         if self.selected_message_index >= 0 and self.current_session in self.sessions:
-            messages = self.sessions[self.current_session]
-            if self.selected_message_index < len(messages):
+            message = self.load_message(self.current_session, self.selected_message_index)
+            if message is not None:
                 # 获取当前选中的消息
-                message = messages[self.selected_message_index]
+                session_name = self.current_session
+                message_index = self.selected_message_index
                 
                 # 创建编辑对话框
                 edit_window = tk.Toplevel(self.root)
@@ -495,13 +1053,15 @@ class DeepSeekClient:
                     # 获取编辑后的内容
                     new_content = text_widget.get(1.0, tk.END).strip()
                     if new_content:
-                        # 更新消息内容
-                        message["content"] = new_content
-                        message["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
-                        
-                        # 保存更改
-                        self.save_sessions()
-                        self.update_chat_history()
+                        # 更新消息内容并保存更改
+                        new_message = dict(message)
+                        new_message["content"] = new_content
+                        new_message["timestamp"] = time.strftime("%Y-%m-%d %H:%M:%S")
+                        count_message(new_message)
+                        if session_name in self.sessions:
+                            self.store.update_message(session_name, message_index, new_message)
+                        if session_name == self.current_session:
+                            self.refresh_message(message_index)
                         
                         # 关闭对话框
                         edit_window.destroy()
@@ -519,6 +1079,7 @@ class DeepSeekClient:
         self.config["top_p"] = self.top_p_var.get()
         self.config["frequency_penalty"] = self.frequency_penalty_var.get()
         self.config["presence_penalty"] = self.presence_penalty_var.get()
+        self.config["stream"] = self.stream_var.get()
         
         self.save_config_to_file()
         messagebox.showinfo("提示", "配置保存成功")
@@ -528,34 +1089,55 @@ class DeepSeekClient:
         with open("config.json", "w", encoding="utf-8") as f:
             json.dump(self.config, f, ensure_ascii=False, indent=2)
     
+    @profile_phase("load_config")
     def load_config(self):
-        """加载配置"""
+        """加载配置，失败时返回异常（日志尚未设置，由调用方在设置后记录）"""
         if os.path.exists("config.json"):
             try:
                 with open("config.json", "r", encoding="utf-8") as f:
                     self.config.update(json.load(f))
             except Exception as e:
-                print(f"加载配置失败: {e}")
-    
-    def save_sessions(self):
-        """保存会话到文件"""
-        with open("sessions.json", "w", encoding="utf-8") as f:
-            json.dump(self.sessions, f, ensure_ascii=False, indent=2)
+                return e
+        return None
     
+    @profile_phase("load_sessions")
     def load_sessions(self):
         """加载会话"""
-        if os.path.exists("sessions.json"):
-            try:
-                with open("sessions.json", "r", encoding="utf-8") as f:
-                    self.sessions = json.load(f)
-            except Exception as e:
-                print(f"加载会话失败: {e}")
+        # 存储后端由 storage_backend 决定，修改会话时只写入变化的部分
+        self.store = open_session_store(self.config)
+        try:
+            self.store.load()
+        except SessionStoreError:
+            # 数据库打不开时无法保存任何会话，由调用方提示后退出
+            raise
+        except Exception as e:
+            logger.error("加载会话失败: %s", e, exc_info=True)
+        self.sessions = self.store.sessions
         
         # 确保默认会话存在
         if "默认会话" not in self.sessions:
-            self.sessions["默认会话"] = []
+            self.store.create_session("默认会话")
+        
+        # 会话名前缀索引，用于会话列表的筛选
+        self.session_index = PrefixIndex(self.sessions)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DeepSeek API 客户端 (GUI)")
+    parser.add_argument("--profile", nargs="?", const=DEFAULT_PROFILE_DIR, metavar="DIR",
+                        help=f"剖析启动、请求、保存和刷新聊天记录等阶段，退出时把报告写入 DIR 下按时间命名的子目录（默认 {DEFAULT_PROFILE_DIR}）")
+    args = parser.parse_args()
+    if args.profile:
+        start_profiling(args.profile)
     root = tk.Tk()
-    app = DeepSeekClient(root)
-    root.mainloop()
+    try:
+        app = DeepSeekClient(root)
+    except SessionStoreError as e:
+        logger.error("加载会话失败: %s", e)
+        messagebox.showerror("错误", str(e))
+        shutdown_logging()
+        root.destroy()
+    else:
+        root.mainloop()
+    report_dir = stop_profiling()
+    if report_dir:
+        print(f"剖析报告已写入: {report_dir}")
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+"""
+运行指标模块
+统计请求数、按状态码区分的错误、重试、延迟、token 用量、缓存命中和会话保存耗时，
+以 Prometheus 文本格式（或 OpenMetrics）通过 HTTP 端点提供，或定期写入文本文件供
+node_exporter 的 textfile 收集器读取。未开启时 get_metrics 返回 None，调用方只多一次判断。
+"""
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from structured_log import get_logger
+
+logger = get_logger("metrics")
+
+PREFIX = "deepseek_client_"
+
+# 请求延迟的分桶上限（秒）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 会话保存耗时的分桶上限（秒）
+PERSIST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+PROMETHEUS_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OPENMETRICS_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def format_labels(names, values, extra=""):
+    """生成 {a="1",b="2"} 形式的标签，值中的反斜杠、引号和换行需要转义"""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    """数值的文本形式，整数不带小数点"""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数器，按标签值分别计数"""
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self, openmetrics):
+        # OpenMetrics 中计数器的类型行使用不带 _total 的名称
+        type_name = self.name if openmetrics else self.name + "_total"
+        lines = [f"# HELP {type_name} {self.help_text}", f"# TYPE {type_name} counter"]
+        for labels, value in sorted(self.values.items()):
+            lines.append(f"{self.name}_total{format_labels(self.label_names, labels)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """按固定分桶统计分布，同时记录总和与次数"""
+
+    def __init__(self, name, help_text, buckets, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label_names = label_names
+        # 标签值 -> [各分桶计数..., 总和, 次数]
+        self.values = {}
+
+    def observe(self, value, labels=()):
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values[labels] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def render(self, openmetrics):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for labels, state in sorted(self.values.items()):
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += state[i]
+                le = f'le="{format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, labels, le)} {cumulative}")
+            inf_labels = format_labels(self.label_names, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {state[-1]}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {format_value(state[-2])}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {state[-1]}")
+        return lines
+
+
+class Metrics:
+    """客户端的全部指标，各方法可在任意线程中调用"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter(PREFIX + "requests", "完成的对话请求数（含缓存命中）", ("model",))
+        self.errors = Counter(PREFIX + "request_errors", "最终失败的对话请求数，按状态码区分（network 表示网络错误）", ("status",))
+        self.retries = Counter(PREFIX + "request_retries", "暂时性错误后的重试次数")
+        self.cache = Counter(PREFIX + "cache_lookups", "响应缓存查询次数", ("result",))
+        self.tokens = Counter(PREFIX + "tokens", "服务端返回的 token 用量", ("direction",))
+        self.latency = Histogram(PREFIX + "request_duration_seconds", "对话请求从构建到得到完整回复的耗时", LATENCY_BUCKETS)
+        self.ttfb = Histogram(PREFIX + "request_ttfb_seconds", "发出请求到收到响应头的耗时", LATENCY_BUCKETS)
+        self.persist = Histogram(PREFIX + "persist_duration_seconds", "会话保存耗时", PERSIST_BUCKETS, ("operation",))
+        self.families = (self.requests, self.errors, self.retries, self.cache, self.tokens,
+                         self.latency, self.ttfb, self.persist)
+        self.server = None
+        self.textfile = None
+        self.textfile_stop = None
+
+    def record_success(self, model, meta, cache_enabled=False):
+        """记录一次成功的请求，meta 为请求返回的元数据"""
+        timing = meta.get("timing") or {}
+        usage = meta.get("usage") or {}
+        with self.lock:
+            self.requests.inc((model,))
+            if meta.get("retries"):
+                self.retries.inc(amount=meta["retries"])
+            if meta.get("cached"):
+                self.cache.inc(("hit",))
+            elif cache_enabled:
+                self.cache.inc(("miss",))
+            if "total" in timing:
+                self.latency.observe(timing["total"] / 1000)
+            if "ttfb" in timing:
+                self.ttfb.observe(timing["ttfb"] / 1000)
+            if usage.get("prompt_tokens"):
+                self.tokens.inc(("prompt",), usage["prompt_tokens"])
+            if usage.get("completion_tokens"):
+                self.tokens.inc(("completion",), usage["completion_tokens"])
+
+    def record_error(self, error, cache_enabled=False):
+        """记录一次最终失败的请求"""
+        with self.lock:
+            self.errors.inc((str(getattr(error, "status_code", "network")),))
+            if getattr(error, "retries", 0):
+                self.retries.inc(amount=error.retries)
+            if cache_enabled:
+                self.cache.inc(("miss",))
+
+    def observe_persist(self, operation, seconds):
+        """记录一次会话保存（append 为追加消息，compact 为压缩存储）"""
+        with self.lock:
+            self.persist.observe(seconds, (operation,))
+
+    def render(self, openmetrics=False):
+        """生成 Prometheus 文本格式（或 OpenMetrics）的全部指标"""
+        with self.lock:
+            lines = []
+            for family in self.families:
+                lines.extend(family.render(openmetrics))
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def start_server(self, host, port):
+        """在后台线程中提供 /metrics 端点"""
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.metrics = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def start_textfile(self, path, interval):
+        """每隔 interval 秒把指标写入文本文件"""
+        self.textfile = path
+        stop = self.textfile_stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.write_textfile()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def write_textfile(self):
+        """原子地写入文本文件，收集器不会读到写了一半的内容"""
+        tmp_path = self.textfile + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+                f.write(self.render())
+            os.replace(tmp_path, self.textfile)
+        except OSError as e:
+            logger.warning("写入指标文件失败: %s", e)
+
+    def close(self):
+        """停止 HTTP 端点，最后写一次文本文件"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        if self.textfile_stop is not None:
+            self.textfile_stop.set()
+            self.write_textfile()
+            self.textfile_stop = None
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """响应 GET /metrics，按 Accept 头选择 OpenMetrics 或 Prometheus 文本格式"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            body = b"Not Found\n"
+            self.send_response(404)
+            self.send_header("Content-Type", "text/plain; charset=utf-8")
+        else:
+            openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+            body = self.server.metrics.render(openmetrics).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics(config):
+    """返回进程内共享的指标，未配置 metrics_port 和 metrics_textfile 时返回 None
+
+    首次调用时启动 HTTP 端点或文本文件导出线程。
+    """
+    global _metrics
+    if _metrics is not None:
+        return _metrics
+    port = int(config.get("metrics_port") or 0)
+    textfile = config.get("metrics_textfile") or ""
+    if not port and not textfile:
+        return None
+
+    with _metrics_lock:
+        if _metrics is None:
+            metrics = Metrics()
+            if port:
+                try:
+                    metrics.start_server(config.get("metrics_host") or "127.0.0.1", port)
+                except OSError as e:
+                    logger.error("启动指标端点失败: %s", e)
+            if textfile:
+                metrics.start_textfile(textfile, max(1.0, float(config.get("metrics_textfile_interval", 15))))
+            _metrics = metrics
+        return _metrics
+
+
+def shutdown_metrics():
+    """程序退出前停止指标导出"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is not None:
+            _metrics.close()
+            _metrics = None
+
+
+def record_success(config, model, meta, cache_lookup=False):
+    """记录一次成功的请求；cache_lookup 表示本次请求查询过响应缓存"""
+    metrics = get_metrics(config)
+    if metrics is not None:
+        metrics.record_success(model, meta, cache_lookup)
+
+
+def record_error(config, error, cache_lookup=False):
+    """记录一次最终失败的请求"""
+    metrics = get_metrics(config)
+    if metrics is not None:
+        metrics.record_error(error, cache_lookup)
+
+
+def observe_persist(config, operation, seconds):
+    """记录一次会话保存的耗时"""
+    metrics = get_metrics(config)
+    if metrics is not None:
+        metrics.observe_persist(operation, seconds)
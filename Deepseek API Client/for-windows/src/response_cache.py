@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+响应缓存模块
+以请求体的规范化哈希（加上上游地址和 API 密钥的哈希）为键，把完全相同请求的回复缓存在本地 SQLite 文件中
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def request_key(data, endpoint=None, api_key=None):
+    """计算请求体的规范化哈希（与是否流式无关）
+
+    指定 endpoint 和 api_key 时一并计入，不同上游或不同账号的回复互不共用；密钥只以哈希形式参与计算。
+    """
+    canonical = {key: value for key, value in data.items() if key != "stream"}
+    if endpoint is not None:
+        canonical = {"request": canonical, "endpoint": endpoint}
+    if api_key is not None:
+        canonical["account"] = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    text = json.dumps(canonical, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """带过期时间和容量上限 (LRU 淘汰) 的磁盘响应缓存，可在多个线程中共享"""
+
+    def __init__(self, path="response_cache.db", ttl=86400, max_entries=1000):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    content TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+
+    def get(self, key):
+        """查找缓存的回复，未命中或已过期时返回 None"""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT content, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                if row is not None:
+                    with self.conn:
+                        self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+
+            with self.conn:
+                self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, content):
+        """保存回复，超出容量时淘汰最久未使用的条目"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, content, now, now)
+            )
+            count = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if self.max_entries and count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def stats(self):
+        """返回命中、未命中次数和当前条目数"""
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+    def close(self):
+        """关闭缓存文件"""
+        with self.lock:
+            self.conn.close()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache(config):
+    """返回进程内共享的响应缓存，未开启缓存时返回 None"""
+    global _cache
+    if not config.get("cache_enabled"):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        _cache.ttl = float(config.get("cache_ttl", 86400))
+        _cache.max_entries = int(config.get("cache_max_entries", 1000))
+        return _cache
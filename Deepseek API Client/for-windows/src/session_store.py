@@ -0,0 +1,700 @@
+# -*- coding: utf-8 -*-
+
+"""
+会话存储模块
+可选两种后端：SQLite 数据库（默认），或 sessions.json 快照 + 追加写入的事件日志 (JSON Lines)
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import time
+from collections import OrderedDict
+from collections.abc import Mapping
+
+from metrics import observe_persist
+from profiler import profile_phase
+from text_search import index_text, make_snippet, match_query, query_terms
+from structured_log import get_logger
+from token_counter import message_tokens, session_tokens
+
+logger = get_logger("session_store")
+
+# 消息记录中单独成列的字段，其余字段以 JSON 形式存入 extra 列
+MESSAGE_COLUMNS = ("role", "content", "timestamp")
+
+
+class SessionStoreError(Exception):
+    """会话存储无法打开（如数据库文件损坏、被其他程序锁定或所在目录不可写）"""
+
+
+class JournalSessionStore:
+    """会话存储：每次修改只向日志追加一条事件，定期压缩为完整快照
+
+    日志首行记录所基于快照的哈希。压缩时先替换快照再替换日志，
+    若在两步之间崩溃，旧日志的哈希与新快照不符，加载时会被整体忽略，
+    因此事件不会被重复应用。
+    """
+
+    def __init__(self, snapshot_path="sessions.json", journal_path="sessions.journal.jsonl", compact_threshold=1000,
+                 on_compact=None):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_threshold = compact_threshold
+        # 每次压缩成功后以耗时（秒）调用，用于记录指标
+        self.on_compact = on_compact
+        self.sessions = {}
+        # 各会话 token 总数，随每条事件增量更新
+        self.tokens = {}
+        # 各会话的版本 "快照哈希:日志中最近一次修改的事件序号"，重新加载同一份快照和日志时不变，
+        # 供语义索引判断哪些会话有变化；压缩后全部会话的版本都会变化
+        self.snapshot_hash = ""
+        self.version = 0
+        self.versions = {}
+        self.journal = None
+        self.event_count = 0
+
+    def load(self):
+        """加载快照并重放日志，返回会话字典"""
+        snapshot = b""
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = f.read()
+        self.sessions = json.loads(snapshot.decode("utf-8")) if snapshot else {}
+        self.tokens = {session: session_tokens(messages) for session, messages in self.sessions.items()}
+        snapshot_hash = hashlib.sha1(snapshot).hexdigest()
+        self.reset_versions(snapshot_hash)
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "rb") as f:
+                lines = f.readlines()
+            header = self.parse_event(lines[0]) if lines else None
+            if header and header.get("op") == "header" and header.get("snapshot") == snapshot_hash:
+                valid_size = len(lines[0])
+                for line in lines[1:]:
+                    event = self.parse_event(line)
+                    # 末尾不完整的一行说明写入时崩溃，其后的内容全部忽略
+                    if event is None:
+                        break
+                    self.apply_event(event)
+                    self.event_count += 1
+                    valid_size += len(line)
+
+                # 截掉损坏的尾部，后续事件才能接在完整的行之后
+                self.journal = open(self.journal_path, "a", encoding="utf-8", newline="\n")
+                self.journal.truncate(valid_size)
+                return self.sessions
+
+        # 日志不存在或属于旧快照时，基于当前快照新建日志
+        self.write_journal_header(snapshot_hash)
+        return self.sessions
+
+    def parse_event(self, line):
+        """解析一行日志，格式不完整时返回 None"""
+        if not line.endswith(b"\n"):
+            return None
+        try:
+            return json.loads(line.decode("utf-8"))
+        except ValueError:
+            return None
+
+    def apply_event(self, event):
+        """把一条事件应用到内存中的会话字典"""
+        op = event["op"]
+        session = event["session"]
+        self.version += 1
+        self.versions[session] = f"{self.snapshot_hash}:{self.version}"
+        if op == "create":
+            self.sessions.setdefault(session, [])
+            self.tokens.setdefault(session, 0)
+        elif op == "delete_session":
+            self.sessions.pop(session, None)
+            self.tokens.pop(session, None)
+            self.versions.pop(session, None)
+        elif op == "append":
+            self.sessions.setdefault(session, []).append(event["message"])
+            self.tokens[session] = self.tokens.get(session, 0) + message_tokens(event["message"])
+        elif op == "update":
+            old_message = self.sessions[session][event["index"]]
+            self.sessions[session][event["index"]] = event["message"]
+            self.tokens[session] += message_tokens(event["message"]) - message_tokens(old_message)
+        elif op == "delete":
+            old_message = self.sessions[session].pop(event["index"])
+            self.tokens[session] -= message_tokens(old_message)
+
+    def session_info(self, session):
+        """返回会话的消息数、token 总数和最后修改时间"""
+        messages = self.sessions[session]
+        updated_at = 0
+        if messages and messages[-1].get("timestamp"):
+            try:
+                updated_at = time.mktime(time.strptime(messages[-1]["timestamp"], "%Y-%m-%d %H:%M:%S"))
+            except ValueError:
+                pass
+        return {"count": len(messages), "tokens": self.tokens.get(session, 0), "updated_at": updated_at}
+
+    def load_range(self, session, start, stop):
+        """返回会话中 [start, stop) 范围内的消息"""
+        return self.sessions[session][start:stop]
+
+    def open_reader(self):
+        """复制当前会话供后台线程只读扫描，需在修改会话的线程中调用"""
+        sessions = {session: list(messages) for session, messages in self.sessions.items()}
+        return JournalSessionReader(sessions, dict(self.versions))
+
+    def search(self, query, limit=20):
+        """在所有会话中搜索包含全部关键词的消息，按出现次数排序"""
+        terms = [term.lower() for term in query_terms(query)]
+        if not terms:
+            return []
+        hits = []
+        for session, messages in self.sessions.items():
+            for index, message in enumerate(messages):
+                content = message["content"].lower()
+                if all(term in content for term in terms):
+                    score = sum(content.count(term) for term in terms)
+                    hits.append((score, session, index, message))
+        hits.sort(key=lambda hit: hit[0], reverse=True)
+        return [search_result(session, index, message, terms) for score, session, index, message in hits[:limit]]
+
+    def write_event(self, event):
+        """应用事件并追加写入日志，写入后立即落盘"""
+        self.apply_event(event)
+        try:
+            self.journal.write(json.dumps(event, ensure_ascii=False) + "\n")
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+        except Exception as e:
+            logger.error("保存会话失败: %s", e, exc_info=True)
+            return
+
+        self.event_count += 1
+        if self.compact_threshold and self.event_count >= self.compact_threshold:
+            self.compact()
+
+    def create_session(self, session):
+        """创建会话"""
+        self.write_event({"op": "create", "session": session})
+
+    def delete_session(self, session):
+        """删除会话"""
+        self.write_event({"op": "delete_session", "session": session})
+
+    def append_message(self, session, message):
+        """向会话末尾追加一条消息"""
+        self.write_event({"op": "append", "session": session, "message": message})
+
+    def update_message(self, session, index, message):
+        """替换会话中的一条消息"""
+        self.write_event({"op": "update", "session": session, "index": index, "message": message})
+
+    def delete_message(self, session, index):
+        """删除会话中的一条消息"""
+        self.write_event({"op": "delete", "session": session, "index": index})
+
+    def write_journal_header(self, snapshot_hash):
+        """以原子方式新建只含文件头的日志"""
+        temp_path = self.journal_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8", newline="\n") as f:
+            f.write(json.dumps({"op": "header", "snapshot": snapshot_hash}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if self.journal is not None:
+            self.journal.close()
+        os.replace(temp_path, self.journal_path)
+        self.fsync_directory()
+        self.journal = open(self.journal_path, "a", encoding="utf-8", newline="\n")
+        self.event_count = 0
+        self.reset_versions(snapshot_hash)
+
+    def reset_versions(self, snapshot_hash):
+        """以新快照为基准重置各会话的版本"""
+        self.snapshot_hash = snapshot_hash
+        self.version = 0
+        self.versions = dict.fromkeys(self.sessions, f"{snapshot_hash}:0")
+
+    @profile_phase("compact_sessions")
+    def compact(self):
+        """把当前会话写成完整快照并清空日志"""
+        started_at = time.perf_counter()
+        try:
+            snapshot = json.dumps(self.sessions, ensure_ascii=False, indent=2).encode("utf-8")
+            temp_path = self.snapshot_path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(snapshot)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.snapshot_path)
+            self.fsync_directory()
+            self.write_journal_header(hashlib.sha1(snapshot).hexdigest())
+        except Exception as e:
+            logger.error("保存会话失败: %s", e, exc_info=True)
+            return
+        if self.on_compact is not None:
+            self.on_compact(time.perf_counter() - started_at)
+
+    def fsync_directory(self):
+        """同步目录项，确保重命名操作落盘（Windows 不支持，直接跳过）"""
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """关闭日志文件"""
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+
+class JournalSessionReader:
+    """JSON 会话存储的只读快照，供后台线程扫描消息"""
+
+    def __init__(self, sessions, versions):
+        self.sessions = sessions
+        self.versions = versions
+
+    def session_versions(self):
+        """返回 {会话名: 版本}，会话的任何修改都会改变其版本"""
+        return self.versions
+
+    def load_messages(self, session):
+        """返回一个会话的全部消息"""
+        return self.sessions[session]
+
+    def close(self):
+        pass
+
+
+def search_result(session, index, message, terms):
+    """搜索结果条目"""
+    return {
+        "session": session,
+        "index": index,
+        "role": message["role"],
+        "timestamp": message.get("timestamp") or "",
+        "snippet": make_snippet(message["content"], terms)
+    }
+
+
+class SessionCache(Mapping):
+    """会话字典的惰性视图
+
+    所有会话的元数据（id、消息数、token 总数、最后修改时间）常驻内存，消息列表在首次访问时
+    才从数据库加载，最近访问的若干会话保留在 LRU 缓存中。
+    """
+
+    def __init__(self, loader, capacity=8):
+        self.loader = loader
+        self.capacity = max(1, capacity)
+        self.meta = {}
+        self.loaded = OrderedDict()
+
+    def __getitem__(self, session):
+        if session not in self.meta:
+            raise KeyError(session)
+        if session in self.loaded:
+            self.loaded.move_to_end(session)
+            return self.loaded[session]
+
+        messages = self.loader(session)
+        self.loaded[session] = messages
+        while len(self.loaded) > self.capacity:
+            self.loaded.popitem(last=False)
+        return messages
+
+    def __contains__(self, session):
+        return session in self.meta
+
+    def __iter__(self):
+        return iter(self.meta)
+
+    def __len__(self):
+        return len(self.meta)
+
+    def cached(self, session):
+        """返回已在缓存中的消息列表，未加载时返回 None（不触发加载）"""
+        return self.loaded.get(session)
+
+
+class SQLiteSessionStore:
+    """会话存储：SQLite 数据库 (WAL 模式)，每次修改只影响相关的行
+
+    启动时只读取会话元数据，消息在打开会话时按需加载。
+    首次运行时自动导入已有的 sessions.json（含未压缩的日志）。
+    """
+
+    def __init__(self, db_path="sessions.db", legacy_snapshot_path="sessions.json",
+                 legacy_journal_path="sessions.journal.jsonl", cache_size=8):
+        self.db_path = db_path
+        self.legacy_snapshot_path = legacy_snapshot_path
+        self.legacy_journal_path = legacy_journal_path
+        self.sessions = SessionCache(self.load_messages, cache_size)
+        self.conn = None
+        self.fts = False
+
+    def connect(self):
+        """打开数据库并建表"""
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    token_count INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at);
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY,
+                    session_id INTEGER NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+                    position INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp TEXT,
+                    extra TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_messages_session_position ON messages(session_id, position);
+                CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);
+            """)
+            # 升级前创建的数据库没有 token_count 列
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(sessions)")]
+            if "token_count" not in columns:
+                self.conn.execute("ALTER TABLE sessions ADD COLUMN token_count INTEGER NOT NULL DEFAULT 0")
+            # 全文索引，rowid 与 messages.id 一致；SQLite 未编译 FTS5 时搜索退回逐条匹配
+            try:
+                self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content)")
+                self.fts = True
+            except sqlite3.OperationalError:
+                self.fts = False
+
+    def load(self):
+        """打开数据库（必要时迁移旧数据），只加载会话元数据，返回惰性会话字典
+
+        数据库无法打开或初始化时抛出 SessionStoreError，不会留下没有连接的存储。
+        """
+        try:
+            self.connect()
+            self.migrate_legacy()
+            self.build_search_index()
+            self.count_session_tokens()
+        except sqlite3.Error as e:
+            self.close()
+            raise SessionStoreError(f"无法打开会话数据库 {self.db_path}: {e}") from e
+
+        self.sessions.meta.clear()
+        self.sessions.loaded.clear()
+        rows = self.conn.execute("SELECT id, name, message_count, token_count, updated_at FROM sessions ORDER BY id")
+        for session_id, name, count, tokens, updated_at in rows:
+            self.sessions.meta[name] = {"id": session_id, "count": count, "tokens": tokens, "updated_at": updated_at}
+        return self.sessions
+
+    def load_messages(self, session):
+        """从数据库读取一个会话的全部消息"""
+        rows = self.conn.execute(
+            "SELECT role, content, timestamp, extra FROM messages WHERE session_id = ? ORDER BY position",
+            (self.sessions.meta[session]["id"],)
+        )
+        return [self.row_to_message(*row) for row in rows]
+
+    def session_info(self, session):
+        """返回会话的消息数、token 总数和最后修改时间（不加载消息）"""
+        meta = self.sessions.meta[session]
+        return {"count": meta["count"], "tokens": meta["tokens"], "updated_at": meta["updated_at"]}
+
+    def load_range(self, session, start, stop):
+        """返回会话中 [start, stop) 范围内的消息，会话未加载时只读取这一段"""
+        messages = self.sessions.cached(session)
+        if messages is not None:
+            return messages[start:stop]
+        rows = self.conn.execute(
+            "SELECT role, content, timestamp, extra FROM messages "
+            "WHERE session_id = ? AND position >= ? AND position < ? ORDER BY position",
+            (self.sessions.meta[session]["id"], start, stop)
+        )
+        return [self.row_to_message(*row) for row in rows]
+
+    def migrate_legacy(self):
+        """首次运行时把 sessions.json 及其日志导入数据库"""
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+            return
+
+        legacy = {}
+        if os.path.exists(self.legacy_snapshot_path) or os.path.exists(self.legacy_journal_path):
+            journal_store = JournalSessionStore(self.legacy_snapshot_path, self.legacy_journal_path, compact_threshold=0)
+            legacy = journal_store.load()
+            journal_store.close()
+
+        with self.conn:
+            for name, messages in legacy.items():
+                session_id = self.insert_session(name)
+                self.conn.executemany(
+                    "INSERT INTO messages (session_id, position, role, content, timestamp, extra) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(session_id, position) + self.message_to_row(message) for position, message in enumerate(messages)]
+                )
+                self.conn.execute("UPDATE sessions SET message_count = ? WHERE id = ?", (len(messages), session_id))
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('migrated', ?)", (str(time.time()),))
+
+    def open_reader(self):
+        """复制当前的会话元数据，返回供后台线程只读扫描的存储，需在修改会话的线程中调用"""
+        return SQLiteSessionReader(self.db_path, {name: dict(meta) for name, meta in self.sessions.meta.items()})
+
+    def build_search_index(self):
+        """为升级前已保存的消息建立全文索引（只执行一次），之后随每次修改增量更新"""
+        if not self.fts or self.conn.execute("SELECT 1 FROM meta WHERE key = 'fts_indexed'").fetchone():
+            return
+        with self.conn:
+            self.conn.execute("DELETE FROM messages_fts")
+            cursor = self.conn.execute("SELECT id, content FROM messages")
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                self.conn.executemany(
+                    "INSERT INTO messages_fts (rowid, content) VALUES (?, ?)",
+                    [(message_id, index_text(content)) for message_id, content in rows]
+                )
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('fts_indexed', ?)", (str(time.time()),))
+
+    def count_session_tokens(self):
+        """统计升级前已保存的各会话 token 总数（只执行一次），之后随每次修改增量更新"""
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'tokens_counted'").fetchone():
+            return
+        totals = {}
+        cursor = self.conn.execute("SELECT session_id, role, content, timestamp, extra FROM messages")
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for session_id, role, content, timestamp, extra in rows:
+                tokens = message_tokens(self.row_to_message(role, content, timestamp, extra))
+                totals[session_id] = totals.get(session_id, 0) + tokens
+        with self.conn:
+            self.conn.executemany("UPDATE sessions SET token_count = ? WHERE id = ?",
+                                  [(tokens, session_id) for session_id, tokens in totals.items()])
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('tokens_counted', ?)", (str(time.time()),))
+
+    def message_row(self, session_id, index):
+        """读取会话中一条消息的 (id, 消息字典)，不存在时返回 None"""
+        row = self.conn.execute(
+            "SELECT id, role, content, timestamp, extra FROM messages WHERE session_id = ? AND position = ?",
+            (session_id, index)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], self.row_to_message(*row[1:])
+
+    def index_message(self, message_id, content):
+        """写入或替换一条消息的全文索引"""
+        if self.fts:
+            self.conn.execute("DELETE FROM messages_fts WHERE rowid = ?", (message_id,))
+            self.conn.execute("INSERT INTO messages_fts (rowid, content) VALUES (?, ?)", (message_id, index_text(content)))
+
+    def search(self, query, limit=20):
+        """在所有会话中搜索包含全部关键词的消息，按相关度 (BM25) 排序"""
+        terms = query_terms(query)
+        if not terms:
+            return []
+        if self.fts:
+            expression = match_query(query)
+            if not expression:
+                return []
+            try:
+                rows = self.conn.execute(
+                    "SELECT s.name, m.position, m.role, m.content, m.timestamp FROM messages_fts "
+                    "JOIN messages m ON m.id = messages_fts.rowid JOIN sessions s ON s.id = m.session_id "
+                    "WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?",
+                    (expression, limit)
+                ).fetchall()
+            except sqlite3.OperationalError as e:
+                # 查询表达式仍被 FTS5 拒绝时按没有结果处理，不让界面或命令行因输入而出错
+                logger.warning("全文搜索失败: %s", e)
+                return []
+        else:
+            condition = " AND ".join("m.content LIKE ?" for _ in terms)
+            rows = self.conn.execute(
+                "SELECT s.name, m.position, m.role, m.content, m.timestamp FROM messages m "
+                f"JOIN sessions s ON s.id = m.session_id WHERE {condition} ORDER BY m.id DESC LIMIT ?",
+                [f"%{term}%" for term in terms] + [limit]
+            )
+        return [
+            search_result(name, position, {"role": role, "content": content, "timestamp": timestamp}, terms)
+            for name, position, role, content, timestamp in rows
+        ]
+
+    def message_to_row(self, message):
+        """把消息字典转换为 (role, content, timestamp, extra)"""
+        extra = {key: value for key, value in message.items() if key not in MESSAGE_COLUMNS}
+        return (
+            message["role"],
+            message["content"],
+            message.get("timestamp"),
+            json.dumps(extra, ensure_ascii=False) if extra else None
+        )
+
+    def row_to_message(self, role, content, timestamp, extra):
+        """把数据库中的一行还原为消息字典"""
+        message = {"role": role, "content": content}
+        if timestamp is not None:
+            message["timestamp"] = timestamp
+        if extra:
+            message.update(json.loads(extra))
+        return message
+
+    def insert_session(self, name):
+        """插入会话行并返回其 id"""
+        now = time.time()
+        cursor = self.conn.execute(
+            "INSERT INTO sessions (name, created_at, updated_at) VALUES (?, ?, ?)", (name, now, now)
+        )
+        return cursor.lastrowid
+
+    def touch_session(self, session, count_delta, token_delta=0):
+        """更新会话的最后修改时间、消息数和 token 总数（数据库与内存元数据同步）"""
+        meta = self.sessions.meta[session]
+        meta["count"] += count_delta
+        meta["tokens"] += token_delta
+        meta["updated_at"] = time.time()
+        self.conn.execute(
+            "UPDATE sessions SET updated_at = ?, message_count = ?, token_count = ? WHERE id = ?",
+            (meta["updated_at"], meta["count"], meta["tokens"], meta["id"])
+        )
+
+    def create_session(self, session):
+        """创建会话"""
+        if session in self.sessions:
+            return
+        with self.conn:
+            session_id = self.insert_session(session)
+        self.sessions.meta[session] = {"id": session_id, "count": 0, "tokens": 0, "updated_at": time.time()}
+        self.sessions.loaded[session] = []
+
+    def delete_session(self, session):
+        """删除会话（消息随外键级联删除）"""
+        meta = self.sessions.meta.pop(session, None)
+        self.sessions.loaded.pop(session, None)
+        if meta is not None:
+            with self.conn:
+                if self.fts:
+                    self.conn.execute(
+                        "DELETE FROM messages_fts WHERE rowid IN (SELECT id FROM messages WHERE session_id = ?)",
+                        (meta["id"],)
+                    )
+                self.conn.execute("DELETE FROM sessions WHERE id = ?", (meta["id"],))
+
+    def append_message(self, session, message):
+        """向会话末尾追加一条消息"""
+        self.create_session(session)
+        meta = self.sessions.meta[session]
+        # 先计数，未计数的消息写入时一并保存 tokens 字段
+        tokens = message_tokens(message)
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO messages (session_id, position, role, content, timestamp, extra) VALUES (?, ?, ?, ?, ?, ?)",
+                (meta["id"], meta["count"]) + self.message_to_row(message)
+            )
+            self.index_message(cursor.lastrowid, message["content"])
+            self.touch_session(session, 1, tokens)
+        messages = self.sessions.cached(session)
+        if messages is not None:
+            messages.append(message)
+
+    def update_message(self, session, index, message):
+        """替换会话中的一条消息"""
+        meta = self.sessions.meta[session]
+        tokens = message_tokens(message)
+        with self.conn:
+            old = self.message_row(meta["id"], index)
+            self.conn.execute(
+                "UPDATE messages SET role = ?, content = ?, timestamp = ?, extra = ? WHERE session_id = ? AND position = ?",
+                self.message_to_row(message) + (meta["id"], index)
+            )
+            if old is not None:
+                self.index_message(old[0], message["content"])
+                tokens -= message_tokens(old[1])
+            self.touch_session(session, 0, tokens)
+        messages = self.sessions.cached(session)
+        if messages is not None:
+            messages[index] = message
+
+    def delete_message(self, session, index):
+        """删除会话中的一条消息，其后的消息依次前移"""
+        meta = self.sessions.meta[session]
+        with self.conn:
+            old = self.message_row(meta["id"], index)
+            if old is None:
+                return
+            if self.fts:
+                self.conn.execute("DELETE FROM messages_fts WHERE rowid = ?", (old[0],))
+            self.conn.execute("DELETE FROM messages WHERE id = ?", (old[0],))
+            self.conn.execute(
+                "UPDATE messages SET position = position - 1 WHERE session_id = ? AND position > ?", (meta["id"], index)
+            )
+            self.touch_session(session, -1, -message_tokens(old[1]))
+        messages = self.sessions.cached(session)
+        if messages is not None:
+            messages.pop(index)
+
+    def compact(self):
+        """把 WAL 日志合并回数据库文件"""
+        try:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except Exception as e:
+            logger.error("保存会话失败: %s", e, exc_info=True)
+
+    def close(self):
+        """关闭数据库"""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class SQLiteSessionReader(SQLiteSessionStore):
+    """SQLite 会话存储的只读视图，供后台线程扫描消息
+
+    只读连接在首次读取时由使用它的线程打开，WAL 模式下读取与界面线程的写入互不阻塞；
+    用完后由同一线程调用 close()。
+    """
+
+    def __init__(self, db_path, meta):
+        super().__init__(db_path)
+        self.sessions.meta.update(meta)
+
+    def session_versions(self):
+        """返回 {会话名: 版本}，会话的任何修改都会改变其版本（最后修改时间）"""
+        return {name: meta["updated_at"] for name, meta in self.sessions.meta.items()}
+
+    def load_messages(self, session):
+        """从数据库读取一个会话的全部消息，不经过会话缓存"""
+        if self.conn is None:
+            uri = pathlib.Path(os.path.abspath(self.db_path)).as_uri() + "?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True)
+        return super().load_messages(session)
+
+
+def open_session_store(config):
+    """根据配置创建会话存储后端"""
+    if config.get("storage_backend", "sqlite") == "json":
+        return JournalSessionStore(
+            compact_threshold=int(config.get("journal_compact_events", 1000)),
+            on_compact=lambda seconds: observe_persist(config, "compact", seconds)
+        )
+    return SQLiteSessionStore(cache_size=int(config.get("session_cache_size", 8)))
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+
+"""
+异步 API 客户端模块
+CLI 与 GUI 共用的 asyncio 请求核心，一个事件循环即可同时进行多个对话；
+安装了 httpx 时使用 httpx.AsyncClient，否则在线程池中运行同步请求
+"""
+
+import asyncio
+import functools
+import json
+import threading
+import time
+
+try:
+    import httpx
+except ImportError:  # 可选依赖，未安装时退回同步请求
+    httpx = None
+
+from api_client import (
+    TRANSPORT_KEYS, APIError, ChatRequest, RequestCancelled, api_endpoint, build_headers, chat_completion,
+    encode_body, parse_stream_line, prepare_request
+)
+from rate_limiter import get_rate_limiter, wait_async
+from request_timing import RequestTiming
+from retry_policy import parse_retry_after
+
+
+class AsyncChatClient:
+    """基于 asyncio 的对话客户端，需在同一个事件循环中使用"""
+
+    def __init__(self):
+        self.client = None
+        self.client_settings = None
+
+    async def get_client(self, config):
+        """返回 httpx.AsyncClient 连接池，首次请求或相关配置变化时重新创建"""
+        settings = tuple(config.get(key) for key in TRANSPORT_KEYS)
+        if self.client is None or settings != self.client_settings:
+            if self.client is not None:
+                await self.client.aclose()
+            connect_timeout = float(config.get("connect_timeout", 10))
+            read_timeout = float(config.get("read_timeout", 30))
+            pool_maxsize = max(1, int(config.get("pool_maxsize", 10)))
+            keep_alive = bool(config.get("keep_alive", True))
+            options = {
+                "limits": httpx.Limits(
+                    max_connections=pool_maxsize,
+                    max_keepalive_connections=pool_maxsize if keep_alive else 0
+                ),
+                "timeout": httpx.Timeout(read_timeout, connect=connect_timeout)
+            }
+            try:
+                self.client = httpx.AsyncClient(http2=bool(config.get("http2")), **options)
+            except ImportError:
+                # 未安装 h2 时 httpx 不支持 HTTP/2，退回 HTTP/1.1
+                self.client = httpx.AsyncClient(**options)
+            self.client_settings = settings
+        return self.client
+
+    async def send_request(self, client, url, headers, data, on_delta=None, cancel_event=None, progress=None,
+                           body=None, timing=None):
+        """发送一次请求并返回助手回复，不做重试
+
+        body 为已编码的请求体；timing 记录连接、首字节、下载和解析的耗时。
+        """
+        stream = bool(data.get("stream"))
+        if body is None:
+            body = encode_body(data)
+        if timing is None:
+            timing = RequestTiming()
+        started_at = timing.begin_attempt()
+        async with client.stream("POST", url, headers=headers, content=body,
+                                 extensions={"trace": timing.atrace}) as response:
+            received_at = timing.since("ttfb", started_at)
+            if response.status_code != 200:
+                await response.aread()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                raise APIError(response.status_code, response.text, retry_after)
+
+            if not stream:
+                raw = await response.aread()
+                parse_started_at = timing.since("download", received_at)
+                result = json.loads(raw)
+                timing.since("parse", parse_started_at)
+                timing.response_bytes = len(raw)
+                timing.usage = result.get("usage")
+                return result["choices"][0]["message"]["content"]
+
+            chunks = []
+            usage = {}
+            async for line in response.aiter_lines():
+                parse_started_at = time.perf_counter()
+                deltas, done = parse_stream_line(line, usage)
+                timing.since("parse", parse_started_at)
+                if done:
+                    break
+                for delta in deltas:
+                    if cancel_event is not None and cancel_event.is_set():
+                        raise RequestCancelled()
+                    chunks.append(delta)
+                    if on_delta is not None:
+                        if progress is not None:
+                            progress["delivered"] = True
+                        on_delta(delta)
+            # 解析时间穿插在接收过程中，下载时间不含解析
+            timing.add("download", time.perf_counter() - received_at - timing.phases.get("parse", 0.0))
+            timing.response_bytes = response.num_bytes_downloaded
+            timing.usage = usage or None
+            return "".join(chunks)
+
+    async def chat(self, config, history, on_delta=None, cancel_event=None, session=None, use_cache=True):
+        """发送对话请求，返回值与 chat_completion 相同
+
+        on_delta 在事件循环线程中调用。任务被取消或 cancel_event 被置位时中止请求。
+        """
+        if httpx is None:
+            return await self.chat_in_executor(config, history, on_delta, cancel_event, session, use_cache)
+
+        request = ChatRequest(config, session, use_cache)
+        if config.get("context_summary"):
+            # 生成摘要需要额外的同步请求，放到线程池中避免阻塞事件循环
+            loop = asyncio.get_running_loop()
+            request.prepare(await loop.run_in_executor(None, prepare_request, config, history, session))
+        else:
+            request.prepare(prepare_request(config, history, session))
+        result = request.cached_result(on_delta)
+        if result is not None:
+            return result
+
+        client = await self.get_client(config)
+        url = api_endpoint(config)
+        headers = build_headers(config)
+        limiter = get_rate_limiter(config)
+
+        steps = request.steps(cancel_event)
+        reply = None
+        while True:
+            try:
+                operation, argument = steps.send(reply)
+            except StopIteration as done:
+                return done.value
+            if operation == "acquire":
+                reply = await limiter.acquire_async(argument, cancel_event)
+            elif operation == "send":
+                try:
+                    content = await self.send_request(client, url, headers, request.data, on_delta, cancel_event,
+                                                      request.progress, request.body, request.timing)
+                    reply = (content, None)
+                except (RequestCancelled, asyncio.CancelledError):
+                    raise
+                except Exception as e:
+                    reply = (None, e)
+            else:
+                # 重试前的退避等待中也要及时响应取消
+                reply = await wait_async(argument, cancel_event)
+
+    async def chat_in_executor(self, config, history, on_delta, cancel_event, session, use_cache):
+        """未安装 httpx 时在线程池中运行同步请求，增量文本转交回事件循环线程"""
+        loop = asyncio.get_running_loop()
+        if cancel_event is None:
+            cancel_event = threading.Event()
+        deliver = None
+        if on_delta is not None:
+            deliver = lambda delta: loop.call_soon_threadsafe(on_delta, delta)
+        call = functools.partial(
+            chat_completion, config, history, on_delta=deliver, cancel_event=cancel_event,
+            session=session, use_cache=use_cache
+        )
+        try:
+            return await loop.run_in_executor(None, call)
+        except asyncio.CancelledError:
+            # 通知工作线程尽快停止接收
+            cancel_event.set()
+            raise
+
+    async def stream_chat(self, config, history, session=None, use_cache=True):
+        """以异步生成器的形式逐段返回助手回复"""
+        queue = asyncio.Queue()
+        done = object()
+
+        async def run():
+            try:
+                await self.chat(dict(config, stream=True), history, on_delta=queue.put_nowait,
+                                session=session, use_cache=use_cache)
+            finally:
+                queue.put_nowait(done)
+
+        task = asyncio.ensure_future(run())
+        try:
+            while True:
+                delta = await queue.get()
+                if delta is done:
+                    break
+                yield delta
+            # 取出请求中的异常
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def aclose(self):
+        """关闭连接池"""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+
+"""
+性能剖析模块
+以 --profile 启动时，启动、发送请求、保存会话和刷新聊天记录等阶段在每次调用时用 cProfile
+统计函数耗时、用 tracemalloc 统计内存分配，退出时按阶段写出报告（耗时、分配、耗时最多的函数），
+便于直接在真实的会话数据上查找性能退化。未开启时被标记的方法只多一次判断。
+"""
+
+import cProfile
+import datetime
+import functools
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+
+DEFAULT_PROFILE_DIR = "profile"
+# 报告中列出的函数和分配位置数
+TOP_FUNCTIONS = 30
+TOP_ALLOCATIONS = 15
+# 每个阶段每隔多少次调用比较一次内存快照（快照耗时与当前内存中的对象数成正比）
+SNAPSHOT_EVERY = 10
+# tracemalloc 记录的调用栈深度
+TRACE_FRAMES = 1
+
+_profiler = None
+
+
+class PhaseStats:
+    """一个阶段的累计统计"""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = []
+        self.allocated = 0
+        self.peak = 0
+        self.nested_calls = 0
+        self.nested_wall = 0.0
+        self.stats = None
+        # 分配位置 -> [大小, 次数]，只来自抽样的调用
+        self.allocations = {}
+        self.snapshots = 0
+
+
+class PhaseProfiler:
+    """按阶段剖析：同一时刻只剖析一个阶段，嵌套调用的阶段只记录耗时
+
+    cProfile 不能嵌套启用，所以启动阶段中调用的 load_config、load_sessions 的函数明细计入启动阶段。
+    内存数字含 cProfile 记录调用的少量开销，适合在多次运行之间比较。
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.phases = {}
+        self.active = None
+        self.started_at = datetime.datetime.now()
+        # 已通过 PYTHONTRACEMALLOC 等方式开启时沿用，结束时也不关闭
+        self.owns_tracemalloc = not tracemalloc.is_tracing()
+        if self.owns_tracemalloc:
+            tracemalloc.start(TRACE_FRAMES)
+        # 剖析器自身和 tracemalloc 的分配不计入报告
+        self.trace_filters = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, pstats.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+        )
+
+    def phase_stats(self, name):
+        stats = self.phases.get(name)
+        if stats is None:
+            stats = self.phases[name] = PhaseStats(name)
+        return stats
+
+    def call(self, name, func, args, kwargs):
+        """剖析一次调用并累计到阶段统计"""
+        stats = self.phase_stats(name)
+        if self.active is not None:
+            started_at = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats.nested_calls += 1
+                stats.nested_wall += time.perf_counter() - started_at
+
+        self.active = name
+        snapshot = None
+        if stats.calls % SNAPSHOT_EVERY == 0:
+            snapshot = tracemalloc.take_snapshot().filter_traces(self.trace_filters)
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        profile = cProfile.Profile()
+        started_at = time.perf_counter()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            wall = time.perf_counter() - started_at
+            memory_after, peak = tracemalloc.get_traced_memory()
+            stats.calls += 1
+            stats.wall.append(wall)
+            stats.allocated += max(0, memory_after - memory_before)
+            stats.peak = max(stats.peak, peak - memory_before)
+            # 先比较快照，再把 cProfile 的数据转换为统计结果，转换中的分配不计入该阶段
+            if snapshot is not None:
+                self.add_allocations(stats, snapshot)
+            if stats.stats is None:
+                stats.stats = pstats.Stats(profile)
+            else:
+                stats.stats.add(profile)
+            self.active = None
+
+    def add_allocations(self, stats, before):
+        """比较调用前后的内存快照，累计各位置新增的分配"""
+        after = tracemalloc.take_snapshot().filter_traces(self.trace_filters)
+        stats.snapshots += 1
+        for diff in after.compare_to(before, "lineno"):
+            if diff.size_diff <= 0:
+                continue
+            frame = diff.traceback[0]
+            key = f"{frame.filename}:{frame.lineno}"
+            entry = stats.allocations.setdefault(key, [0, 0])
+            entry[0] += diff.size_diff
+            entry[1] += max(0, diff.count_diff)
+
+    def summary(self):
+        """各阶段的汇总数据，时间单位为毫秒，内存单位为字节"""
+        result = {}
+        for name, stats in self.phases.items():
+            wall = sorted(stats.wall)
+            entry = {"calls": stats.calls}
+            if wall:
+                entry.update({
+                    "total_ms": round(sum(wall) * 1000, 2),
+                    "mean_ms": round(sum(wall) / len(wall) * 1000, 2),
+                    "median_ms": round(wall[len(wall) // 2] * 1000, 2),
+                    "max_ms": round(wall[-1] * 1000, 2),
+                    "allocated_bytes": stats.allocated,
+                    "peak_bytes": stats.peak
+                })
+            if stats.nested_calls:
+                entry["nested_calls"] = stats.nested_calls
+                entry["nested_total_ms"] = round(stats.nested_wall * 1000, 2)
+            result[name] = entry
+        return result
+
+    def format_report(self, stats, entry):
+        """生成一个阶段的文本报告"""
+        lines = [f"阶段: {stats.name}"]
+        if stats.calls:
+            lines.append(f"调用 {stats.calls} 次，共 {entry['total_ms']:.1f}ms，平均 {entry['mean_ms']:.2f}ms，"
+                         f"中位数 {entry['median_ms']:.2f}ms，最长 {entry['max_ms']:.2f}ms")
+            lines.append(f"内存: 调用后仍保留 {format_bytes(stats.allocated)}，单次调用峰值 {format_bytes(stats.peak)}")
+        if stats.nested_calls:
+            lines.append(f"另有 {stats.nested_calls} 次在其他阶段中调用，共 {stats.nested_wall * 1000:.1f}ms（计入外层阶段的函数明细）")
+
+        if stats.allocations:
+            lines.append("")
+            lines.append(f"新增分配最多的位置（抽样 {stats.snapshots} 次调用）:")
+            top = sorted(stats.allocations.items(), key=lambda item: item[1][0], reverse=True)[:TOP_ALLOCATIONS]
+            for location, (size, count) in top:
+                lines.append(f"  {format_bytes(size):>10}  {count:>7} 块  {location}")
+
+        if stats.stats is not None:
+            buffer = io.StringIO()
+            stats.stats.stream = buffer
+            stats.stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+            lines.append("")
+            lines.append("耗时最多的函数（按累计时间）:")
+            lines.append(buffer.getvalue().strip("\n"))
+        return "\n".join(lines) + "\n"
+
+    def write_reports(self):
+        """把各阶段的报告、cProfile 原始数据和汇总写入输出目录，返回目录路径"""
+        run_dir = os.path.join(self.output_dir, self.started_at.strftime("%Y%m%d-%H%M%S"))
+        os.makedirs(run_dir, exist_ok=True)
+        summary = self.summary()
+        for name, stats in self.phases.items():
+            with open(os.path.join(run_dir, f"{name}.txt"), "w", encoding="utf-8") as f:
+                f.write(self.format_report(stats, summary[name]))
+            if stats.stats is not None:
+                # 可用 python -m pstats 或 snakeviz 等工具查看
+                stats.stats.dump_stats(os.path.join(run_dir, f"{name}.prof"))
+        with open(os.path.join(run_dir, "summary.json"), "w", encoding="utf-8") as f:
+            json.dump({"started_at": self.started_at.isoformat(timespec="seconds"), "phases": summary},
+                      f, ensure_ascii=False, indent=2)
+        return run_dir
+
+
+def format_bytes(size):
+    """把字节数格式化为便于阅读的形式"""
+    if size < 1024:
+        return f"{size}B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f}KB"
+    return f"{size / 1024 / 1024:.1f}MB"
+
+
+def profile_phase(name):
+    """把方法标记为可剖析的阶段，未开启剖析时直接调用"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return func(*args, **kwargs)
+            return _profiler.call(name, func, args, kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def start_profiling(output_dir=DEFAULT_PROFILE_DIR):
+    """开启剖析，之后调用的阶段都会被统计"""
+    global _profiler
+    if _profiler is None:
+        _profiler = PhaseProfiler(output_dir)
+    return _profiler
+
+
+def stop_profiling():
+    """停止剖析并写出报告，返回报告所在目录；未开启时返回 None"""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is None:
+        return None
+    if profiler.owns_tracemalloc:
+        tracemalloc.stop()
+    return profiler.write_reports()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""
+速率限制模块
+按每分钟请求数 (RPM) 和每分钟 token 数 (TPM) 两个令牌桶限流，
+超出预算的请求排队等待，而不是发出后被服务器拒绝
+"""
+
+import asyncio
+import threading
+import time
+
+# 异步等待时检查取消事件的间隔（秒）
+CANCEL_POLL_INTERVAL = 0.05
+
+
+async def wait_async(delay, cancel_event=None):
+    """在事件循环中等待 delay 秒，cancel_event 被置位时提前结束并返回 True
+
+    cancel_event 为线程事件，等待期间每隔 CANCEL_POLL_INTERVAL 秒检查一次。
+    """
+    deadline = time.monotonic() + delay
+    while True:
+        if cancel_event is not None and cancel_event.is_set():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(remaining if cancel_event is None else min(remaining, CANCEL_POLL_INTERVAL))
+
+
+class TokenBucket:
+    """令牌桶：容量为每分钟预算，按秒匀速补充
+
+    预约时直接扣减余额（允许为负），返回余额回到非负所需的等待时间，
+    因此并发请求按预约顺序依次放行。
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        """按经过的时间补充令牌"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, amount, now):
+        """预约 amount 个令牌，返回需要等待的秒数"""
+        self.refill(now)
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def refund(self, amount, now):
+        """归还未使用的令牌"""
+        self.refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """RPM / TPM 双令牌桶限流器，可在多个线程中共享"""
+
+    def __init__(self, rpm=0, tpm=0):
+        self.lock = threading.Lock()
+        self.request_bucket = None
+        self.token_bucket = None
+        self.waiting = 0
+        self.configure(rpm, tpm)
+
+    def configure(self, rpm, tpm):
+        """更新预算，为 0 表示不限制"""
+        with self.lock:
+            if not rpm:
+                self.request_bucket = None
+            elif self.request_bucket is None or self.request_bucket.capacity != rpm:
+                self.request_bucket = TokenBucket(rpm)
+            if not tpm:
+                self.token_bucket = None
+            elif self.token_bucket is None or self.token_bucket.capacity != tpm:
+                self.token_bucket = TokenBucket(tpm)
+
+    @property
+    def queue_depth(self):
+        """当前正在排队等待的请求数"""
+        return self.waiting
+
+    def reserve(self, tokens):
+        """预约一次请求和 tokens 个 token，返回需要等待的秒数（不阻塞）"""
+        now = time.monotonic()
+        delay = 0.0
+        with self.lock:
+            if self.request_bucket is not None:
+                delay = max(delay, self.request_bucket.reserve(1, now))
+            if self.token_bucket is not None:
+                delay = max(delay, self.token_bucket.reserve(tokens, now))
+        return delay
+
+    def refund(self, tokens, requests=0):
+        """归还预约后未实际使用的额度（请求被取消或失败，或完成后实际用量小于预估）"""
+        now = time.monotonic()
+        with self.lock:
+            if requests and self.request_bucket is not None:
+                self.request_bucket.refund(requests, now)
+            if tokens and self.token_bucket is not None:
+                self.token_bucket.refund(tokens, now)
+
+    def acquire(self, tokens, cancel_event=None):
+        """阻塞直到预算允许发送请求；等待期间被取消时归还额度并返回 False"""
+        delay = self.reserve(tokens)
+        if delay <= 0:
+            return True
+
+        with self.lock:
+            self.waiting += 1
+        try:
+            if cancel_event is not None:
+                cancelled = cancel_event.wait(delay)
+            else:
+                time.sleep(delay)
+                cancelled = False
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+        if cancelled:
+            self.refund(tokens, requests=1)
+            return False
+        return True
+
+    async def acquire_async(self, tokens, cancel_event=None):
+        """acquire 的协程版本，在事件循环中等待而不占用线程
+
+        cancel_event 被置位时归还额度并返回 False，任务被取消时归还额度后抛出 CancelledError。
+        """
+        delay = self.reserve(tokens)
+        if delay <= 0:
+            return True
+
+        with self.lock:
+            self.waiting += 1
+        try:
+            if await wait_async(delay, cancel_event):
+                self.refund(tokens, requests=1)
+                return False
+            return True
+        except asyncio.CancelledError:
+            self.refund(tokens, requests=1)
+            raise
+        finally:
+            with self.lock:
+                self.waiting -= 1
+
+
+_limiter = RateLimiter()
+
+
+def get_rate_limiter(config):
+    """返回进程内共享的限流器（按最新配置更新预算）"""
+    _limiter.configure(int(config.get("rate_limit_rpm", 0)), int(config.get("rate_limit_tpm", 0)))
+    return _limiter
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+"""
+请求耗时统计模块
+记录一次对话请求各阶段的耗时、收发字节数和服务端返回的 token 用量，
+结果作为元数据保存在助手消息中，CLI 和 GUI 状态栏按统一格式显示
+"""
+
+import time
+
+# 阶段名及显示名称，按请求的先后顺序排列
+PHASE_LABELS = (
+    ("build", "构建"),
+    ("queue", "排队"),
+    ("retry_wait", "重试等待"),
+    ("connect", "连接"),
+    ("ttfb", "首字节"),
+    ("download", "下载"),
+    ("parse", "解析"),
+    ("total", "共"),
+    ("persist", "保存")
+)
+
+# httpx 的 trace 事件中属于建立连接的部分（TCP 连接和 TLS 握手）
+CONNECT_EVENTS = ("connection.connect_tcp", "connection.start_tls")
+
+
+class RequestTiming:
+    """一次请求的耗时记录
+
+    build 为裁剪上下文和编码请求体；queue 为限流器中的等待；retry_wait 为重试前的退避；
+    connect 为新建 TCP/TLS 连接（复用连接时没有，只在使用 httpx 时能单独测得）；
+    ttfb 为发出请求到收到响应头（含 connect）；download 为接收响应体；parse 为解析 JSON/SSE；
+    total 为从开始构建到得到完整回复。重试时 connect 之后的阶段只记录最后一次尝试。
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.usage = None
+        self.event_started_at = None
+
+    def add(self, phase, seconds):
+        """累加某阶段的耗时"""
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def since(self, phase, started_at):
+        """记录从 started_at 到现在的耗时，返回当前时刻"""
+        now = time.perf_counter()
+        self.add(phase, now - started_at)
+        return now
+
+    def begin_attempt(self):
+        """开始一次新的尝试，清除上一次尝试的网络阶段"""
+        for phase in ("connect", "ttfb", "download", "parse"):
+            self.phases.pop(phase, None)
+        self.response_bytes = 0
+        self.usage = None
+        return time.perf_counter()
+
+    def trace(self, event_name, info):
+        """httpx 同步客户端的 trace 回调，记录建立连接的耗时"""
+        prefix, _, stage = event_name.rpartition(".")
+        if prefix not in CONNECT_EVENTS:
+            return
+        if stage == "started":
+            self.event_started_at = time.perf_counter()
+        elif stage in ("complete", "failed") and self.event_started_at is not None:
+            self.since("connect", self.event_started_at)
+            self.event_started_at = None
+
+    async def atrace(self, event_name, info):
+        """httpx 异步客户端的 trace 回调"""
+        self.trace(event_name, info)
+
+    def to_meta(self):
+        """结束计时，返回写入消息的元数据"""
+        self.phases["total"] = time.perf_counter() - self.started_at
+        meta = {"timing": {phase: round(seconds * 1000, 1) for phase, seconds in self.phases.items()}}
+        if self.request_bytes:
+            meta["request_bytes"] = self.request_bytes
+        if self.response_bytes:
+            meta["response_bytes"] = self.response_bytes
+        if self.usage:
+            meta["usage"] = self.usage
+        return meta
+
+
+def format_size(size):
+    """把字节数格式化为便于阅读的形式"""
+    if size < 1024:
+        return f"{size}B"
+    return f"{size / 1024:.1f}KB"
+
+
+def format_timing(message, persist_ms=None):
+    """把消息中记录的耗时和用量格式化为一行文本，没有记录时返回空字符串"""
+    timing = dict(message.get("timing") or {})
+    if persist_ms is not None:
+        timing["persist"] = round(persist_ms, 1)
+    if not timing:
+        return ""
+
+    parts = [f"{label} {timing[phase]:.0f}ms" if timing[phase] >= 10 else f"{label} {timing[phase]:.1f}ms"
+             for phase, label in PHASE_LABELS if phase in timing]
+    if message.get("request_bytes") or message.get("response_bytes"):
+        parts.append(f"发送 {format_size(message.get('request_bytes', 0))} / 接收 {format_size(message.get('response_bytes', 0))}")
+    usage = message.get("usage")
+    if usage:
+        parts.append(f"tokens {usage.get('prompt_tokens', 0)}+{usage.get('completion_tokens', 0)}")
+    if message.get("cached"):
+        parts.append("缓存命中")
+    return " | ".join(parts)
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+"""
+语义搜索模块
+为会话中的消息计算向量（调用 embeddings 接口或本地 CPU 模型），保存在内存映射的
+NumPy 向量文件中，按余弦相似度查找意思相近的消息。
+向量以消息内容的哈希为键，内容不变的消息不会重复计算，新消息分批增量计算；
+各会话扫描时的版本与向量一起保存，每次扫描（包括新启动的进程）只重新读取修改过的会话。
+"""
+
+import hashlib
+import json
+import os
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖，未安装时不能使用语义搜索
+    np = None
+
+from api_client import APIError, api_endpoint, build_headers, get_transport
+from text_search import make_snippet
+
+DEFAULT_LOCAL_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+
+
+def content_hash(content):
+    """消息内容的哈希，作为向量的键"""
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+class APIEmbedder:
+    """调用 OpenAI 兼容的 /v1/embeddings 接口计算向量"""
+
+    def __init__(self, config):
+        self.config = config
+        self.model = config.get("embedding_model")
+        if not self.model:
+            raise ValueError("使用 embeddings 接口时需要配置 embedding_model")
+        self.url = config.get("embedding_endpoint") or api_endpoint(config).replace("chat/completions", "embeddings")
+
+    def embed(self, texts):
+        """返回每段文本的向量"""
+        response = get_transport(self.config).post(
+            self.url, build_headers(self.config), {"model": self.model, "input": texts}
+        )
+        try:
+            if response.status_code != 200:
+                raise APIError(response.status_code, response.text)
+            data = sorted(response.json()["data"], key=lambda item: item["index"])
+        finally:
+            response.close()
+        return [item["embedding"] for item in data]
+
+
+class LocalEmbedder:
+    """使用 sentence-transformers 在本地 CPU 上计算向量"""
+
+    def __init__(self, config):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ValueError("使用本地模型时需要安装 sentence-transformers")
+        self.model = config.get("embedding_model") or DEFAULT_LOCAL_MODEL
+        self.encoder = SentenceTransformer(self.model, device="cpu")
+
+    def embed(self, texts):
+        """返回每段文本的向量"""
+        return self.encoder.encode(texts, batch_size=len(texts), show_progress_bar=False)
+
+
+class SemanticIndex:
+    """消息向量索引
+
+    vectors.f32 依次保存归一化后的 float32 向量（只追加），hashes.txt 的第 i 行是
+    第 i 个向量对应的内容哈希，index.json 记录模型名和维度，模型变化时重建索引。
+    scanned.json 记录各会话上次扫描时的版本和 {内容哈希: 序号}，只保存消息全部算好向量的会话。
+    """
+
+    def __init__(self, embedder, path="semantic_index", batch_size=64):
+        self.embedder = embedder
+        self.path = path
+        self.batch_size = max(1, batch_size)
+        self.vectors_path = os.path.join(path, "vectors.f32")
+        self.hashes_path = os.path.join(path, "hashes.txt")
+        self.info_path = os.path.join(path, "index.json")
+        self.scanned_path = os.path.join(path, "scanned.json")
+        self.dim = None
+        self.hashes = []
+        self.rows = {}
+        self.vectors = None
+        # 内容哈希 -> {会话名: 序号}，以及各会话的 {内容哈希: 序号}，只包含最近一次扫描时仍存在的消息
+        self.locations = {}
+        self.session_keys = {}
+        # 各会话上次扫描时的版本（高水位），版本不变的会话不再读取
+        self.scanned = {}
+        # 已扫描但还没有向量的 {内容哈希: 内容}，计算失败后下次扫描继续
+        self.pending = {}
+
+    def load(self):
+        """读取已有的索引文件；模型变化或文件不完整时清空重建"""
+        os.makedirs(self.path, exist_ok=True)
+        info = {}
+        if os.path.exists(self.info_path):
+            with open(self.info_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+        if info.get("model") != self.embedder.model:
+            self.reset()
+            return
+
+        self.dim = info.get("dim")
+        if os.path.exists(self.hashes_path):
+            with open(self.hashes_path, "r", encoding="utf-8") as f:
+                self.hashes = [line.strip() for line in f if line.strip()]
+        # 上次写入中断时向量文件和哈希文件可能不一致，以较短者为准
+        count = os.path.getsize(self.vectors_path) // (4 * self.dim) if self.dim and os.path.exists(self.vectors_path) else 0
+        if count != len(self.hashes):
+            count = min(count, len(self.hashes))
+            self.hashes = self.hashes[:count]
+            self.rewrite(list(range(count)))
+        self.rows = {value: row for row, value in enumerate(self.hashes)}
+        self.vectors = None
+        self.load_scanned()
+
+    def load_scanned(self):
+        """读取上次保存的各会话扫描结果；有消息缺少向量的会话下次重新扫描"""
+        if not os.path.exists(self.scanned_path):
+            return
+        try:
+            with open(self.scanned_path, "r", encoding="utf-8") as f:
+                scanned = json.load(f)
+        except ValueError:
+            return
+        for session, entry in scanned.items():
+            keys = entry["keys"]
+            if not all(key in self.rows for key in keys):
+                continue
+            for key, index in keys.items():
+                self.locations.setdefault(key, {})[session] = index
+            self.session_keys[session] = keys
+            self.scanned[session] = entry["version"]
+
+    def save_scanned(self):
+        """保存各会话的扫描结果，供下次启动时跳过没有变化的会话"""
+        scanned = {
+            session: {"version": version, "keys": self.session_keys[session]}
+            for session, version in self.scanned.items()
+            if all(key in self.rows for key in self.session_keys[session])
+        }
+        tmp_path = self.scanned_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(scanned, f, ensure_ascii=False)
+        os.replace(tmp_path, self.scanned_path)
+
+    def reset(self):
+        """清空索引"""
+        self.dim = None
+        self.hashes = []
+        self.rows = {}
+        self.vectors = None
+        self.locations = {}
+        self.session_keys = {}
+        self.scanned = {}
+        for path in (self.vectors_path, self.hashes_path, self.scanned_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.save_info()
+
+    def save_info(self):
+        """保存模型名和向量维度"""
+        with open(self.info_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.embedder.model, "dim": self.dim}, f)
+
+    def scan(self, reader):
+        """扫描上次扫描后新增、修改或删除的会话，返回还没有向量的 [(内容哈希, 内容)]
+
+        reader 由会话存储的 open_reader() 创建，可在后台线程中使用；只处理用户和助手的消息。
+        """
+        versions = reader.session_versions()
+        for session in [session for session in self.scanned if session not in versions]:
+            self.forget_session(session)
+        for session, version in versions.items():
+            if self.scanned.get(session) == version:
+                continue
+            self.forget_session(session)
+            keys = {}
+            for index, message in enumerate(reader.load_messages(session)):
+                if message["role"] not in ("user", "assistant") or not message["content"].strip():
+                    continue
+                key = content_hash(message["content"])
+                keys[key] = index
+                if key not in self.rows:
+                    self.pending.setdefault(key, message["content"])
+            for key, index in keys.items():
+                self.locations.setdefault(key, {})[session] = index
+            self.session_keys[session] = keys
+            self.scanned[session] = version
+        self.pending = {key: text for key, text in self.pending.items() if key not in self.rows}
+        return list(self.pending.items())
+
+    def forget_session(self, session):
+        """移除一个会话上次扫描的结果"""
+        self.scanned.pop(session, None)
+        for key in self.session_keys.pop(session, {}):
+            owners = self.locations[key]
+            del owners[session]
+            if not owners:
+                del self.locations[key]
+
+    def add(self, items, progress=None, stop_event=None):
+        """分批计算并追加向量，每批写入后即可在中断后继续；stop_event 被置位时在批次之间停止"""
+        for start in range(0, len(items), self.batch_size):
+            if stop_event is not None and stop_event.is_set():
+                break
+            batch = items[start:start + self.batch_size]
+            vectors = np.asarray(self.embedder.embed([text for key, text in batch]), dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors = vectors / np.maximum(norms, 1e-12)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self.save_info()
+
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self.hashes_path, "a", encoding="utf-8", newline="\n") as f:
+                f.write("".join(key + "\n" for key, text in batch))
+            for key, text in batch:
+                self.rows[key] = len(self.hashes)
+                self.hashes.append(key)
+            self.vectors = None
+            if progress is not None:
+                progress(min(start + self.batch_size, len(items)), len(items))
+
+    def sync(self, reader, progress=None, stop_event=None):
+        """为新增或修改过的消息计算向量并保存扫描结果，返回本次需要计算的条数"""
+        missing = self.scan(reader)
+        try:
+            self.add(missing, progress, stop_event)
+        finally:
+            self.compact()
+            self.save_scanned()
+        return len(missing)
+
+    def compact(self):
+        """已删除消息的向量超过一半时重写索引文件，只保留仍存在的消息"""
+        live = [row for row, key in enumerate(self.hashes) if key in self.locations]
+        if len(live) * 2 >= len(self.hashes):
+            return
+        self.rewrite(live)
+        self.hashes = [self.hashes[row] for row in live]
+        self.rows = {value: row for row, value in enumerate(self.hashes)}
+
+    def rewrite(self, rows):
+        """只保留指定行，重写向量文件和哈希文件"""
+        vectors = self.open_vectors()
+        data = vectors[rows] if vectors is not None and rows else np.zeros((0, self.dim or 0), dtype=np.float32)
+        # 先释放内存映射，Windows 上才能替换文件
+        del vectors
+        self.vectors = None
+        tmp_path = self.vectors_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(np.ascontiguousarray(data, dtype=np.float32).tobytes())
+        os.replace(tmp_path, self.vectors_path)
+        with open(self.hashes_path, "w", encoding="utf-8", newline="\n") as f:
+            f.write("".join(self.hashes[row] + "\n" for row in rows))
+
+    def open_vectors(self):
+        """以只读内存映射打开向量文件"""
+        if self.vectors is None and self.hashes and self.dim:
+            count = min(len(self.hashes), os.path.getsize(self.vectors_path) // (4 * self.dim))
+            self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(count, self.dim))
+        return self.vectors
+
+    def query(self, text, limit=10):
+        """返回与 text 最相近的消息 [(会话名, 序号, 相似度)]，只包含最近一次扫描时仍存在的消息"""
+        vectors = self.open_vectors()
+        if vectors is None or not len(vectors):
+            return []
+        query = np.asarray(self.embedder.embed([text])[0], dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        scores = vectors @ query
+
+        # 多取一些，跳过已删除的消息
+        count = min(len(scores), limit * 2 + 10)
+        top = np.argpartition(-scores, count - 1)[:count]
+        top = top[np.argsort(-scores[top])]
+        hits = []
+        for row in top:
+            owners = self.locations.get(self.hashes[row])
+            if owners:
+                session, index = next(iter(owners.items()))
+                hits.append((session, index, float(scores[row])))
+                if len(hits) >= limit:
+                    break
+        return hits
+
+
+def create_semantic_index(config):
+    """根据配置创建语义索引，未开启时返回 None；缺少依赖时抛出 ValueError"""
+    backend = config.get("embedding_backend")
+    if not backend:
+        return None
+    if np is None:
+        raise ValueError("语义搜索需要安装 numpy")
+    if backend == "api":
+        embedder = APIEmbedder(config)
+    elif backend == "local":
+        embedder = LocalEmbedder(config)
+    else:
+        raise ValueError(f"未知的 embedding_backend: {backend}")
+    index = SemanticIndex(embedder, batch_size=int(config.get("embedding_batch_size", 64)))
+    index.load()
+    return index
+
+
+def semantic_results(store, hits):
+    """把查询结果转换为与全文搜索相同格式的条目"""
+    results = []
+    for session, index, score in hits:
+        if session not in store.sessions:
+            continue
+        messages = store.load_range(session, index, index + 1)
+        if not messages:
+            continue
+        message = messages[0]
+        results.append({
+            "session": session,
+            "index": index,
+            "role": message["role"],
+            "timestamp": message.get("timestamp") or "",
+            "snippet": make_snippet(message["content"], []),
+            "score": score
+        })
+    return results
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+结构化日志模块
+日志以 JSON 行的形式输出，每次对话请求带有请求 ID、会话名、模型、状态和耗时。
+调用方只把日志记录放入队列，格式化和写文件在后台线程中进行，不会阻塞请求或 Tk 事件循环；
+成功请求的记录可按 log_sample_rate 抽样，失败的请求总会记录。
+"""
+
+import datetime
+import json
+import logging
+import queue
+import random
+import sys
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+LOGGER_NAME = "deepseek"
+
+_listener = None
+_sample_rate = 1.0
+_request_logger = logging.getLogger(LOGGER_NAME + ".request")
+
+
+def get_logger(name):
+    """返回 deepseek 下的子日志记录器"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def new_request_id():
+    """生成请求 ID，用于在日志和消息记录之间对应同一次请求"""
+    return uuid.uuid4().hex[:16]
+
+
+class JSONFormatter(logging.Formatter):
+    """把日志记录格式化为一行 JSON，extra={"fields": {...}} 中的字段并入顶层"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RecordQueueHandler(QueueHandler):
+    """把日志记录放入队列，由监听线程格式化和输出"""
+
+    def prepare(self, record):
+        # 消息参数和异常在调用方线程中先转换为字符串，之后不再引用调用方的对象
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and record.exc_info[0] is not None:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(config):
+    """按配置设置日志输出
+
+    log_file 为空时输出到标准错误，但不输出每次请求的记录，以免与交互界面中的提示混在一起；
+    请求日志只写入 log_file。log_level 无效或 log_file 无法打开时退回默认设置并记录警告。
+    """
+    global _listener, _sample_rate
+    shutdown_logging()
+    _sample_rate = min(1.0, max(0.0, float(config.get("log_sample_rate", 1.0))))
+
+    problems = []
+    path = config.get("log_file") or ""
+    handler = None
+    if path:
+        try:
+            handler = logging.FileHandler(path, encoding="utf-8")
+        except OSError as e:
+            problems.append(f"无法打开日志文件 {path}: {e}")
+    if handler is None:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.addFilter(lambda record: record.name != _request_logger.name)
+    handler.setFormatter(JSONFormatter())
+
+    level = str(config.get("log_level") or "WARNING").upper()
+    if not isinstance(logging.getLevelName(level), int):
+        problems.append(f"无效的 log_level: {config.get('log_level')}，使用 WARNING")
+        level = "WARNING"
+
+    # 队列不设上限，写入方永远不会因日志输出慢而等待
+    log_queue = queue.SimpleQueue()
+
+    logger = logging.getLogger(LOGGER_NAME)
+    for old_handler in list(logger.handlers):
+        logger.removeHandler(old_handler)
+    logger.addHandler(RecordQueueHandler(log_queue))
+    logger.setLevel(level)
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, handler)
+    _listener.start()
+    for problem in problems:
+        get_logger("logging").warning(problem)
+
+
+def shutdown_logging():
+    """等待队列中的日志写完并关闭输出"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+def log_request(request_id, session, model, meta=None, error=None):
+    """记录一次对话请求的结果：成功为 INFO（按抽样率），失败为 WARNING（总会记录）"""
+    if error is None:
+        if not _request_logger.isEnabledFor(logging.INFO):
+            return
+        if _sample_rate < 1.0 and random.random() >= _sample_rate:
+            return
+        timing = meta.get("timing") or {}
+        fields = {
+            "request_id": request_id,
+            "session": session,
+            "model": model,
+            "status": "cached" if meta.get("cached") else "ok",
+            "latency_ms": timing.get("total"),
+            "ttfb_ms": timing.get("ttfb"),
+            "retries": meta.get("retries", 0)
+        }
+        if meta.get("usage"):
+            fields["usage"] = meta["usage"]
+        _request_logger.info("请求完成", extra={"fields": fields})
+        return
+
+    timing = (meta or {}).get("timing") or {}
+    fields = {
+        "request_id": request_id,
+        "session": session,
+        "model": model,
+        "status": getattr(error, "status_code", "network"),
+        "latency_ms": timing.get("total"),
+        "ttfb_ms": timing.get("ttfb"),
+        "retries": getattr(error, "retries", 0),
+        "error": str(error)
+    }
+    _request_logger.warning("请求失败", extra={"fields": fields})
+
+
+def log_retry(request_id, attempt, delay, error):
+    """记录一次重试（DEBUG 级别）"""
+    if _request_logger.isEnabledFor(logging.DEBUG):
+        _request_logger.debug("重试请求", extra={"fields": {
+            "request_id": request_id,
+            "attempt": attempt,
+            "delay_s": round(delay, 3),
+            "status": getattr(error, "status_code", "network"),
+            "error": str(error)
+        }})
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+"""
+全文搜索辅助模块
+FTS5 的 unicode61 分词器会把连续的汉字当作一个词，这里在建索引和查询时
+把每个中日韩字符单独成词，再用短语查询匹配相邻的字，任意长度的中文词都能搜到
+"""
+
+import unicodedata
+
+from token_counter import is_cjk
+
+
+def index_text(text):
+    """把文本转换为写入全文索引的形式（中日韩字符之间加空格）"""
+    return "".join(f" {ch} " if is_cjk(ch) else ch for ch in text)
+
+
+def query_terms(query):
+    """把搜索内容按空白拆分为关键词"""
+    return [term for term in query.split() if term]
+
+
+def is_token_char(ch):
+    """unicode61 分词器视为词内字符的字符（字母、数字、组合符号和私用区字符），其余都是分隔符"""
+    category = unicodedata.category(ch)
+    return category[0] in "LNM" or category == "Co"
+
+
+def fts_tokens(term):
+    """按 FTS5 的分词规则把关键词拆分为词，只含标点的关键词返回空列表"""
+    return index_text("".join(ch if is_token_char(ch) else " " for ch in term)).split()
+
+
+def match_query(query):
+    """生成 FTS5 MATCH 表达式：每个关键词作为短语，多个关键词须同时出现
+
+    分词后为空的关键词（如只有标点）被忽略；全部为空时返回空字符串。
+    """
+    phrases = []
+    for term in query_terms(query):
+        tokens = fts_tokens(term)
+        if tokens:
+            phrases.append('"' + " ".join(tokens) + '"')
+    return " ".join(phrases)
+
+
+def make_snippet(content, terms, width=40):
+    """截取第一个关键词附近的一段文本，用于显示搜索结果"""
+    lowered = content.lower()
+    position = -1
+    for term in terms:
+        position = lowered.find(term.lower())
+        if position >= 0:
+            break
+    start = max(0, position - width // 2) if position >= 0 else 0
+    snippet = content[start:start + width].replace("\n", " ")
+    if start > 0:
+        snippet = "…" + snippet
+    if start + width < len(content):
+        snippet += "…"
+    return snippet
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+Token 计数模块
+配置了 tokenizer_path 且安装了 tokenizers 时使用模型自带的分词器精确计数，
+否则按字符类别估算；计数结果缓存在消息记录的 tokens 字段中，每条消息只计算一次
+"""
+
+import math
+import os
+
+from structured_log import get_logger
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # 可选依赖，未安装时使用估算
+    Tokenizer = None
+
+# 每条消息在请求中额外占用的 token（角色标记、分隔符等）
+MESSAGE_OVERHEAD = 4
+
+_tokenizer = None
+
+logger = get_logger("token_counter")
+
+
+def load_tokenizer(path):
+    """加载分词器文件（如 DeepSeek 的 tokenizer.json），失败时退回估算"""
+    global _tokenizer
+    _tokenizer = None
+    if not path or Tokenizer is None:
+        return False
+    if not os.path.exists(path):
+        logger.warning("分词器文件不存在: %s", path)
+        return False
+    try:
+        _tokenizer = Tokenizer.from_file(path)
+    except Exception as e:
+        logger.warning("加载分词器失败: %s", e)
+        return False
+    return True
+
+
+def is_cjk(ch):
+    """判断字符是否为中日韩文字或全角标点"""
+    code = ord(ch)
+    return (
+        0x4E00 <= code <= 0x9FFF or
+        0x3400 <= code <= 0x4DBF or
+        0x3000 <= code <= 0x303F or
+        0xFF00 <= code <= 0xFFEF or
+        0x3040 <= code <= 0x30FF or
+        0xAC00 <= code <= 0xD7AF
+    )
+
+
+def estimate_tokens(text):
+    """估算文本的 token 数（约 1 个汉字 0.6 token，1 个英文字符 0.3 token）"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if is_cjk(ch))
+    return int(math.ceil(cjk * 0.6 + (len(text) - cjk) * 0.3))
+
+
+def count_tokens(text):
+    """计算文本的 token 数，有分词器时精确计数"""
+    if _tokenizer is not None:
+        return len(_tokenizer.encode(text, add_special_tokens=False).ids)
+    return estimate_tokens(text)
+
+
+def count_message(message):
+    """重新计算消息内容的 token 数并缓存到消息记录中（新建或编辑消息时调用）"""
+    message["tokens"] = count_tokens(message["content"])
+    return message
+
+
+def message_tokens(message):
+    """返回一条消息在请求中占用的 token 数，优先使用缓存的计数"""
+    tokens = message.get("tokens")
+    if tokens is None:
+        # 旧版本保存的消息没有计数，计算后缓存在内存中
+        tokens = message["tokens"] = count_tokens(message["content"])
+    return tokens + MESSAGE_OVERHEAD
+
+
+def session_tokens(messages):
+    """统计一个会话全部消息的 token 数"""
+    return sum(message_tokens(message) for message in messages)
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+"""
+单元测试，在项目根目录运行：python3 -m unittest
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
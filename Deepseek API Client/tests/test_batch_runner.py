@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""批量请求测试"""
+
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from api_client import APIError
+from batch_runner import BatchRunner, iter_prompts, load_finished, request_config, request_messages
+from session_store import SQLiteSessionStore
+
+CONFIG = {"model": "deepseek-chat", "temperature": 0.7, "max_tokens": 2048, "stream": True}
+
+
+class FakeAPI:
+    """按提问内容返回固定回复；内容为 "fail" 时返回 503"""
+
+    def __init__(self):
+        self.requests = []
+
+    async def chat(self, config, messages, session=None, use_cache=True):
+        self.requests.append((config, messages, session, use_cache))
+        await asyncio.sleep(0)
+        if messages[-1]["content"] == "fail":
+            raise APIError(503, "busy")
+        return {"content": "re: " + messages[-1]["content"], "meta": {"model": config["model"]}}
+
+
+class BatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def write_lines(self, name, lines):
+        with open(self.path(name), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        return self.path(name)
+
+    def read_records(self, name):
+        with open(self.path(name), encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+
+
+class IterPromptsTest(BatchTestCase):
+
+    def test_lines(self):
+        path = self.write_lines("in.jsonl", [
+            '"plain"',
+            '{"id": "a", "prompt": "x"}',
+            '',
+            '{"prompt": "no id"}',
+            'not json',
+            '[1, 2]',
+            '{"id": ["list"], "prompt": "x"}',
+            '{"id": true, "prompt": "x"}',
+            '{"id": 7, "prompt": "x"}',
+        ])
+        items = list(iter_prompts(path))
+        self.assertEqual([(item_id, item) for item_id, item, error in items[:3]],
+                         [(1, {"prompt": "plain"}), ("a", {"id": "a", "prompt": "x"}), (4, {"prompt": "no id"})])
+        self.assertEqual([(item_id, item is None, error is None) for item_id, item, error in items[3:]],
+                         [(5, True, False), (6, True, False), (7, True, False), (8, True, False), (7, False, True)])
+
+
+class LoadFinishedTest(BatchTestCase):
+
+    def test_missing_file(self):
+        self.assertEqual(load_finished(self.path("out.jsonl")), set())
+
+    def test_skips_errors_and_invalid_records(self):
+        path = self.write_lines("out.jsonl", [
+            '{"id": 1, "content": "ok"}',
+            '{"id": 2, "error": "busy"}',
+            '{"content": "no id"}',
+            '{"id": ["x"], "content": "bad id"}',
+            '[1]',
+            'garbage',
+            '{"id": "b", "content": "ok"}',
+        ])
+        self.assertEqual(load_finished(path), {1, "b"})
+
+    def test_truncates_partial_line(self):
+        path = self.path("out.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write('{"id": 1, "content": "ok"}\n{"id": 2, "cont')
+        self.assertEqual(load_finished(path), {1})
+        with open(path, encoding="utf-8") as f:
+            self.assertEqual(f.read(), '{"id": 1, "content": "ok"}\n')
+
+
+class RequestLineTest(unittest.TestCase):
+
+    def test_request_config(self):
+        config = request_config(CONFIG, {"model": "deepseek-reasoner", "params": {"temperature": 0, "api_key": "x"}})
+        self.assertEqual(config["model"], "deepseek-reasoner")
+        self.assertEqual(config["temperature"], 0)
+        self.assertFalse(config["stream"])
+        self.assertNotIn("api_key", config)
+        self.assertEqual(request_config(CONFIG, {"params": None})["temperature"], 0.7)
+        with self.assertRaises(ValueError):
+            request_config(CONFIG, {"params": 5})
+
+    def test_request_messages(self):
+        self.assertEqual(request_messages({"prompt": "hi"}), [{"role": "user", "content": "hi"}])
+        messages = [{"role": "system", "content": "s"}, {"role": "user", "content": "u"}]
+        self.assertEqual(request_messages({"messages": messages}), messages)
+        for item in ({"prompt": 5}, {"messages": "hi"}, {"messages": [{"role": "user"}]}, {"messages": [1]}):
+            with self.assertRaises(ValueError):
+                request_messages(item)
+
+
+class BatchRunnerTest(BatchTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = SQLiteSessionStore(self.path("sessions.db"), self.path("sessions.json"), self.path("journal.jsonl"))
+        self.store.load()
+        self.api = FakeAPI()
+
+    def tearDown(self):
+        self.store.close()
+        super().tearDown()
+
+    def run_batch(self, input_path, use_cache=True):
+        runner = BatchRunner(CONFIG, self.api, self.store, self.path("out.jsonl"), concurrency=4, use_cache=use_cache)
+        with contextlib.redirect_stderr(io.StringIO()):
+            return asyncio.run(runner.run(input_path))
+
+    def test_invalid_lines_do_not_stop_batch(self):
+        path = self.write_lines("in.jsonl", [
+            '{"id": "ok", "prompt": "hello"}',
+            '{"id": "params", "prompt": "x", "params": 5}',
+            '{"id": ["list"], "prompt": "x"}',
+            '{"id": "messages", "messages": "x"}',
+            '{"id": "session", "prompt": "x", "session": 1}',
+            '{"id": "fail", "prompt": "fail"}',
+            '"last"',
+        ])
+        counts = self.run_batch(path)
+        self.assertEqual(counts, {"done": 2, "failed": 5, "skipped": 0})
+        records = {str(record["id"]): record for record in self.read_records("out.jsonl")}
+        self.assertEqual(records["ok"]["content"], "re: hello")
+        self.assertEqual(records["7"]["content"], "re: last")
+        self.assertIn("params", records["params"]["error"])
+        self.assertIn("id", records["3"]["error"])
+        self.assertIn("503", records["fail"]["error"])
+
+    def test_resume_skips_finished(self):
+        path = self.write_lines("in.jsonl", ['{"id": 1, "prompt": "a"}', '{"id": 2, "prompt": "fail"}'])
+        self.run_batch(path)
+        counts = self.run_batch(path, use_cache=False)
+        self.assertEqual(counts, {"done": 0, "failed": 1, "skipped": 1})
+        self.assertEqual(len(self.api.requests), 3)
+        self.assertFalse(self.api.requests[-1][3])
+
+    def test_session_history(self):
+        path = self.write_lines("in.jsonl", [
+            '{"id": 1, "prompt": "first", "session": "s"}',
+            '{"id": 2, "prompt": "fail", "session": "s"}',
+            '{"id": 3, "prompt": "second", "session": "s"}',
+        ])
+        self.run_batch(path)
+        # 失败的条目不写入会话；同一会话的条目按顺序带上之前的历史
+        self.assertEqual([m["content"] for m in self.store.sessions["s"]], ["first", "re: first", "second", "re: second"])
+        self.assertEqual([m["content"] for m in self.api.requests[-1][1]], ["first", "re: first", "second"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""上下文裁剪测试"""
+
+import unittest
+
+from context_window import context_settings, load_history, split_turns, trim_history
+from token_counter import message_tokens
+
+
+def conversation(turns, length=20):
+    """生成 turns 轮对话，每轮一问一答，中间夹一条错误提示"""
+    messages = []
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"q{turn} " + "x" * length})
+        if turn % 3 == 0:
+            messages.append({"role": "system", "content": "请求失败"})
+        messages.append({"role": "assistant", "content": f"a{turn} " + "y" * length})
+    return messages
+
+
+class ContextSettingsTest(unittest.TestCase):
+
+    def test_session_override(self):
+        config = {
+            "context_max_turns": 10,
+            "context_max_tokens": 0,
+            "session_context": {"s1": {"context_max_turns": 2, "model": "ignored"}}
+        }
+        self.assertEqual(context_settings(config, "s1")["context_max_turns"], 2)
+        self.assertNotIn("model", context_settings(config, "s1"))
+        self.assertEqual(context_settings(config, "s2")["context_max_turns"], 10)
+
+
+class TrimHistoryTest(unittest.TestCase):
+
+    def test_split_turns(self):
+        messages = [{"role": "assistant", "content": "hi"}] + conversation(2)
+        turns = split_turns(messages)
+        self.assertEqual(len(turns), 3)
+        self.assertEqual(turns[0], messages[:1])
+
+    def test_unlimited(self):
+        messages = conversation(5)
+        kept, dropped = trim_history(messages, {})
+        self.assertEqual(kept, messages)
+        self.assertEqual(dropped, [])
+
+    def test_drop_errors(self):
+        kept, dropped = trim_history(conversation(4), {"context_drop_errors": True})
+        self.assertTrue(all(message["role"] != "system" for message in kept))
+        self.assertEqual(dropped, [])
+
+    def test_max_turns(self):
+        messages = conversation(5)
+        kept, dropped = trim_history(messages, {"context_max_turns": 2})
+        self.assertEqual(kept, [message for turn in split_turns(messages)[-2:] for message in turn])
+        self.assertEqual(dropped + kept, messages)
+
+    def test_max_tokens(self):
+        messages = conversation(10)
+        turn_tokens = sum(message_tokens(message) for message in messages[-2:])
+        kept, dropped = trim_history(messages, {"context_max_tokens": turn_tokens * 3})
+        self.assertLessEqual(sum(message_tokens(message) for message in kept), turn_tokens * 3)
+        self.assertEqual(dropped + kept, messages)
+        self.assertTrue(dropped)
+
+    def test_latest_turn_always_kept(self):
+        messages = conversation(3, length=1000)
+        kept, dropped = trim_history(messages, {"context_max_tokens": 1})
+        self.assertEqual(kept, messages[-2:])
+
+
+class LoadHistoryTest(unittest.TestCase):
+
+    def load(self, messages, config, page_size):
+        reads = []
+
+        def load_range(session, start, stop):
+            reads.append((start, stop))
+            return messages[start:stop]
+
+        history = load_history(config, "s", len(messages), load_range, page_size)
+        return history, reads
+
+    def test_same_result_as_full_history(self):
+        messages = conversation(200)
+        for settings in ({"context_max_turns": 3}, {"context_max_turns": 50},
+                         {"context_max_tokens": 500}, {"context_max_turns": 1000}):
+            for page_size in (1, 7, 200):
+                history, _ = self.load(messages, settings, page_size)
+                self.assertEqual(trim_history(history, settings)[0], trim_history(messages, settings)[0])
+
+    def test_reads_only_tail(self):
+        messages = conversation(2000)
+        history, reads = self.load(messages, {"context_max_turns": 5}, 200)
+        self.assertEqual(reads, [(len(messages) - 200, len(messages))])
+        self.assertEqual(history, messages[-200:])
+
+    def test_summary_reads_everything(self):
+        messages = conversation(50)
+        history, reads = self.load(messages, {"context_max_turns": 2, "context_summary": True}, 10)
+        self.assertEqual(history, messages)
+        self.assertEqual(reads, [(0, len(messages))])
+
+
+if __name__ == "__main__":
+    unittest.main()
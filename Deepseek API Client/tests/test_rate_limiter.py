@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""速率限制测试"""
+
+import asyncio
+import threading
+import time
+import unittest
+
+from rate_limiter import RateLimiter, TokenBucket, wait_async
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_reserve_within_budget(self):
+        bucket = TokenBucket(60)
+        now = bucket.updated_at
+        self.assertEqual(bucket.reserve(60, now), 0.0)
+
+    def test_reserve_over_budget_waits(self):
+        bucket = TokenBucket(60)
+        now = bucket.updated_at
+        bucket.reserve(60, now)
+        # 每秒补充 1 个令牌，再预约 3 个需要等 3 秒
+        self.assertAlmostEqual(bucket.reserve(3, now), 3.0)
+
+    def test_refill_is_capped(self):
+        bucket = TokenBucket(60)
+        now = bucket.updated_at
+        bucket.reserve(30, now)
+        bucket.refill(now + 3600)
+        self.assertEqual(bucket.tokens, 60)
+
+    def test_refund(self):
+        bucket = TokenBucket(60)
+        now = bucket.updated_at
+        bucket.reserve(100, now)
+        bucket.refund(40, now)
+        self.assertEqual(bucket.reserve(0, now), 0.0)
+        bucket.refund(1000, now)
+        self.assertEqual(bucket.tokens, 60)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_unlimited(self):
+        limiter = RateLimiter()
+        for _ in range(100):
+            self.assertEqual(limiter.reserve(10 ** 6), 0.0)
+
+    def test_rpm(self):
+        limiter = RateLimiter(rpm=2)
+        self.assertEqual(limiter.reserve(0), 0.0)
+        self.assertEqual(limiter.reserve(0), 0.0)
+        self.assertAlmostEqual(limiter.reserve(0), 30.0, delta=0.1)
+
+    def test_tpm_refund(self):
+        limiter = RateLimiter(tpm=600)
+        self.assertEqual(limiter.reserve(600), 0.0)
+        self.assertGreater(limiter.reserve(100), 0)
+        limiter.refund(100)
+        # 归还多预约的部分后，后续请求不必等待
+        limiter.refund(500)
+        self.assertEqual(limiter.reserve(100), 0.0)
+
+    def test_configure_keeps_bucket(self):
+        limiter = RateLimiter(tpm=600)
+        limiter.reserve(600)
+        bucket = limiter.token_bucket
+        limiter.configure(0, 600)
+        self.assertIs(limiter.token_bucket, bucket)
+        limiter.configure(0, 0)
+        self.assertIsNone(limiter.token_bucket)
+
+    def test_acquire_cancel_refunds(self):
+        limiter = RateLimiter(tpm=600)
+        limiter.reserve(600)
+        cancel_event = threading.Event()
+        threading.Timer(0.1, cancel_event.set).start()
+        started_at = time.monotonic()
+        self.assertFalse(limiter.acquire(300, cancel_event))
+        self.assertLess(time.monotonic() - started_at, 5)
+        self.assertEqual(limiter.queue_depth, 0)
+        # 被取消的请求归还了预约的额度
+        self.assertLess(limiter.token_bucket.tokens, 10)
+        self.assertGreater(limiter.token_bucket.tokens, -10)
+
+    def test_acquire_waits(self):
+        limiter = RateLimiter(rpm=600)
+        for _ in range(600):
+            limiter.reserve(0)
+        started_at = time.monotonic()
+        self.assertTrue(limiter.acquire(0))
+        self.assertGreater(time.monotonic() - started_at, 0.05)
+
+
+class AsyncWaitTest(unittest.TestCase):
+
+    def test_wait_async_completes(self):
+        started_at = time.monotonic()
+        self.assertFalse(asyncio.run(wait_async(0.1, threading.Event())))
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.1)
+
+    def test_wait_async_cancel(self):
+        cancel_event = threading.Event()
+        threading.Timer(0.1, cancel_event.set).start()
+        started_at = time.monotonic()
+        self.assertTrue(asyncio.run(wait_async(30, cancel_event)))
+        self.assertLess(time.monotonic() - started_at, 5)
+
+    def test_acquire_async_cancel_refunds(self):
+        limiter = RateLimiter(rpm=1)
+        limiter.reserve(0)
+        cancel_event = threading.Event()
+        threading.Timer(0.1, cancel_event.set).start()
+        self.assertFalse(asyncio.run(limiter.acquire_async(0, cancel_event)))
+        self.assertEqual(limiter.queue_depth, 0)
+        self.assertGreaterEqual(limiter.request_bucket.tokens, -0.01)
+
+    def test_acquire_async_task_cancel_refunds(self):
+        limiter = RateLimiter(rpm=1)
+        limiter.reserve(0)
+
+        async def run():
+            task = asyncio.ensure_future(limiter.acquire_async(0))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run())
+        self.assertEqual(limiter.queue_depth, 0)
+        self.assertGreaterEqual(limiter.request_bucket.tokens, -0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
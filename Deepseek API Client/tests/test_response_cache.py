@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""响应缓存测试"""
+
+import os
+import tempfile
+import time
+import unittest
+
+from response_cache import ResponseCache, request_key
+
+REQUEST = {
+    "model": "deepseek-chat",
+    "messages": [{"role": "user", "content": "你好"}],
+    "temperature": 0.7,
+    "stream": False
+}
+
+
+class RequestKeyTest(unittest.TestCase):
+
+    def test_ignores_stream_and_key_order(self):
+        reordered = dict(reversed(list(REQUEST.items())), stream=True)
+        self.assertEqual(request_key(REQUEST), request_key(reordered))
+
+    def test_depends_on_request(self):
+        self.assertNotEqual(request_key(REQUEST), request_key(dict(REQUEST, temperature=0.8)))
+
+    def test_scoped_to_endpoint_and_account(self):
+        key = request_key(REQUEST, "https://api.deepseek.com/v1/chat/completions", "sk-a")
+        self.assertNotEqual(key, request_key(REQUEST))
+        self.assertNotEqual(key, request_key(REQUEST, "http://127.0.0.1:8001/v1/chat/completions", "sk-a"))
+        self.assertNotEqual(key, request_key(REQUEST, "https://api.deepseek.com/v1/chat/completions", "sk-b"))
+        self.assertEqual(key, request_key(dict(REQUEST, stream=True), "https://api.deepseek.com/v1/chat/completions", "sk-a"))
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = ResponseCache(os.path.join(self.directory.name, "cache.db"))
+
+    def tearDown(self):
+        self.cache.close()
+        self.directory.cleanup()
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get("k"))
+        self.cache.put("k", "回复")
+        self.assertEqual(self.cache.get("k"), "回复")
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "entries": 1})
+
+    def test_persists(self):
+        self.cache.put("k", "回复")
+        self.cache.close()
+        self.cache = ResponseCache(self.cache.path)
+        self.assertEqual(self.cache.get("k"), "回复")
+
+    def test_ttl(self):
+        self.cache.ttl = 60
+        self.cache.put("k", "回复")
+        with self.cache.conn:
+            self.cache.conn.execute("UPDATE responses SET created_at = ?", (time.time() - 120,))
+        self.assertIsNone(self.cache.get("k"))
+        self.assertEqual(self.cache.stats()["entries"], 0)
+
+    def test_lru_eviction(self):
+        self.cache.max_entries = 2
+        self.cache.put("a", "1")
+        self.cache.put("b", "2")
+        with self.cache.conn:
+            self.cache.conn.execute("UPDATE responses SET last_access = last_access - 10 WHERE key = 'a'")
+            self.cache.conn.execute("UPDATE responses SET last_access = last_access - 20 WHERE key = 'b'")
+        # a 比 b 更近被访问，写入 c 时淘汰 b
+        self.cache.get("a")
+        self.cache.put("c", "3")
+        self.assertEqual(self.cache.get("a"), "1")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("c"), "3")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""重试策略测试"""
+
+import email.utils
+import time
+import unittest
+
+import requests
+
+from api_client import APIError
+from retry_policy import RetryPolicy, is_retryable, parse_retry_after
+
+
+class ParseRetryAfterTest(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(parse_retry_after("5"), 5.0)
+        self.assertEqual(parse_retry_after(" 0 "), 0.0)
+
+    def test_http_date(self):
+        value = email.utils.formatdate(time.time() + 30, usegmt=True)
+        self.assertAlmostEqual(parse_retry_after(value), 30, delta=2)
+
+    def test_past_date_is_zero(self):
+        value = email.utils.formatdate(time.time() - 30, usegmt=True)
+        self.assertEqual(parse_retry_after(value), 0.0)
+
+    def test_invalid(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after(""))
+        self.assertIsNone(parse_retry_after("soon"))
+
+
+class IsRetryableTest(unittest.TestCase):
+
+    def test_status_codes(self):
+        for status in (408, 429, 500, 502, 503, 504):
+            self.assertTrue(is_retryable(APIError(status, "")), status)
+        for status in (400, 401, 402, 404, 422):
+            self.assertFalse(is_retryable(APIError(status, "")), status)
+
+    def test_network_errors(self):
+        self.assertTrue(is_retryable(requests.ConnectionError()))
+        self.assertTrue(is_retryable(requests.Timeout()))
+        self.assertFalse(is_retryable(ValueError()))
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_max_retries(self):
+        policy = RetryPolicy(max_retries=2)
+        error = APIError(503, "busy")
+        self.assertTrue(policy.should_retry(error, 0))
+        self.assertTrue(policy.should_retry(error, 1))
+        self.assertFalse(policy.should_retry(error, 2))
+        self.assertFalse(RetryPolicy(max_retries=0).should_retry(error, 0))
+
+    def test_not_retryable(self):
+        self.assertFalse(RetryPolicy().should_retry(APIError(401, "unauthorized"), 0))
+
+    def test_retry_after_is_capped(self):
+        policy = RetryPolicy(backoff_max=10)
+        self.assertEqual(policy.delay(APIError(429, "", retry_after=3), 0), 3)
+        self.assertEqual(policy.delay(APIError(429, "", retry_after=60), 0), 10)
+
+    def test_backoff_bounds(self):
+        policy = RetryPolicy(backoff_base=1.0, backoff_max=5.0)
+        error = APIError(503, "")
+        for retries, upper in ((0, 1.0), (1, 2.0), (2, 4.0), (3, 5.0), (10, 5.0)):
+            for _ in range(50):
+                self.assertTrue(0 <= policy.delay(error, retries) <= upper)
+
+    def test_from_config(self):
+        policy = RetryPolicy.from_config({"max_retries": -1, "retry_backoff_base": "0.5", "retry_backoff_max": 8})
+        self.assertEqual(policy.max_retries, 0)
+        self.assertEqual(policy.backoff_base, 0.5)
+        self.assertEqual(policy.backoff_max, 8.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
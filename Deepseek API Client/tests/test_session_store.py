@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""会话存储与迁移测试"""
+
+import json
+import os
+import tempfile
+import unittest
+
+from session_store import JournalSessionStore, SessionStoreError, SQLiteSessionStore
+from token_counter import session_tokens
+
+
+def message(role, content):
+    return {"role": role, "content": content, "timestamp": "2024-01-01 12:00:00"}
+
+
+class StoreTestMixin:
+    """两种存储后端共用的测试，子类实现 open_store"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = self.open_store()
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def reopen(self):
+        self.store.close()
+        self.store = self.open_store()
+        return self.store
+
+    def fill(self):
+        self.store.create_session("s1")
+        self.store.append_message("s1", message("user", "你好"))
+        self.store.append_message("s1", message("assistant", "你好，有什么可以帮你？"))
+        self.store.append_message("s1", message("user", "介绍一下 SQLite"))
+        self.store.create_session("s2")
+        self.store.append_message("s2", message("user", "hello"))
+
+    def test_round_trip(self):
+        self.fill()
+        sessions = self.reopen().sessions
+        self.assertEqual(sorted(sessions), ["s1", "s2"])
+        self.assertEqual([m["content"] for m in sessions["s1"]], ["你好", "你好，有什么可以帮你？", "介绍一下 SQLite"])
+        self.assertEqual(sessions["s1"][0]["timestamp"], "2024-01-01 12:00:00")
+
+    def test_update_and_delete(self):
+        self.fill()
+        self.store.update_message("s1", 1, message("assistant", "改过的回复"))
+        self.store.delete_message("s1", 0)
+        self.store.delete_session("s2")
+        sessions = self.reopen().sessions
+        self.assertEqual(list(sessions), ["s1"])
+        self.assertEqual([m["content"] for m in sessions["s1"]], ["改过的回复", "介绍一下 SQLite"])
+
+    def test_session_info_tokens(self):
+        self.fill()
+        self.store.update_message("s1", 1, message("assistant", "短"))
+        self.store.delete_message("s1", 0)
+        for store in (self.store, self.reopen()):
+            info = store.session_info("s1")
+            self.assertEqual(info["count"], 2)
+            expected = session_tokens([dict(m) for m in store.load_range("s1", 0, info["count"])])
+            self.assertEqual(info["tokens"], expected)
+
+    def test_load_range(self):
+        self.fill()
+        self.reopen()
+        self.assertEqual([m["content"] for m in self.store.load_range("s1", 1, 3)],
+                         ["你好，有什么可以帮你？", "介绍一下 SQLite"])
+        self.assertEqual(self.store.load_range("s1", 5, 10), [])
+
+    def test_search(self):
+        self.fill()
+        results = self.store.search("SQLite")
+        self.assertEqual([(r["session"], r["index"]) for r in results], [("s1", 2)])
+        self.assertEqual(self.store.search(""), [])
+        self.assertEqual(self.store.search("不存在的内容"), [])
+
+    def test_reader_versions(self):
+        self.fill()
+        before = self.store.open_reader()
+        self.store.append_message("s1", message("assistant", "新的回复"))
+        after = self.store.open_reader()
+        self.assertNotEqual(before.session_versions()["s1"], after.session_versions()["s1"])
+        self.assertEqual(before.session_versions()["s2"], after.session_versions()["s2"])
+        self.assertEqual(len(after.load_messages("s1")), 4)
+        before.close()
+        after.close()
+
+
+class JournalSessionStoreTest(StoreTestMixin, unittest.TestCase):
+
+    def open_store(self, compact_threshold=1000):
+        store = JournalSessionStore(self.path("sessions.json"), self.path("sessions.journal.jsonl"), compact_threshold)
+        store.load()
+        return store
+
+    def test_truncated_tail_is_ignored(self):
+        self.fill()
+        self.store.close()
+        with open(self.path("sessions.journal.jsonl"), "a", encoding="utf-8") as f:
+            f.write('{"op": "append", "session": "s2", "mess')
+        self.store = self.open_store()
+        self.assertEqual(len(self.store.sessions["s2"]), 1)
+        # 截掉损坏的尾部后，新的事件能正常追加
+        self.store.append_message("s2", message("assistant", "hi"))
+        self.assertEqual(len(self.reopen().sessions["s2"]), 2)
+
+    def test_compaction(self):
+        self.store.close()
+        self.store = self.open_store(compact_threshold=3)
+        self.fill()
+        with open(self.path("sessions.json"), encoding="utf-8") as f:
+            self.assertIn("s1", json.load(f))
+        self.assertEqual(len(self.reopen().sessions["s1"]), 3)
+
+    def test_stale_journal_is_ignored(self):
+        self.fill()
+        self.store.compact()
+        self.store.close()
+        # 模拟压缩时替换快照后、替换日志前崩溃：旧日志的哈希与新快照不符
+        with open(self.path("sessions.journal.jsonl"), "w", encoding="utf-8") as f:
+            f.write(json.dumps({"op": "header", "snapshot": "old"}) + "\n")
+            f.write(json.dumps({"op": "append", "session": "s2", "message": message("user", "重复")}) + "\n")
+        self.store = self.open_store()
+        self.assertEqual(len(self.store.sessions["s2"]), 1)
+
+    def test_versions_stable_across_reload(self):
+        self.fill()
+        versions = self.store.open_reader().session_versions()
+        self.assertEqual(self.reopen().open_reader().session_versions(), versions)
+
+
+class SQLiteSessionStoreTest(StoreTestMixin, unittest.TestCase):
+
+    def open_store(self):
+        store = SQLiteSessionStore(self.path("sessions.db"), self.path("sessions.json"),
+                                   self.path("sessions.journal.jsonl"), cache_size=1)
+        store.load()
+        return store
+
+    def test_lazy_loading(self):
+        self.fill()
+        self.reopen()
+        self.assertIsNone(self.store.sessions.cached("s1"))
+        self.assertEqual(self.store.session_info("s1")["count"], 3)
+        self.assertEqual(len(self.store.sessions["s1"]), 3)
+        # 缓存容量为 1，打开另一个会话后前一个被换出
+        self.store.sessions["s2"]
+        self.assertIsNone(self.store.sessions.cached("s1"))
+
+    def test_cjk_search(self):
+        self.fill()
+        self.assertEqual([r["index"] for r in self.store.search("有什么")], [1])
+        self.assertEqual(self.store.search("? !!"), [])
+        self.assertEqual(self.store.search('"'), [])
+
+    def test_open_failure(self):
+        self.store.close()
+        os.makedirs(self.path("broken.db"))
+        store = SQLiteSessionStore(self.path("broken.db"), self.path("none.json"), self.path("none.jsonl"))
+        with self.assertRaises(SessionStoreError):
+            store.load()
+        self.assertIsNone(store.conn)
+
+
+class MigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def test_migrates_snapshot_and_journal(self):
+        legacy = JournalSessionStore(self.path("sessions.json"), self.path("sessions.journal.jsonl"))
+        legacy.load()
+        legacy.create_session("旧会话")
+        legacy.append_message("旧会话", message("user", "第一条"))
+        legacy.compact()
+        # 压缩后的修改只在日志中
+        legacy.append_message("旧会话", dict(message("assistant", "第二条"), model="deepseek-chat"))
+        legacy.close()
+
+        store = SQLiteSessionStore(self.path("sessions.db"), self.path("sessions.json"), self.path("sessions.journal.jsonl"))
+        store.load()
+        messages = store.sessions["旧会话"]
+        self.assertEqual([m["content"] for m in messages], ["第一条", "第二条"])
+        self.assertEqual(messages[1]["model"], "deepseek-chat")
+        self.assertEqual(store.session_info("旧会话")["tokens"], session_tokens(messages))
+        self.assertEqual([r["index"] for r in store.search("第二")], [1])
+
+        # 只迁移一次：之后删除的会话不会被重新导入
+        store.delete_session("旧会话")
+        store.close()
+        store = SQLiteSessionStore(self.path("sessions.db"), self.path("sessions.json"), self.path("sessions.journal.jsonl"))
+        self.assertEqual(list(store.load()), [])
+        store.close()
+
+    def test_no_legacy_data(self):
+        store = SQLiteSessionStore(self.path("sessions.db"), self.path("sessions.json"), self.path("sessions.journal.jsonl"))
+        self.assertEqual(list(store.load()), [])
+        store.close()
+        self.assertFalse(os.path.exists(self.path("sessions.journal.jsonl")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""全文搜索查询测试"""
+
+import unittest
+
+from text_search import fts_tokens, index_text, make_snippet, match_query, query_terms
+
+
+class FTSQueryTest(unittest.TestCase):
+
+    def test_index_text_splits_cjk(self):
+        self.assertEqual(index_text("用Python").split(), ["用", "Python"])
+
+    def test_query_terms(self):
+        self.assertEqual(query_terms("  a  b\tc "), ["a", "b", "c"])
+
+    def test_fts_tokens(self):
+        self.assertEqual(fts_tokens("数据库"), ["数", "据", "库"])
+        self.assertEqual(fts_tokens("c++"), ["c"])
+        self.assertEqual(fts_tokens("foo-bar"), ["foo", "bar"])
+        self.assertEqual(fts_tokens("..."), [])
+
+    def test_match_query(self):
+        self.assertEqual(match_query("数据库 index"), '"数 据 库" "index"')
+        self.assertEqual(match_query('say "hi"'), '"say" "hi"')
+
+    def test_match_query_drops_punctuation_terms(self):
+        self.assertEqual(match_query("python ? !!"), '"python"')
+        self.assertEqual(match_query("? ()"), "")
+        self.assertEqual(match_query(""), "")
+
+    def test_make_snippet(self):
+        content = "a" * 100 + "关键词" + "b" * 100
+        snippet = make_snippet(content, ["关键词"], width=20)
+        self.assertIn("关键词", snippet)
+        self.assertTrue(snippet.startswith("…"))
+        self.assertTrue(snippet.endswith("…"))
+
+
+if __name__ == "__main__":
+    unittest.main()